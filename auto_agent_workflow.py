@@ -97,6 +97,7 @@ def process_single_dataset(dataset_id, n_genes, n_samples):
     
     logging.info(f"[{dataset_id}] 跑差异表达式 (DEA)...")
     pipeline.run_dea()
+    pipeline.run_threshold_sweep()
     pipeline.run_deg_heatmap()
     time.sleep(2)
     
@@ -135,6 +135,91 @@ def load_config():
 if "chat_history" not in st.session_state: st.session_state.chat_history = []
 if "analyzing" not in st.session_state: st.session_state.analyzing = False
 
+# --- PIPELINE REGISTRY (incremental threshold re-evaluation) ---
+def pipeline_registry():
+    """
+    会话级注册表：保存本会话最近一次完成 DEA 统计阶段的 pipeline，阈值变化时复用，无需重新下载/归一化/检验。
+    放在 st.session_state 而非 st.cache_resource，避免不同用户的滑块互相触发重算；
+    返回的是普通 dict，后台线程通过闭包直接写入，不访问 session_state。
+    """
+    if "pipeline_registry" not in st.session_state:
+        st.session_state.pipeline_registry = {}
+    return st.session_state.pipeline_registry
+
+# 与 p/FC 阈值无关的图：阈值增量重算时保留，不删除也不重绘
+THRESHOLD_INDEPENDENT_FIGS = ("Fig1_PCA", "Fig6a_Cox_Screen", "Fig7e_GSEA_", "Fig7f_GSEA_", "Fig7g_GSEA_", "Fig7h_GSEA_",
+                              "Fig7i_Pathway_Activity")
+
+def run_threshold_independent_steps(pipeline):
+    """只依赖 DEA 统计量/表达矩阵、与阈值无关的步骤：每个数据集只跑一次。"""
+    add_log("🧭 计算单样本通路活性评分 (ssGSEA)...")
+    pipeline.run_pathway_scores()
+
+    add_log("⏳ 全基因组单因素 Cox 预后筛选...")
+    pipeline.run_cox_screen()
+
+    add_log("📊 执行全基因排序 GSEA 通路富集分析...")
+    pipeline.run_gsea()
+
+def run_downstream_steps(pipeline, p_thresh, fc_thresh, p_type, rethreshold=False):
+    """
+    所有依赖 sig_genes 的步骤：火山图、热图、ML、生存、富集与报告。
+    rethreshold=True (滑块增量重算) 时 ML 只做单次划分的 RF + L1，跳过超参搜索、嵌套 CV 与稳定性选择。
+    """
+    add_log(f"📊 执行差异表达分析 (DEA) [P<{p_thresh}, FC>{fc_thresh}]...")
+    pipeline.run_dea(p_thresh=p_thresh, fc_thresh=fc_thresh, p_type=p_type)
+
+    add_log("🎚️ 扫描 p × FC 阈值网格的 DEG 数量敏感性...")
+    pipeline.run_threshold_sweep(p_type=p_type)
+    
+    add_log("🔥 正在生成差异基因表达热图 (Heatmap)...")
+    pipeline.run_deg_heatmap()
+    
+    add_log("🧬 执行机器学习特征筛选 (Random Forest)...")
+    if rethreshold:
+        pipeline.run_advanced_ml(nested_cv=False, tune=False, stability=False)
+    else:
+        pipeline.run_advanced_ml()
+    
+    add_log("🧮 构建 LASSO-Cox 多基因预后风险模型...")
+    pipeline.run_survival_model()
+
+    add_log("📈 拟合 Kaplan-Meier 临床生存曲线...")
+    pipeline.run_survival()
+    
+    add_log("🧬 执行功能富集分析 (GO/KEGG)...")
+    pipeline.run_enrichment()
+    
+    add_log("📝 正在撰写自动化生信综合分析报告...")
+    pipeline.generate_report()
+
+def trigger_rethreshold(entry, p_thresh, fc_thresh, p_type):
+    """阈值增量重算：同步完成 Sig 分类 (亚秒级)，下游步骤在后台线程中重跑。"""
+    pipeline = entry["pipeline"]
+    st.session_state.analyzing = True
+    hard_reset_log()
+    t0 = time.perf_counter()
+    pipeline.classify_degs(p_thresh=p_thresh, fc_thresh=fc_thresh, p_type=p_type)
+    add_log(f"⚡ 阈值增量重算 ({entry['gse']}): {p_type}<{p_thresh}, |log2FC|>{fc_thresh} -> {len(pipeline.sig_genes)} 个显著基因 ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+    # 清理依赖旧阈值的图，仅保留与阈值无关的图 (PCA、Cox 筛选等)
+    for img in list(pipeline.report_images):
+        if not img["path"].startswith(THRESHOLD_INDEPENDENT_FIGS):
+            try: os.remove(os.path.join(pipeline.out_dir, img["path"]))
+            except OSError: pass
+    pipeline.report_images = [img for img in pipeline.report_images if img["path"].startswith(THRESHOLD_INDEPENDENT_FIGS)]
+
+    def background_rethreshold():
+        try:
+            run_downstream_steps(pipeline, p_thresh, fc_thresh, p_type, rethreshold=True)
+            add_log("[DONE] 阈值增量重算完成。结果已进入可视化看板。")
+        except Exception as e:
+            add_log(f"[ERROR] 运行中断: {str(e)}", "ERROR")
+
+    thread = threading.Thread(target=background_rethreshold)
+    thread.daemon = True
+    thread.start()
+
 def main():
     cfg = load_config()
     
@@ -159,6 +244,14 @@ def main():
         p_val = st.slider("p-value 阈值", 0.0, 0.5, 0.05, 0.01)
         fc_val = st.slider("log2FC (倍数) 阈值", 0.0, 5.0, 1.0, 0.1)
         p_type = st.selectbox("p-value 类型", ["padj", "pvalue"], index=0, help="推荐使用 padj (FDR 校正后的 p 值)")
+        auto_rethreshold = st.toggle("⚡ 阈值变更自动增量重算", value=True, help="复用已缓存的差异统计量，仅重跑 Sig 分类及依赖显著基因的下游步骤。")
+        
+        registry = pipeline_registry()
+        active = registry.get("active")
+        if active and auto_rethreshold and not st.session_state.analyzing \
+                and active["pipeline"]._dea_thresholds not in (None, (p_val, fc_val, p_type)):
+            trigger_rethreshold(active, p_val, fc_val, p_type)
+            st.rerun()
         
         st.markdown("---")
         if os.getenv("OPENCLAW_IS_DESKTOP"): st.success("💻 Local Desktop Node")
@@ -179,7 +272,14 @@ def main():
             use_soft = st.toggle("🔍 深度临床挖掘 (拉取 SOFT 文件)", value=False, help="开启后将下载完整 SOFT 家族包，耗时增加但可提取分期、突变、年龄等极细粒度标签。")
             
             def trigger_analysis(input_txt, is_nl=False, p_thresh=0.05, fc_thresh=1.0, p_type='padj', use_soft=False):
+                # 同一数据集仅阈值变化：走增量路径
+                active = registry.get("active")
+                if active and not is_nl and input_txt.strip().upper().split()[:1] == [active["gse"]] and active["use_soft"] == use_soft:
+                    trigger_rethreshold(active, p_thresh, fc_thresh, p_type)
+                    return
+
                 st.session_state.analyzing = True
+                registry.pop("active", None)
                 hard_reset_log()
                 add_log(f"任务启动指令收到: {input_txt}")
                 
@@ -213,23 +313,12 @@ def main():
                         add_log("🚀 启动自动化分析矩阵: 正在执行归一化与 PCA...")
                         pipeline.run_pre_processing(custom_counts=counts, custom_meta=meta)
                         
-                        add_log(f"📊 执行差异表达分析 (DEA) [P<{p_thresh}, FC>{fc_thresh}]...")
-                        pipeline.run_dea(p_thresh=p_thresh, fc_thresh=fc_thresh, p_type=p_type)
-                        
-                        add_log("🔥 正在生成差异基因表达热图 (Heatmap)...")
-                        pipeline.run_deg_heatmap()
-                        
-                        add_log("🧬 执行机器学习特征筛选 (Random Forest)...")
-                        pipeline.run_advanced_ml()
-                        
-                        add_log("📈 拟合 Kaplan-Meier 临床生存曲线...")
-                        pipeline.run_survival()
-                        
-                        add_log("🧬 执行功能富集分析 (GO/KEGG)...")
-                        pipeline.run_enrichment()
+                        add_log("🧮 计算差异统计量 (向量化 t 检验 + FDR，结果缓存供阈值调整复用)...")
+                        pipeline.compute_dea_stats()
+                        run_threshold_independent_steps(pipeline)
+                        registry["active"] = {"gse": target_gse, "use_soft": use_soft, "pipeline": pipeline}
                         
-                        add_log("📝 正在撰写自动化生信综合分析报告...")
-                        pipeline.generate_report()
+                        run_downstream_steps(pipeline, p_thresh, fc_thresh, p_type)
                         
                         add_log("[DONE] 任务大功告成。结果已进入可视化看板。")
                     except Exception as e:
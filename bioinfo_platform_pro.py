@@ -8,6 +8,7 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_curve, auc
 from lifelines import KaplanMeierFitter, CoxPHFitter
+from volcano_renderer import render_volcano
 import os
 
 # ==========================================
@@ -79,21 +80,11 @@ def plot_volcano_pro(res_df):
     res_df.loc[(res_df['log2FC'] > 1) & (res_df['padj'] < 0.05), 'Significance'] = 'Up'
     res_df.loc[(res_df['log2FC'] < -1) & (res_df['padj'] < 0.05), 'Significance'] = 'Down'
     
-    sns.scatterplot(
-        data=res_df, x='log2FC', y=-np.log10(res_df['pvalue']),
-        hue='Significance', hue_order=['Down', 'NS', 'Up'],
-        palette={'Up': '#E64B35', 'Down': '#4DBBD5', 'NS': '#999999'},
-        s=40, alpha=0.7, edgecolor='none'
-    )
-    
-    plt.axvline(1, color='gray', linestyle='--', linewidth=0.8)
-    plt.axvline(-1, color='gray', linestyle='--', linewidth=0.8)
-    plt.axhline(-np.log10(0.05), color='gray', linestyle='--', linewidth=0.8)
+    render_volcano(res_df, p_col='pvalue', sig_col='Significance', p_thresh=0.05, fc_thresh=1)
     
     plt.title('Differential Expression Profile', fontweight='bold')
     plt.xlabel('log2(Fold Change)')
     plt.ylabel('-log10(adj P-value)')
-    plt.legend(frameon=False, loc='upper right')
     plt.savefig('Fig1_Volcano_Journal.png')
     plt.close()
 
@@ -0,0 +1,388 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# WGCNA 标准模块配色 (按模块大小降序分配，grey = 未分配)
+WGCNA_COLORS = [
+    "turquoise", "blue", "brown", "yellow", "green", "red", "black", "pink", "magenta", "purple",
+    "greenyellow", "tan", "salmon", "cyan", "midnightblue", "lightcyan", "grey60", "lightgreen",
+    "lightyellow", "royalblue", "darkred", "darkgreen", "darkturquoise", "darkgrey", "orange",
+    "darkorange", "white", "skyblue", "saddlebrown", "steelblue",
+]
+
+# dynamicTreeCut 的 deepSplit -> maxCoreScatter 对照表 (minGap = (1 - maxCoreScatter) * 3/4)
+_DEEP_SPLIT_CORE_SCATTER = [0.64, 0.73, 0.82, 0.91, 0.95]
+
+
+def _standardize_columns(X):
+    """Column-standardize a samples × genes matrix so that Z.T @ Z is the Pearson correlation (float32)."""
+    X = np.asarray(X, dtype=np.float32)
+    Z = X - X.mean(axis=0, keepdims=True)
+    norm = np.sqrt((Z ** 2).sum(axis=0, keepdims=True))
+    Z /= np.where(norm > 0, norm, 1.0)
+    return Z
+
+
+def scale_free_fit(connectivity, n_bins=10):
+    """
+    Vectorized scale-free topology fit for several powers at once.
+    connectivity: (n_powers, n_genes). Returns (signed R^2, slope, mean connectivity) per power.
+    """
+    k = np.asarray(connectivity, dtype=float)
+    n_pow = k.shape[0]
+    kmax = k.max(axis=1, keepdims=True)
+    kmin = k.min(axis=1, keepdims=True)
+    # Equal-width bins per power (same as WGCNA's cut(k, nBreaks)), computed for all powers in one shot
+    width = np.where(kmax > kmin, (kmax - kmin) / n_bins, 1.0)
+    bins = np.clip(((k - kmin) / width).astype(int), 0, n_bins - 1)
+    flat = bins + np.arange(n_pow)[:, None] * n_bins
+    counts = np.bincount(flat.ravel(), minlength=n_pow * n_bins).reshape(n_pow, n_bins)
+    ksum = np.bincount(flat.ravel(), weights=k.ravel(), minlength=n_pow * n_bins).reshape(n_pow, n_bins)
+
+    valid = counts > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_k = np.log10(np.where(valid, ksum / np.maximum(counts, 1), 1.0) + 1e-9)
+        log_p = np.log10(np.where(valid, counts / k.shape[1], 1.0) + 1e-9)
+        w = valid.astype(float)
+        n = w.sum(axis=1)
+        mx = (w * log_k).sum(axis=1) / n
+        my = (w * log_p).sum(axis=1) / n
+        sxy = (w * (log_k - mx[:, None]) * (log_p - my[:, None])).sum(axis=1)
+        sxx = (w * (log_k - mx[:, None]) ** 2).sum(axis=1)
+        syy = (w * (log_p - my[:, None]) ** 2).sum(axis=1)
+        slope = sxy / sxx
+        r2 = sxy ** 2 / (sxx * syy)
+    signed_r2 = np.nan_to_num(-np.sign(slope) * r2)
+    return signed_r2, np.nan_to_num(slope), k.mean(axis=1)
+
+
+def pick_soft_threshold(X, powers=range(1, 21), r2_cut=0.85, block_size=2000, cor_path=None):
+    """
+    Soft-threshold power selection (unsigned network).
+    Correlation is computed in gene blocks with float32 matmuls; per-power connectivities are
+    accumulated block by block. If cor_path is given, |cor| is also written to a memmap there
+    so that the adjacency step can reuse it without recomputation.
+    Returns (power, fit_table, cor_memmap_or_None); falls back to the WGCNA FAQ sample-size
+    recommendation when no power reaches r2_cut.
+    """
+    powers = np.asarray(sorted(powers))
+    Z = _standardize_columns(X)
+    n_genes = Z.shape[1]
+    conn = np.zeros((len(powers), n_genes), dtype=np.float64)
+    cor_mm = np.lib.format.open_memmap(cor_path, mode='w+', dtype=np.float32, shape=(n_genes, n_genes)) if cor_path else None
+
+    for start in range(0, n_genes, block_size):
+        stop = min(start + block_size, n_genes)
+        a = np.abs(Z[:, start:stop].T @ Z)
+        a[np.arange(stop - start), np.arange(start, stop)] = 0.0
+        if cor_mm is not None:
+            cor_mm[start:stop] = a
+        # Incremental powers: a^p from a^(p_prev)
+        ap = np.ones_like(a)
+        prev = 0
+        for i, pw in enumerate(powers):
+            ap *= a ** (pw - prev)
+            prev = pw
+            conn[i, start:stop] = ap.sum(axis=1)
+
+    signed_r2, slope, mean_k = scale_free_fit(conn)
+    fit = pd.DataFrame({'Power': powers, 'SFT.R.sq': signed_r2, 'slope': slope, 'mean.k': mean_k,
+                        'median.k': np.median(conn, axis=1), 'max.k': conn.max(axis=1)})
+    hits = np.where(signed_r2 >= r2_cut)[0]
+    if len(hits):
+        power = int(powers[hits[0]])
+    else:
+        # WGCNA FAQ fallback for unsigned networks when no power reaches the scale-free cut
+        n_samples = Z.shape[0]
+        power = 9 if n_samples < 20 else 8 if n_samples < 30 else 7 if n_samples < 40 else 6
+    if cor_mm is not None:
+        cor_mm.flush()
+    return power, fit, cor_mm
+
+
+def blockwise_tom(abs_cor, power, workdir, block_size=2000):
+    """
+    Adjacency (|cor|^power) and topological overlap computed in gene blocks with float32 matmuls.
+    abs_cor: (n, n) float32 |cor| memmap with zero diagonal; it is raised to `power` in place and
+    becomes the adjacency. TOM dissimilarity is written to a second memmap in workdir, so resident
+    memory is bounded by block_size × n_genes. Returns (dissTOM memmap, connectivity).
+    """
+    n = abs_cor.shape[0]
+    adj = abs_cor
+    k = np.zeros(n, dtype=np.float64)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        blk = np.power(np.asarray(adj[start:stop]), power)
+        adj[start:stop] = blk
+        k[start:stop] = blk.sum(axis=1)
+    if hasattr(adj, 'flush'):
+        adj.flush()
+
+    diss = np.lib.format.open_memmap(os.path.join(workdir, "dissTOM.npy"), mode='w+', dtype=np.float32, shape=(n, n))
+    k32 = k.astype(np.float32)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        a_blk = np.asarray(adj[start:stop])
+        shared = a_blk @ adj  # l_ij = sum_u a_iu a_uj
+        denom = np.minimum(k32[start:stop, None], k32[None, :]) + 1.0 - a_blk
+        tom = (shared + a_blk) / denom
+        tom[np.arange(stop - start), np.arange(start, stop)] = 1.0
+        diss[start:stop] = 1.0 - tom
+    diss.flush()
+    return diss, k
+
+
+def condensed_from_square(mat, block_size=2000):
+    """Condensed (pdist-style) float64 vector from a symmetric square (mem-mapped) matrix, read in row blocks."""
+    n = mat.shape[0]
+    out = np.empty(n * (n - 1) // 2, dtype=np.float64)
+    pos = 0
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        blk = np.asarray(mat[start:stop])
+        for r in range(stop - start):
+            i = start + r
+            seg = blk[r, i + 1:]
+            out[pos:pos + len(seg)] = seg
+            pos += len(seg)
+    return out
+
+
+def dynamic_tree_cut(Z, min_module_size=30, cut_height=None, deep_split=2):
+    """
+    Top-down dynamic branch cut of a scipy linkage (simplified dynamicTreeCut 'tree' method).
+    Branches below cut_height become modules if they hold >= min_module_size genes; a branch is
+    split further when both children are large enough and their cores are separated from the
+    parent join by at least minGap (derived from deep_split), and small branches attached more than minGap above
+    a large core are peeled off as unassigned. Returns integer labels (0 = unassigned / grey).
+    """
+    n = Z.shape[0] + 1
+    heights = Z[:, 2]
+    if cut_height is None:
+        # cutreeDynamic default: 99% of the dendrogram height range
+        cut_height = heights.min() + 0.99 * (heights.max() - heights.min())
+    ref = cut_height - heights.min()
+    min_gap = (1 - _DEEP_SPLIT_CORE_SCATTER[deep_split]) * 0.75 * ref
+
+    sizes = np.ones(2 * n - 1, dtype=int)
+    sizes[n:] = Z[:, 3].astype(int)
+    node_h = np.zeros(2 * n - 1)
+    node_h[n:] = heights
+
+    # Core height of each branch: mean of its lowest (min_module_size - 1) merge heights.
+    # Chained stragglers raise a branch's top height but not its core, so the split test
+    # between two large branches is robust to genes loosely attached on both sides.
+    m = max(min_module_size - 1, 1)
+    lowest = [np.empty(0)] * (2 * n - 1)
+    core_h = np.zeros(2 * n - 1)
+    for i in range(n - 1):
+        a, b = int(Z[i, 0]), int(Z[i, 1])
+        merged = np.sort(np.concatenate([lowest[a], lowest[b], [heights[i]]]))[:m]
+        lowest[n + i] = merged
+        core_h[n + i] = merged.mean()
+
+    def children(node):
+        return int(Z[node - n, 0]), int(Z[node - n, 1])
+
+    def leaves(node):
+        out, stack = [], [node]
+        while stack:
+            x = stack.pop()
+            if x < n:
+                out.append(x)
+            else:
+                stack.extend(children(x))
+        return out
+
+    modules = []
+    stack = [2 * n - 2]
+    while stack:
+        node = stack.pop()
+        if node < n:
+            continue
+        left, right = children(node)
+        if node_h[node] > cut_height:
+            stack.extend([left, right])
+            continue
+        big_l = sizes[left] >= min_module_size
+        big_r = sizes[right] >= min_module_size
+        if big_l and big_r:
+            # Two well-separated sub-branches -> split; otherwise they form one module
+            if node_h[node] - max(core_h[left], core_h[right]) >= min_gap:
+                stack.extend([left, right])
+            else:
+                modules.append(leaves(node))
+        elif big_l or big_r:
+            core = left if big_l else right
+            # A small branch joined far above the core is loosely attached: peel it off (grey)
+            if node_h[node] - node_h[core] >= min_gap:
+                stack.append(core)
+            else:
+                modules.append(leaves(node))
+        elif sizes[node] >= min_module_size:
+            modules.append(leaves(node))
+
+    labels = np.zeros(n, dtype=int)
+    for i, members in enumerate(sorted(modules, key=len, reverse=True)):
+        labels[members] = i + 1
+    return labels
+
+
+def module_eigengenes(X, labels):
+    """
+    First principal component of each module (samples × modules), sign-aligned with the
+    module's average standardized expression. Module 0 (grey) is skipped.
+    """
+    X = np.asarray(X, dtype=float)
+    Xs = (X - X.mean(axis=0)) / np.where(X.std(axis=0) > 0, X.std(axis=0), 1.0)
+    mods = [m for m in np.unique(labels) if m != 0]
+    me = np.zeros((X.shape[0], len(mods)))
+    for j, m in enumerate(mods):
+        sub = Xs[:, labels == m]
+        u, s, _ = np.linalg.svd(sub, full_matrices=False)
+        pc = u[:, 0] * s[0]
+        if np.corrcoef(pc, sub.mean(axis=1))[0, 1] < 0:
+            pc = -pc
+        me[:, j] = (pc - pc.mean()) / (pc.std() + 1e-12)
+    return me, mods
+
+
+def merge_close_modules(X, labels, merge_cut_height=0.25):
+    """Merge modules whose eigengenes correlate above 1 - merge_cut_height (WGCNA mergeCloseModules)."""
+    from scipy.cluster.hierarchy import linkage, fcluster
+    me, mods = module_eigengenes(X, labels)
+    if len(mods) < 2:
+        return labels
+    diss = 1 - np.corrcoef(me.T)
+    cond = diss[np.triu_indices(len(mods), 1)]
+    groups = fcluster(linkage(np.clip(cond, 0, None), method='average'), t=merge_cut_height, criterion='distance')
+    mapping = dict(zip(mods, groups))
+    merged = np.array([mapping.get(l, 0) for l in labels])
+    # Relabel by size (1 = largest)
+    out = np.zeros_like(merged)
+    ids = [g for g in np.unique(merged) if g != 0]
+    for i, g in enumerate(sorted(ids, key=lambda g: (merged == g).sum(), reverse=True)):
+        out[merged == g] = i + 1
+    return out
+
+
+def prune_by_kme(X, labels, min_kme=0.3):
+    """Send genes whose correlation with their own module eigengene is below min_kme to grey (WGCNA minKMEtoStay)."""
+    me, mods = module_eigengenes(X, labels)
+    if not mods:
+        return labels
+    Zx = _standardize_columns(X)
+    Zme = _standardize_columns(me)
+    kme = Zx.T @ Zme  # genes × modules
+    col = {m: j for j, m in enumerate(mods)}
+    out = labels.copy()
+    assigned = np.where(labels != 0)[0]
+    own = kme[assigned, [col[l] for l in labels[assigned]]]
+    out[assigned[own < min_kme]] = 0
+    return out
+
+
+def module_trait_correlation(me, traits):
+    """
+    Pearson correlation + two-sided p between eigengenes (samples × modules) and traits
+    (samples × traits). Missing trait values are excluded per trait (pairwise-complete).
+    """
+    me = np.asarray(me, dtype=float)
+    T = np.asarray(traits, dtype=float)
+    r = np.full((me.shape[1], T.shape[1]), np.nan)
+    p = np.full_like(r, np.nan)
+    for j in range(T.shape[1]):
+        ok = ~np.isnan(T[:, j])
+        n = ok.sum()
+        if n < 3 or np.nanstd(T[:, j]) == 0:
+            continue
+        a = me[ok] - me[ok].mean(axis=0)
+        b = T[ok, j] - T[ok, j].mean()
+        denom = np.sqrt((a ** 2).sum(axis=0) * (b ** 2).sum())
+        r[:, j] = np.clip(a.T @ b / np.where(denom > 0, denom, np.inf), -1, 1)
+        t = r[:, j] * np.sqrt((n - 2) / np.maximum(1 - r[:, j] ** 2, 1e-12))
+        p[:, j] = 2 * stats.t.sf(np.abs(t), n - 2)
+    return r, p
+
+
+def label_colors(labels):
+    """Integer module labels -> WGCNA color names (0 -> grey)."""
+    return np.array(["grey" if l == 0 else WGCNA_COLORS[(l - 1) % len(WGCNA_COLORS)] for l in labels])
+
+
+# ==========================================
+# Sparse kNN co-expression graph backend
+# ==========================================
+
+def knn_coexpression_edges(X, k=20, block_size=2000):
+    """
+    Top-k co-expression partners per gene (by |Pearson r|), computed in row blocks.
+    Only k entries per gene are kept (argpartition), so memory grows with genes × k, not genes².
+    Returns (src, dst, weight) arrays of length n_genes × k; weight = |r|.
+    """
+    Z = _standardize_columns(X)
+    n = Z.shape[1]
+    k = min(k, n - 1)
+    src = np.repeat(np.arange(n), k)
+    dst = np.empty(n * k, dtype=np.int64)
+    w = np.empty(n * k, dtype=np.float32)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        a = np.abs(Z[:, start:stop].T @ Z)
+        a[np.arange(stop - start), np.arange(start, stop)] = -1.0  # exclude self
+        top = np.argpartition(a, -k, axis=1)[:, -k:]
+        dst[start * k:stop * k] = top.ravel()
+        w[start * k:stop * k] = np.take_along_axis(a, top, axis=1).ravel()
+    return src, dst, w
+
+
+def knn_graph(genes, src, dst, weight):
+    """Undirected networkx graph from kNN edges (mutual pairs collapse into one edge)."""
+    import networkx as nx
+    G = nx.Graph()
+    G.add_nodes_from(genes)
+    names = np.asarray(genes)
+    G.add_weighted_edges_from(zip(names[src], names[dst], weight.astype(float)))
+    return G
+
+
+def graph_modules(G, genes, min_module_size=30, seed=42):
+    """
+    Community detection on the co-expression graph (Louvain; greedy modularity on older networkx).
+    Returns integer labels aligned with `genes` (1 = largest community, 0 = communities below min size).
+    """
+    from networkx.algorithms import community
+    if hasattr(community, 'louvain_communities'):
+        comms = community.louvain_communities(G, weight='weight', seed=seed)
+    else:
+        comms = community.greedy_modularity_communities(G, weight='weight')
+    pos = {g: i for i, g in enumerate(genes)}
+    labels = np.zeros(len(genes), dtype=int)
+    kept = [c for c in sorted(comms, key=len, reverse=True) if len(c) >= min_module_size]
+    for i, c in enumerate(kept):
+        labels[[pos[g] for g in c]] = i + 1
+    return labels
+
+
+def hub_genes(G, genes, labels, method='degree', top_n=10):
+    """
+    Hub-gene ranking inside each module: intramodular weighted degree ('degree'),
+    or PageRank / eigenvector centrality on the module subgraph.
+    Returns a DataFrame (Module, Gene, Score, Rank).
+    """
+    import networkx as nx
+    rows = []
+    names = np.asarray(genes, dtype=object)
+    for m in [m for m in np.unique(labels) if m != 0]:
+        sub = G.subgraph(names[labels == m])
+        if method == 'pagerank':
+            score = nx.pagerank(sub, weight='weight')
+        elif method == 'eigenvector':
+            score = nx.eigenvector_centrality_numpy(sub, weight='weight')
+        else:
+            score = dict(sub.degree(weight='weight'))
+        ranked = sorted(score.items(), key=lambda kv: kv[1], reverse=True)[:top_n]
+        color = label_colors([m])[0]
+        rows.extend({'Module': color, 'Gene': g, 'Score': float(v), 'Rank': r + 1} for r, (g, v) in enumerate(ranked))
+    return pd.DataFrame(rows, columns=['Module', 'Gene', 'Score', 'Rank'])
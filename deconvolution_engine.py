@@ -0,0 +1,221 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import nnls
+
+# 进程内缓存：签名矩阵文件 (按路径 + mtime) 与对齐后的预处理结果 (按签名指纹 + 表达谱基因集)
+_SIGNATURE_FILES = {}
+_PREPARED = {}
+
+# Worker-side copy of the prepared signature (set once per process by the pool initializer)
+_WORKER_SIG = None
+# 置换零分布缓存 (内存 + 磁盘)，按对齐后签名矩阵 + 混合表达谱数值 + 求解器 + 置换次数索引：同一队列内各样本共享，跨队列不复用
+_NULLS = {}
+DEFAULT_CACHE_DIR = os.environ.get("OPENCLAW_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".openclaw_cache"))
+
+
+def load_signature_matrix(path):
+    """
+    Load an LM22-format signature matrix (genes × cell types; first column = gene symbol,
+    tab- or comma-separated). Cached by path + modification time.
+    """
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+    if key not in _SIGNATURE_FILES:
+        sep = ',' if path.lower().endswith('.csv') else '\t'
+        sig = pd.read_csv(path, sep=sep, index_col=0)
+        sig.index = sig.index.astype(str).str.strip().str.upper()
+        sig = sig.apply(pd.to_numeric, errors='coerce').fillna(0.0)
+        _SIGNATURE_FILES[key] = sig.groupby(level=0).mean()
+    return _SIGNATURE_FILES[key]
+
+
+def prepare_signature(sig, genes):
+    """
+    Align the signature matrix to the expression gene universe once and precompute everything
+    the solvers need: overlap index, globally scaled signature (nu-SVR), Gram matrix and its
+    Cholesky factor (NNLS), and the pseudo-inverse. Cached by signature + gene-set fingerprint.
+    Duplicated (or case-colliding) expression symbols map to their first occurrence; deconvolve()
+    averages them beforehand.
+    """
+    genes_up = pd.Index([str(g).strip().upper() for g in genes])
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(sig, index=True).values.tobytes())
+    h.update(str(tuple(sig.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(pd.Series(genes_up), index=False).values.tobytes())
+    key = h.hexdigest()
+    if key in _PREPARED:
+        return _PREPARED[key]
+
+    first = ~genes_up.duplicated()
+    overlap = sig.index.intersection(genes_up)
+    if len(overlap) < 2 * sig.shape[1]:
+        raise ValueError(f"Only {len(overlap)} signature genes found in the expression matrix.")
+    S = sig.loc[overlap].values.astype(float)
+    gram = S.T @ S
+    # Tiny ridge keeps the Cholesky factor stable for near-collinear cell types (e.g. LM22 T cell subsets)
+    chol = np.linalg.cholesky(gram + 1e-10 * np.trace(gram) * np.eye(gram.shape[0])).T
+    prepared = {
+        'key': key,
+        'sig_key': hashlib.sha1(S.tobytes() + str(tuple(sig.columns)).encode('utf-8')).hexdigest(),
+        'cell_types': list(sig.columns),
+        'genes': list(overlap),
+        'expr_idx': np.flatnonzero(first)[genes_up[first].get_indexer(overlap)],
+        'S': S,
+        'S_scaled': (S - S.mean()) / S.std(),
+        'gram': gram,
+        'chol': chol,
+        'chol_inv_t': np.linalg.inv(chol.T),
+        'pinv': np.linalg.pinv(S),
+    }
+    _PREPARED[key] = prepared
+    return prepared
+
+
+def _solve_nnls(prepared, Y):
+    """
+    Batched NNLS: with S^T S = R^T R, ||S x - y||^2 = ||R x - R^-T S^T y||^2 + const, so each sample
+    is a cell_types × cell_types NNLS problem. S^T Y for all samples is one matmul.
+    """
+    rhs = prepared['chol_inv_t'] @ (prepared['S'].T @ Y)
+    R = prepared['chol']
+    return np.column_stack([nnls(R, rhs[:, j])[0] for j in range(rhs.shape[1])])
+
+
+def _solve_nusvr(prepared, Y, nus=(0.25, 0.5, 0.75)):
+    """CIBERSORT core: linear nu-SVR on the scaled signature, best nu by RMSE, negative weights clipped."""
+    from sklearn.svm import NuSVR
+    X = prepared['S_scaled']
+    out = np.zeros((X.shape[1], Y.shape[1]))
+    for j in range(Y.shape[1]):
+        y = Y[:, j]
+        y = (y - y.mean()) / (y.std() + 1e-12)
+        best, best_rmse = None, np.inf
+        for nu in nus:
+            w = NuSVR(kernel='linear', nu=nu, C=1.0).fit(X, y).coef_.ravel()
+            w = np.clip(w, 0, None)
+            if w.sum() > 0:
+                w = w / w.sum()
+            rmse = np.sqrt(np.mean((X @ w - y) ** 2))
+            if rmse < best_rmse:
+                best, best_rmse = w, rmse
+        out[:, j] = best
+    return out
+
+
+def _init_worker(prepared):
+    global _WORKER_SIG
+    _WORKER_SIG = prepared
+
+
+def _worker_solve(args):
+    method, Y = args
+    return _solve_nusvr(_WORKER_SIG, Y) if method == 'nusvr' else _solve_nnls(_WORKER_SIG, Y)
+
+
+def solve_mixtures(prepared, Y, method='nnls', n_jobs=None, chunk_size=64, return_fit=False):
+    """
+    Cell fractions (cell_types × samples) for aligned mixtures Y (signature genes × samples).
+    With return_fit=True also returns the per-sample correlation between each mixture and its
+    reconstruction (the CIBERSORT goodness-of-fit statistic used for permutation p-values).
+    Sample chunks are solved in a process pool; the prepared signature is shipped to each worker
+    once via the pool initializer. NNLS batches below 20k samples run in-process (pool start-up
+    would dominate).
+    """
+    n = Y.shape[1]
+    n_jobs = n_jobs or os.cpu_count() or 1
+    solver = _solve_nusvr if method == 'nusvr' else _solve_nnls
+    # NNLS on the reduced system costs microseconds per sample; only nu-SVR benefits from processes
+    if n_jobs == 1 or n < 2 or (method == 'nnls' and n < 20000):
+        coef = solver(prepared, Y)
+    else:
+        step = min(chunk_size, -(-n // n_jobs))
+        chunks = [(method, Y[:, i:i + step]) for i in range(0, n, step)]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(prepared,)) as ex:
+            coef = np.hstack(list(ex.map(_worker_solve, chunks)))
+    total = coef.sum(axis=0, keepdims=True)
+    frac = coef / np.where(total > 0, total, 1.0)
+    if not return_fit:
+        return frac
+    return frac, _column_correlation(Y, prepared['S'] @ frac)
+
+
+def _column_correlation(A, B):
+    """Pearson correlation of matching columns of A and B."""
+    a = A - A.mean(axis=0)
+    b = B - B.mean(axis=0)
+    denom = np.sqrt((a ** 2).sum(axis=0) * (b ** 2).sum(axis=0))
+    return np.where(denom > 0, (a * b).sum(axis=0) / np.where(denom > 0, denom, 1.0), 0.0)
+
+
+def permutation_null(prepared, Y, n_perm=500, method='nnls', n_jobs=None, batch_size=250, seed=42, cache_dir=None):
+    """
+    Null distribution of the fit correlation from random mixtures (sorted array of length n_perm).
+    As in CIBERSORT, each random mixture draws its signature-gene values from the pooled values of
+    the real mixture matrix Y (signature genes × samples); draws are batched (genes × batch matrix
+    per solve). Because the pool is cohort-specific the null is not reused across cohorts: it is
+    shared by all samples of one cohort, kept in memory and persisted as .npy under cache_dir
+    (keyed by signature, mixture values and solver) so re-runs on the same data skip it.
+    """
+    pool = np.ascontiguousarray(Y, dtype=float).ravel()
+    mix_key = hashlib.sha1(pool.tobytes()).hexdigest()[:16]
+    key = f"{prepared['sig_key']}_{mix_key}_{method}_{n_perm}_{seed}"
+    if key in _NULLS:
+        return _NULLS[key]
+    cache_dir = cache_dir or os.path.join(DEFAULT_CACHE_DIR, "deconv_null")
+    path = os.path.join(cache_dir, f"{key}.npy")
+    if os.path.exists(path):
+        _NULLS[key] = np.load(path)
+        return _NULLS[key]
+
+    rng = np.random.default_rng(seed)
+    n_genes = prepared['S'].shape[0]
+    null = []
+    for start in range(0, n_perm, batch_size):
+        b = min(batch_size, n_perm - start)
+        Y_rand = rng.choice(pool, size=(n_genes, b), replace=True)
+        _, r = solve_mixtures(prepared, Y_rand, method=method, n_jobs=n_jobs, return_fit=True)
+        null.append(r)
+    null = np.sort(np.concatenate(null))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(path, null)
+    _NULLS[key] = null
+    return null
+
+
+def permutation_pvalues(null, r):
+    """Empirical p = (1 + #{null >= r}) / (1 + n_perm), vectorized via searchsorted on the sorted null."""
+    n_ge = len(null) - np.searchsorted(null, r, side='left')
+    return (1.0 + n_ge) / (1.0 + len(null))
+
+
+def mixture_matrix(prepared, expr, log_scale=True):
+    """Extract signature genes from an expression matrix (genes × samples); log2 data is anti-logged (CIBERSORT expects linear space)."""
+    vals = np.asarray(expr, dtype=float)[prepared['expr_idx']]
+    if log_scale:
+        vals = np.power(2.0, vals) - 1.0
+    return np.nan_to_num(vals)
+
+
+def deconvolve(sig, expr, method='nnls', n_jobs=None, log_scale=True, n_perm=0, cache_dir=None):
+    """
+    Full deconvolution of an expression DataFrame (genes × samples).
+    Returns (fractions samples × cell_types, prepared). With n_perm > 0 the fractions table also
+    carries CIBERSORT-style 'Correlation' and permutation 'P-value' columns.
+    Duplicated symbols (matched case-insensitively) are averaged first.
+    """
+    symbols = pd.Index([str(g).strip().upper() for g in expr.index])
+    if symbols.has_duplicates:
+        expr = expr.groupby(symbols).mean()
+    prepared = prepare_signature(sig, expr.index)
+    Y = mixture_matrix(prepared, expr.values, log_scale=log_scale)
+    frac, r = solve_mixtures(prepared, Y, method=method, n_jobs=n_jobs, return_fit=True)
+    out = pd.DataFrame(frac.T, index=expr.columns, columns=prepared['cell_types'])
+    if n_perm:
+        null = permutation_null(prepared, Y, n_perm=n_perm, method=method, n_jobs=n_jobs, cache_dir=cache_dir)
+        out['Correlation'] = r
+        out['P-value'] = permutation_pvalues(null, r)
+    return out, prepared
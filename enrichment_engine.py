@@ -0,0 +1,513 @@
+import os
+import io
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import hypergeom
+from statsmodels.stats.multitest import multipletests
+
+# 本地基因集库目录 (GMT 文件) 与二进制索引缓存目录
+GENESET_DIR = os.environ.get("OPENCLAW_GENESET_DIR", "genesets")
+DEFAULT_CACHE_DIR = os.environ.get("OPENCLAW_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".openclaw_cache"))
+
+# Enrichr 库名 → 本地 GMT 文件名 (与 Enrichr 下载页文件名一致)
+LIBRARY_FILES = {
+    'GO_Biological_Process_2023': 'GO_Biological_Process_2023.gmt',
+    'KEGG_2021_Human': 'KEGG_2021_Human.gmt',
+    'MSigDB_Hallmark_2020': 'MSigDB_Hallmark_2020.gmt',
+}
+
+# Enrichr 在线接口 (测试时可指向本地 stub：tools/enrichr_stub.py)
+ENRICHR_URL = os.environ.get("OPENCLAW_ENRICHR_URL", "https://maayanlab.cloud/Enrichr")
+# 富集结果缓存上限 (磁盘 MB / 进程内条目数)，按最近使用淘汰
+CACHE_MAX_MB = float(os.environ.get("OPENCLAW_ENRICH_CACHE_MB", "256"))
+CACHE_MAX_ENTRIES = 128
+
+# 进程内缓存：已加载的库索引 (按文件内容指纹)
+_LIBRARIES = {}
+# 进程内 LRU：富集结果 (键 = 基因列表哈希 + 库名/版本 + 背景集哈希)
+_RESULTS = OrderedDict()
+_RESULTS_LOCK = threading.Lock()
+# GSEA 置换 worker 的共享状态 (排序权重向量 + 基因集成员位置)
+_WORKER_GSEA = None
+
+ENRICHR_COLUMNS = ['Gene_set', 'Term', 'Overlap', 'P-value', 'Adjusted P-value', 'Old P-value',
+                   'Old Adjusted P-value', 'Odds Ratio', 'Combined Score', 'Genes']
+
+
+def read_gmt(path):
+    """Parse a GMT file into {term: [genes]} (second column = description, ignored; symbols upper-cased)."""
+    sets = {}
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 3:
+                continue
+            genes = [g.split(',')[0].strip().upper() for g in parts[2:] if g.strip()]
+            if genes:
+                sets[parts[0]] = list(dict.fromkeys(genes))
+    return sets
+
+
+def library_path(name, geneset_dir=None):
+    """Local GMT path for an Enrichr library name (or a direct path), None when not available offline."""
+    if os.path.exists(name):
+        return os.path.abspath(name)
+    path = os.path.join(geneset_dir or GENESET_DIR, LIBRARY_FILES.get(name, f"{name}.gmt"))
+    return os.path.abspath(path) if os.path.exists(path) else None
+
+
+def load_library(name, geneset_dir=None, cache_dir=None):
+    """
+    Sparse index of one gene-set library: CSR membership matrix (sets × genes), term names,
+    gene universe and set sizes. The GMT is parsed once; the index is stored as .npz under
+    cache_dir keyed by the file's content hash (= library version) and reloaded from there.
+    """
+    path = library_path(name, geneset_dir)
+    if path is None:
+        raise FileNotFoundError(f"Gene-set library '{name}' not found in {geneset_dir or GENESET_DIR}.")
+    with open(path, 'rb') as fh:
+        version = hashlib.sha1(fh.read()).hexdigest()[:16]
+    if version in _LIBRARIES:
+        return _LIBRARIES[version]
+
+    cache_dir = cache_dir or os.path.join(DEFAULT_CACHE_DIR, "genesets")
+    npz = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}_{version}.npz")
+    if os.path.exists(npz):
+        z = np.load(npz, allow_pickle=False)
+        M = sparse.csr_matrix((z['data'], z['indices'], z['indptr']), shape=tuple(z['shape']))
+        terms, genes = z['terms'].tolist(), z['genes'].tolist()
+    else:
+        sets = read_gmt(path)
+        terms = list(sets)
+        genes = sorted({g for members in sets.values() for g in members})
+        gidx = {g: i for i, g in enumerate(genes)}
+        indptr = np.cumsum([0] + [len(sets[t]) for t in terms])
+        indices = np.fromiter((gidx[g] for t in terms for g in sets[t]), dtype=np.int32, count=indptr[-1])
+        M = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(len(terms), len(genes)))
+        M.sort_indices()
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(npz, data=M.data, indices=M.indices, indptr=M.indptr, shape=np.array(M.shape),
+                 terms=np.array(terms), genes=np.array(genes))
+
+    lib = {
+        'name': os.path.splitext(os.path.basename(path))[0],
+        'version': version,
+        'terms': terms,
+        'genes': pd.Index(genes),
+        'M': M,
+        'set_sizes': np.asarray(M.sum(axis=1)).ravel().astype(int),
+    }
+    _LIBRARIES[version] = lib
+    return lib
+
+
+def enrich(library, gene_list, background=None):
+    """
+    Over-representation analysis of one gene list against one library.
+
+    The list becomes an indicator vector over the library genes and all set overlaps come from
+    one sparse mat-vec; hypergeometric upper tails for every set are one vectorized sf call.
+    With `background` (e.g. all measured genes) both the sets and the list are restricted to it;
+    otherwise the universe is all genes annotated in the library.
+
+    Returns an Enrichr/gseapy-compatible result (object with `.results` DataFrame).
+    """
+    lib = library if isinstance(library, dict) else load_library(library)
+    M, genes = lib['M'], lib['genes']
+    if background is not None:
+        bg = np.zeros(len(genes), dtype=np.float32)
+        pos = genes.get_indexer(pd.Index([str(g).upper() for g in background]).unique())
+        bg[pos[pos >= 0]] = 1.0
+        set_sizes = np.asarray(M @ bg).ravel()
+        N = int(bg.sum())
+    else:
+        bg = None
+        set_sizes = lib['set_sizes'].astype(float)
+        N = len(genes)
+
+    query = pd.Index([str(g).upper() for g in gene_list]).unique()
+    pos = genes.get_indexer(query)
+    pos = pos[pos >= 0]
+    if bg is not None:
+        pos = pos[bg[pos] > 0]
+    v = np.zeros(len(genes), dtype=np.float32)
+    v[pos] = 1.0
+    n = len(pos)
+    k = np.asarray(M @ v).ravel()
+
+    hit = np.flatnonzero(k > 0)
+    if n == 0 or len(hit) == 0:
+        return SimpleNamespace(results=pd.DataFrame(columns=ENRICHR_COLUMNS), library=lib['name'], version=lib['version'])
+    kh, Kh = k[hit], set_sizes[hit]
+    p = hypergeom.sf(kh - 1, N, Kh, n)
+    # Odds ratio of the 2×2 table (Haldane correction when a cell is empty)
+    a, b, c, d = kh, n - kh, Kh - kh, N - Kh - n + kh
+    zero = (a == 0) | (b == 0) | (c == 0) | (d == 0)
+    odds = np.where(zero, (a + 0.5) * (d + 0.5) / ((b + 0.5) * (c + 0.5)), a * d / np.where(zero, 1, b * c))
+
+    # Overlapping gene names: the query columns of the membership matrix, one CSR slice per hit set
+    sub = M[hit][:, pos].tocsr()
+    names = genes[pos]
+    overlap_genes = [';'.join(names[sub.indices[sub.indptr[i]:sub.indptr[i + 1]]]) for i in range(len(hit))]
+
+    padj = multipletests(p, method='fdr_bh')[1]
+    res = pd.DataFrame({
+        'Gene_set': lib['name'],
+        'Term': [lib['terms'][i] for i in hit],
+        'Overlap': [f"{int(x)}/{int(y)}" for x, y in zip(kh, Kh)],
+        'P-value': p,
+        'Adjusted P-value': padj,
+        'Old P-value': 0,
+        'Old Adjusted P-value': 0,
+        'Odds Ratio': odds,
+        'Combined Score': -np.log(np.clip(p, 1e-300, None)) * odds,
+        'Genes': overlap_genes,
+    })
+    res = res.sort_values('P-value', kind='stable').reset_index(drop=True)
+    return SimpleNamespace(results=res, library=lib['name'], version=lib['version'])
+
+
+def enrichr_remote(gene_list, library, url=None, timeout=60):
+    """Query the Enrichr REST API (addList + export) for one library; result in the same layout as enrich()."""
+    import requests
+    url = (url or ENRICHR_URL).rstrip('/')
+    r = requests.post(f"{url}/addList", files={'list': (None, '\n'.join(gene_list)), 'description': (None, 'openclaw')},
+                      timeout=timeout)
+    r.raise_for_status()
+    user_list = r.json()['userListId']
+    r = requests.get(f"{url}/export", params={'userListId': user_list, 'filename': 'enrichr', 'backgroundType': library},
+                     timeout=timeout)
+    r.raise_for_status()
+    res = pd.read_csv(io.StringIO(r.text), sep='\t') if r.text.strip() else pd.DataFrame()
+    # Enrichr answers some failures (rate limits, server errors) with HTTP 200 and a non-table body
+    if not {'Term', 'P-value'} <= set(res.columns):
+        raise ValueError(f"Enrichr export for {library} returned no result table.")
+    res.insert(0, 'Gene_set', library)
+    return SimpleNamespace(results=res.reindex(columns=ENRICHR_COLUMNS), library=library, version='enrichr')
+
+
+def _gene_key(genes):
+    return hashlib.sha1('\n'.join(sorted({str(g).upper() for g in genes})).encode()).hexdigest()
+
+
+def _cache_key(gene_list, library, version, background):
+    spec = {'genes': _gene_key(gene_list), 'library': library, 'version': version,
+            'background': None if background is None else _gene_key(background)}
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def _prune_cache(cache_dir, max_mb):
+    """Drop least-recently-used result files (mtime is touched on every hit) until under max_mb."""
+    entries = []
+    for f in os.listdir(cache_dir):
+        if f.endswith('.pkl'):
+            try:
+                st = os.stat(os.path.join(cache_dir, f))
+            except FileNotFoundError:  # removed by a concurrent prune
+                continue
+            entries.append((st.st_mtime, st.st_size, os.path.join(cache_dir, f)))
+    total = sum(size for _, size, _ in entries)
+    for _, size, f in sorted(entries):
+        if total <= max_mb * 1024 ** 2:
+            break
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def enrich_cached(gene_list, library, background=None, cache_dir=None, url=None, max_mb=None):
+    """
+    enrich() / enrichr_remote() behind a two-level cache keyed by the sorted gene-list hash, the
+    library name + version (local: GMT content hash; Enrichr: its versioned library name + URL)
+    and the background universe. Hits skip the computation and the network entirely; results
+    persist on disk under cache_dir with an LRU size cap. Local libraries are used when present.
+    Empty Enrichr responses are returned but not cached, so a transient failure is retried next call.
+    """
+    local = library_path(library) is not None
+    if local:
+        lib = load_library(library)
+        version = lib['version']
+    else:
+        # Enrichr ignores a custom background: keep it out of the key so equivalent queries share hits
+        lib, version, background = None, f"enrichr:{url or ENRICHR_URL}", None
+    key = _cache_key(gene_list, library, version, background)
+
+    with _RESULTS_LOCK:
+        hit = _RESULTS.get(key)
+        if hit is not None:
+            _RESULTS.move_to_end(key)
+    if hit is not None:
+        return SimpleNamespace(results=hit.copy(), library=library, version=version, cached=True)
+    cache_dir = cache_dir or os.path.join(DEFAULT_CACHE_DIR, "enrichment")
+    path = os.path.join(cache_dir, f"{key}.pkl")
+    cached = os.path.exists(path)
+    if cached:
+        res = pd.read_pickle(path)
+        os.utime(path)
+    else:
+        res = (enrich(lib, gene_list, background) if local else enrichr_remote(gene_list, library, url)).results
+        if not local and res.empty:
+            return SimpleNamespace(results=res, library=library, version=version, cached=False)
+        os.makedirs(cache_dir, exist_ok=True)
+        res.to_pickle(path)
+        _prune_cache(cache_dir, CACHE_MAX_MB if max_mb is None else max_mb)
+    with _RESULTS_LOCK:
+        _RESULTS[key] = res
+        while len(_RESULTS) > CACHE_MAX_ENTRIES:
+            _RESULTS.popitem(last=False)
+    return SimpleNamespace(results=res.copy(), library=library, version=version, cached=cached)
+
+
+def enrich_many(queries, background=None, n_jobs=4, **kwargs):
+    """
+    Run independent (gene_list, library) queries concurrently (threads: remote queries are I/O
+    bound). Returns results in query order; a failed query yields its exception instead.
+    """
+    def run(q):
+        try:
+            return enrich_cached(q[0], q[1], background=background, **kwargs)
+        except Exception as e:
+            return e
+    # Load each local library once up front so concurrent queries don't parse the same GMT twice
+    for lib in {q[1] for q in queries if library_path(q[1]) is not None}:
+        load_library(lib)
+    with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, len(queries)))) as ex:
+        return list(ex.map(run, queries))
+
+
+def _running_extremes(pos, w, indptr, n_genes):
+    """
+    Kolmogorov–Smirnov running sum of many sets at once, evaluated at their hits only.
+
+    pos / w: (..., nnz) hit positions in the ranked list (ascending within each set) and their
+    weights |r|^p; indptr delimits the sets (CSR layout). The running sum peaks at a hit and
+    bottoms out just before one, so the nnz hits suffice instead of the full n_genes walk.
+    Returns the running sum at each hit and just before it.
+    """
+    k = np.diff(indptr)
+    seg = np.repeat(np.arange(len(k)), k)
+    starts = indptr[:-1]
+    cw = np.cumsum(w, axis=-1)
+    prev = np.concatenate([np.zeros(cw.shape[:-1] + (1,)), cw[..., :-1]], axis=-1)
+    cw -= np.take(np.take(prev, starts, axis=-1), seg, axis=-1)
+    norm = np.take(np.take(cw, indptr[1:] - 1, axis=-1), seg, axis=-1)
+    miss = (pos - (np.arange(pos.shape[-1]) - starts[seg])) / (n_genes - k)[seg]
+    top = cw / norm - miss
+    return top, top - w / norm
+
+
+def _enrichment_scores(pos, w, indptr, n_genes):
+    top, bottom = _running_extremes(pos, w, indptr, n_genes)
+    top = np.maximum.reduceat(top, indptr[:-1], axis=-1)
+    bottom = np.minimum.reduceat(bottom, indptr[:-1], axis=-1)
+    return np.where(top >= -bottom, top, bottom)
+
+
+def running_sum(weights, positions):
+    """Full running enrichment score along the ranked list for one set (used for the enrichment plot)."""
+    n = len(weights)
+    hit = np.zeros(n, dtype=bool)
+    hit[positions] = True
+    w = np.where(hit, np.abs(weights), 0.0)
+    return np.cumsum(w) / w.sum() - np.cumsum(~hit) / (n - hit.sum())
+
+
+def _init_gsea_worker(shm_name, n_genes, sizes):
+    global _WORKER_GSEA
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Keep the handle alive with the view: the buffer is unmapped when shm is garbage-collected
+    _WORKER_GSEA = (shm, np.ndarray((n_genes,), dtype=np.float64, buffer=shm.buf), sizes)
+
+
+def _gsea_null(weights, sizes, seed, n_perm, batch=64):
+    """
+    Null ES (len(sizes) × n_perm) under gene-label permutation, `batch` permutations per matrix op.
+
+    Under gene permutation a set's null depends only on its size, so one null per distinct size
+    is drawn: the first k labels of each permutation form a random k-subset, re-sorted within
+    each size segment via one flat key sort.
+    """
+    n = len(weights)
+    rng = np.random.default_rng(seed)
+    indptr = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    take = np.concatenate([np.arange(k) for k in sizes])
+    seg_base = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes) * n
+    out = []
+    for b0 in range(0, n_perm, batch):
+        perms = np.stack([rng.permutation(n) for _ in range(min(batch, n_perm - b0))])
+        pos = np.sort(seg_base + perms[:, take], axis=1) - seg_base
+        out.append(_enrichment_scores(pos, weights[pos], indptr, n))
+    return np.concatenate(out, axis=0).T
+
+
+def _gsea_chunk(args):
+    seed, n_perm = args
+    _, weights, sizes = _WORKER_GSEA
+    return _gsea_null(weights, sizes, seed, n_perm)
+
+
+def _membership(lib, genes, min_size, max_size):
+    """
+    Library membership remapped onto the rows of `genes` (CSR sets × len(genes), unmatched genes
+    dropped), restricted to sets with min_size..max_size matched members. Returns (S, set rows).
+    """
+    pos = genes.get_indexer(lib['genes'])
+    M = lib['M'].tocoo()
+    keep = pos[M.col] >= 0
+    S = sparse.csr_matrix((np.ones(keep.sum()), (M.row[keep], pos[M.col[keep]])), shape=(M.shape[0], len(genes)))
+    sizes = np.diff(S.indptr)
+    sel = np.flatnonzero((sizes >= min_size) & (sizes <= max_size))
+    if len(sel) == 0:
+        raise ValueError(f"No gene set with {min_size}-{max_size} matched members.")
+    S = S[sel]
+    S.sort_indices()
+    return S, sel
+
+
+def gsea_preranked(ranking, library, min_size=15, max_size=500, n_perm=1000, weight=1.0, n_jobs=None, seed=42):
+    """
+    Preranked GSEA (Subramanian et al. 2005) of every set in a library against a ranked gene list.
+
+    ES for all sets comes from the hit positions in one vectorized pass; the gene-permutation
+    null (one per distinct set size) is generated in batches of permutations per matrix op,
+    chunked over a process pool whose workers read the ranked weight vector from one
+    shared-memory block. NES divides ES by the mean null ES of the same sign; FDR q-values
+    compare each NES with the pooled null NES of all sets.
+
+    Returns (DataFrame in gseapy prerank layout, info dict with the sorted ranking and each
+    set's hit positions for enrichment plots).
+    """
+    lib = library if isinstance(library, dict) else load_library(library)
+    r = pd.Series(ranking, dtype=float).dropna()
+    r.index = r.index.astype(str).str.upper()
+    r = r[~r.index.duplicated()].sort_values(ascending=False, kind='stable')
+    n = len(r)
+    weights = np.abs(r.values) ** weight
+
+    S, sel = _membership(lib, r.index, min_size, max_size)
+    indices, indptr = S.indices.astype(np.int64), S.indptr.astype(np.int64)
+
+    top, bottom = _running_extremes(indices.astype(float), weights[indices], indptr, n)
+    mx, mn = np.maximum.reduceat(top, indptr[:-1]), np.minimum.reduceat(bottom, indptr[:-1])
+    es = np.where(mx >= -mn, mx, mn)
+    sizes, size_of = np.unique(np.diff(indptr), return_inverse=True)
+
+    n_jobs = max(1, min(n_jobs or os.cpu_count() or 1, n_perm // 50 or 1))
+    seeds = np.random.SeedSequence(seed).generate_state(n_jobs)
+    counts = [len(c) for c in np.array_split(np.arange(n_perm), n_jobs)]
+    if n_jobs == 1:
+        null = _gsea_null(weights, sizes, seeds[0], n_perm)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=weights.nbytes)
+        try:
+            np.ndarray(weights.shape, dtype=np.float64, buffer=shm.buf)[:] = weights
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_gsea_worker,
+                                     initargs=(shm.name, n, sizes)) as ex:
+                null = np.concatenate(list(ex.map(_gsea_chunk, zip(seeds, counts))), axis=1)
+        finally:
+            shm.close()
+            shm.unlink()
+    null = null[size_of]
+
+    # Normalization by the same-sign null mean of each set
+    pos_null = null >= 0
+    pos_mean = np.where(pos_null, null, 0).sum(1) / np.maximum(pos_null.sum(1), 1)
+    neg_mean = -np.where(~pos_null, null, 0).sum(1) / np.maximum((~pos_null).sum(1), 1)
+    up = es >= 0
+    scale = np.where(up, pos_mean, neg_mean)[:, None]
+    nes = es / np.where(up, pos_mean, neg_mean)
+    null_nes = null / np.where(scale > 0, scale, 1)
+
+    # Nominal p: same-sign null at least as extreme
+    n_pos, n_neg = pos_null.sum(1), (~pos_null).sum(1)
+    nom = np.where(up, ((null >= es[:, None]) & pos_null).sum(1) + 1, ((null <= es[:, None]) & ~pos_null).sum(1) + 1)
+    nom = nom / (np.where(up, n_pos, n_neg) + 1)
+    null_flat = null_nes.ravel()
+    null_up = np.sort(null_flat[null_flat >= 0])
+    null_dn = np.sort(-null_flat[null_flat < 0])
+    obs_up, obs_dn = np.sort(nes[up]), np.sort(-nes[~up])
+
+    def tail(sorted_vals, x):
+        return (len(sorted_vals) - np.searchsorted(sorted_vals, x, side='left')) / max(len(sorted_vals), 1)
+
+    a = np.abs(nes)
+    fdr = np.where(up, tail(null_up, a) / np.maximum(tail(obs_up, a), 1e-300),
+                   tail(null_dn, a) / np.maximum(tail(obs_dn, a), 1e-300))
+    fdr = np.clip(fdr, 0, 1)
+    # Size-shared nulls have no joint per-permutation max across sets, so FWER is Holm on nominal p
+    fwer = multipletests(nom, method='holm')[1]
+
+    # Leading edge: hits before the peak (positive ES) or after the trough (negative ES)
+    genes = r.index.values
+    terms = [lib['terms'][i] for i in sel]
+    lead, tag, gene_pct, positions = [], [], [], {}
+    for i, t in enumerate(terms):
+        lo, hi = indptr[i], indptr[i + 1]
+        p = indices[lo:hi]
+        positions[t] = p
+        if up[i]:
+            j = int(np.argmax(top[lo:hi]))
+            le = p[:j + 1]
+            gene_pct.append((p[j] + 1) / n)
+        else:
+            j = int(np.argmin(bottom[lo:hi]))
+            le = p[j:]
+            gene_pct.append((n - p[j]) / n)
+        lead.append(';'.join(genes[le]))
+        tag.append(f"{len(le)}/{len(p)}")
+
+    res = pd.DataFrame({
+        'Name': 'prerank', 'Term': terms, 'ES': es, 'NES': nes, 'NOM p-val': nom, 'FDR q-val': fdr,
+        'FWER p-val': fwer, 'Tag %': tag, 'Gene %': [f"{100 * g:.2f}%" for g in gene_pct],
+        'Size': np.diff(indptr), 'Lead_genes': lead,
+    })
+    res = res.sort_values('NES', key=np.abs, ascending=False, kind='stable').reset_index(drop=True)
+    info = {'ranking': r, 'weights': weights, 'positions': positions, 'n_perm': int(n_perm), 'weight': float(weight),
+            'library': lib['name'], 'version': lib['version'], 'n_sets': len(sel)}
+    return res, info
+
+
+def ssgsea_scores(expr, library, min_size=10, max_size=500, alpha=0.25, normalize=True, chunk=256):
+    """
+    Single-sample GSEA (Barbie et al. 2009; GSVA method='ssgsea') for every set × sample.
+
+    Each sample's genes are ranked once (R = 1..N, highest expression = N). The ssGSEA score is
+    the sum of the running sum (P_hit − P_miss) over all N positions; summing the cumulative sums
+    position by position collapses to closed form per set:
+        Σ R^(1+α) / Σ R^α − (N(N+1)/2 − Σ R) / (N − k)     (sums over the set's k members)
+    so all sets × samples come from three sparse (sets × genes) @ dense (genes × samples)
+    products, done in sample chunks. normalize=True divides by the score range (GSVA ssgsea.norm).
+
+    Returns a pathways × samples DataFrame.
+    """
+    from scipy.stats import rankdata
+    lib = library if isinstance(library, dict) else load_library(library)
+    expr = pd.DataFrame(expr).dropna()
+    expr.index = expr.index.astype(str).str.upper()
+    expr = expr[~expr.index.duplicated()]
+    n = expr.shape[0]
+    S, sel = _membership(lib, expr.index, min_size, max_size)
+    k = np.diff(S.indptr).astype(float)
+    miss_norm = (n - k)[:, None]
+
+    values = expr.values
+    scores = np.empty((S.shape[0], values.shape[1]))
+    for c0 in range(0, values.shape[1], chunk):
+        R = rankdata(values[:, c0:c0 + chunk], axis=0)
+        Ra = R ** alpha
+        scores[:, c0:c0 + chunk] = (S @ (Ra * R)) / (S @ Ra) - (n * (n + 1) / 2 - S @ R) / miss_norm
+    if normalize:
+        scores /= scores.max() - scores.min()
+    return pd.DataFrame(scores, index=[lib['terms'][i] for i in sel], columns=expr.columns)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# 8-bit popcount table: fallback for numpy < 2.0 (no np.bitwise_count)
+_POP8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words, axis=-1):
+    """Number of set bits along `axis` of a uint64 bitset array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=axis, dtype=np.int64)
+    as_bytes = words.view(np.uint8).reshape(words.shape[:-1] + (-1,))
+    return _POP8[as_bytes].sum(axis=axis, dtype=np.int64)
+
+
+def encode(sets, labels=None, universe=None):
+    """
+    Bitsets of N gene sets over one shared universe (default: their sorted union).
+
+    Returns {'labels', 'universe' (Index), 'bits' (N × W uint64, bit j of row i = gene j in set i)}.
+    """
+    sets = [pd.Index([str(g) for g in s]).unique() for s in sets]
+    labels = list(labels) if labels is not None else [f"Set_{i + 1}" for i in range(len(sets))]
+    if universe is None:
+        universe = pd.Index(sorted(set().union(*sets)))
+    else:
+        universe = pd.Index([str(g) for g in universe]).unique()
+    n_words = max(1, -(-len(universe) // 64))
+    member = np.zeros((len(sets), n_words * 64), dtype=bool)
+    for i, s in enumerate(sets):
+        pos = universe.get_indexer(s)
+        member[i, pos[pos >= 0]] = True
+    # Pack little-endian so bit j of the flat bitset is gene j
+    bits = np.packbits(member, axis=1, bitorder='little').view('<u8')
+    return {'labels': labels, 'universe': universe, 'bits': bits}
+
+
+def region_sizes(enc):
+    """
+    Exclusive region sizes of the N-set Venn / UpSet diagram (genes in exactly the sets of `code`).
+
+    Region bitsets are built one set at a time, splitting every partial region P into P & b_k and
+    P & ~b_k; empty partials are dropped, so at most min(2^k, |universe|) rows are ever alive and
+    every size is one vectorized popcount. Returns a Series of the non-empty regions indexed by
+    code (bit i set = member of set i), sorted by size.
+    """
+    bits = enc['bits']
+    n_sets, n_words = bits.shape
+    n_genes = len(enc['universe'])
+    valid = np.zeros(n_words * 64, dtype=bool)
+    valid[:n_genes] = True
+    valid = np.packbits(valid, bitorder='little').view('<u8')
+
+    codes = np.zeros(1, dtype=np.int64)
+    parts = valid[None, :]
+    for k in range(n_sets):
+        inside, outside = parts & bits[k], parts & ~bits[k]
+        parts = np.concatenate([outside, inside])
+        codes = np.concatenate([codes, codes | (1 << k)])
+        alive = parts.any(axis=1)
+        parts, codes = parts[alive], codes[alive]
+    sizes = pd.Series(popcount(parts), index=pd.Index(codes, name='code'), name='size')
+    # The all-outside region holds only genes absent from every set (possible with a custom universe)
+    sizes = sizes[sizes.index != 0]
+    return sizes.sort_values(ascending=False, kind='stable')
+
+
+def region_genes(enc, code):
+    """Genes in exactly the sets of `code`."""
+    bits = enc['bits']
+    sel = np.array([(code >> i) & 1 for i in range(bits.shape[0])], dtype=bool)
+    words = np.bitwise_and.reduce(np.where(sel[:, None], bits, ~bits), axis=0)
+    member = np.unpackbits(words.view(np.uint8), bitorder='little')[:len(enc['universe'])].astype(bool)
+    return list(enc['universe'][member])
+
+
+def region_table(enc, sizes=None, with_genes=True):
+    """One row per non-empty region: membership flags, degree, size and (optionally) its genes."""
+    sizes = region_sizes(enc) if sizes is None else sizes
+    codes = sizes.index.values
+    table = pd.DataFrame({lbl: (codes >> i) & 1 == 1 for i, lbl in enumerate(enc['labels'])}, index=sizes.index)
+    table['degree'] = table[enc['labels']].sum(axis=1)
+    table['size'] = sizes.values
+    if with_genes:
+        table['genes'] = [';'.join(region_genes(enc, c)) for c in codes]
+    return table
@@ -7,6 +7,7 @@ OpenClaw 生信工作流启动器
   2. 自然语言描述：用一句话描述任务，自动从中识别 GSE 编号并执行
 """
 
+import os
 import re
 import sys
 import argparse
@@ -184,6 +185,7 @@ def run_workflow_simple(gse_id: str) -> None:
     pipeline = MasterBioinfoPipeline(out_dir=f"Run_{gse_id}_Results")
     pipeline.run_pre_processing(custom_counts=counts, custom_meta=meta)
     pipeline.run_dea()
+    pipeline.run_threshold_sweep()
     pipeline.run_deg_heatmap()
     pipeline.run_wgcna_lite()
     if hasattr(pipeline, "run_advanced_ml"):
@@ -270,6 +272,7 @@ def run_workflow_flexible_ml(train_gse: str, test_gse: str, use_simple: bool = T
     # 4. Run Steps
     pipeline.run_pre_processing(custom_counts=train_counts, custom_meta=train_meta)
     pipeline.run_dea()
+    pipeline.run_threshold_sweep()
     pipeline.run_deg_heatmap()
     pipeline.run_wgcna_lite()
     pipeline.run_advanced_ml() # Will detect external_val
@@ -279,6 +282,13 @@ def run_workflow_flexible_ml(train_gse: str, test_gse: str, use_simple: bool = T
     # Intersect biomarkers for Venn
     train_sig = pipeline.sig_genes
     pipeline.run_venn_analysis(other_sig_lists=[test_counts.index.tolist()], labels=["Validation Cohort"])
+
+    # Cross-cohort meta-analysis: validation-cohort DEA statistics pooled with the training cohort
+    val_pipeline = MasterBioinfoPipeline(out_dir=os.path.join(out_dir, f"Validation_{test_gse}"))
+    val_pipeline.dataset_id = test_gse
+    val_pipeline.run_pre_processing(custom_counts=test_counts, custom_meta=test_meta)
+    val_pipeline.compute_dea_stats()
+    pipeline.run_meta_analysis(other_results=[val_pipeline], labels=[test_gse])
     
     pipeline.generate_report()
     logger.info(f"Done. Results in {out_dir}")
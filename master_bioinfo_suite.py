@@ -6,9 +6,10 @@ from scipy import stats
 from statsmodels.stats.multitest import multipletests
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.decomposition import PCA
-from sklearn.cluster import AgglomerativeClustering
-from lifelines import KaplanMeierFitter, CoxPHFitter
+from volcano_renderer import render_volcano
 import os
+import hashlib
+import time
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -34,6 +35,45 @@ plt.rcParams.update({
 # Nature/Science-grade Color Palette
 NPG_COLORS = ["#E64B35", "#4DBBD5", "#00A087", "#3C8DBC", "#F39B7F", "#8491B4", "#91D1C2", "#DC0000"]
 
+
+def _matrix_fingerprint(df):
+    """Content hash of a DataFrame (values + labels), used as cache key for expensive steps."""
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    h.update(str(tuple(df.columns)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _vectorized_ttest(c_mat, h_mat, return_se=False):
+    """
+    Row-wise Student t-test (equal variance, same as stats.ttest_ind) for two sample blocks.
+    NaN values are ignored per gene; genes with < 2 valid values in either group get log2FC=0, p=1.
+    return_se=True also returns the standard error of log2FC (NaN where undefined), used by meta-analysis.
+    """
+    c_valid = ~np.isnan(c_mat)
+    h_valid = ~np.isnan(h_mat)
+    n1 = c_valid.sum(axis=1).astype(float)
+    n2 = h_valid.sum(axis=1).astype(float)
+    ok = (n1 >= 2) & (n2 >= 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m1 = np.where(c_valid, c_mat, 0.0).sum(axis=1) / n1
+        m2 = np.where(h_valid, h_mat, 0.0).sum(axis=1) / n2
+        ss1 = np.where(c_valid, (c_mat - m1[:, None]) ** 2, 0.0).sum(axis=1)
+        ss2 = np.where(h_valid, (h_mat - m2[:, None]) ** 2, 0.0).sum(axis=1)
+        dof = n1 + n2 - 2
+        sp2 = (ss1 + ss2) / dof
+        se = np.sqrt(sp2 * (1.0 / n1 + 1.0 / n2))
+        t = (m1 - m2) / se
+        p = 2 * stats.t.sf(np.abs(t), dof)
+
+    fc = np.where(ok, m1 - m2, 0.0)
+    # 零方差基因（t 无定义）按不显著处理，避免 NaN 污染 FDR 校正
+    p = np.where(ok & np.isfinite(p), p, 1.0)
+    if return_se:
+        return fc, p, np.where(ok & (se > 0), se, np.nan)
+    return fc, p
+
 class MasterBioinfoPipeline:
     def __init__(self, out_dir="Grand_Master_Results"):
         # Use absolute path for output to avoid issues with Streamlit session state
@@ -47,7 +87,23 @@ class MasterBioinfoPipeline:
         self.metadata = None
         self.log_cpm = None
         self.res_df = None
+        self.threshold_sweep = None
+        self._heatmap_cache = {'dist': {}, 'linkage': {}}  # 热图行聚类缓存 (基因集 + 数据指纹)
+        self.sig_genes = []
+        self._dea_stats_key = None  # 阶段一 (统计量) 缓存键：表达矩阵指纹 + 分组
+        self._dea_thresholds = None  # 阶段二 (Sig 分类) 当前生效的阈值
         self.wgcna_modules = None
+        self.ml_benchmark = None
+        self.stable_panel = []
+        self.model_bundle_path = None
+        self.cox_screen = None
+        self.prognostic_table = None
+        self.risk_score = None
+        self.coxnet_coef = None
+        self.pathway_scores = None  # ssGSEA 通路活性矩阵 (pathways × samples)，可作为 ML / 生存模型特征
+        self.pathway_library = None
+        self.consensus_genes = []  # 所有队列共有的差异基因 (run_venn_analysis)
+        self.meta_res = None  # 跨队列 meta 分析共识表 (run_meta_analysis)
         self.top_gene = "None"
         self.dataset_id = None  # 由 UI / 启动器在创建后注入，用于报告摘要标注 GSE 号
         self._report_summary = {}  # 供报告数据解析与 OpenClaw 下放自由度使用
@@ -59,7 +115,8 @@ class MasterBioinfoPipeline:
         path = os.path.join(self.out_dir, filename)
         plt.savefig(path)
         plt.close()
-        # Keep relative path for Markdown report
+        # Keep relative path for Markdown report (re-rendered figures replace their old entry)
+        self.report_images = [img for img in self.report_images if img["path"] != filename]
         self.report_images.append({"path": filename, "title": title, "caption": caption})
 
     def fetch_geo_data(self, accession):
@@ -167,104 +224,246 @@ class MasterBioinfoPipeline:
         plt.grid(True, linestyle='--', alpha=0.3)
         self._save_fig("Fig1_PCA", "Dimensionality Reduction", "Advanced PCA projection showing distinct sample separation clusters.")
 
-    def run_dea(self, p_thresh=0.05, fc_thresh=1.0, p_type='padj'):
-        print(f"[2/8] Differential Expression Analysis (DEA) [Thresh: {p_type} < {p_thresh}, |log2FC| > {fc_thresh}]...")
+    def compute_dea_stats(self, force=False):
+        """
+        DEA 阶段一：与阈值无关的统计量 (log2FC / pvalue / padj)。
+        结果按表达矩阵指纹 + 分组缓存，阈值变化时不会重复计算。
+        """
         cancer = self.metadata[self.metadata['Group']=='Cancer'].index
         healthy = self.metadata[self.metadata['Group']=='Healthy'].index
-        
-        res = []
-        for g in self.log_cpm.index:
-            c_vals = self.log_cpm.loc[g, cancer].values.astype(float)
-            h_vals = self.log_cpm.loc[g, healthy].values.astype(float)
-            # 移除任何残留 NaN
-            c_vals = c_vals[~np.isnan(c_vals)]
-            h_vals = h_vals[~np.isnan(h_vals)]
-            if len(c_vals) < 2 or len(h_vals) < 2:
-                res.append({'Gene': g, 'log2FC': 0, 'pvalue': 1.0})
-                continue
-            t, p = stats.ttest_ind(c_vals, h_vals)
-            fc = np.mean(c_vals) - np.mean(h_vals)
-            res.append({'Gene': g, 'log2FC': fc, 'pvalue': p})
-            
-        self.res_df = pd.DataFrame(res).set_index('Gene')
+        key = (_matrix_fingerprint(self.log_cpm), tuple(cancer), tuple(healthy))
+        if not force and self.res_df is not None and key == self._dea_stats_key:
+            print("  [*] DEA statistics cache hit. Skipping re-testing.")
+            return self.res_df
+
+        # Vectorized two-sample t-test over all genes at once
+        c_mat = self.log_cpm[cancer].values.astype(float)
+        h_mat = self.log_cpm[healthy].values.astype(float)
+        fc, p, se = _vectorized_ttest(c_mat, h_mat, return_se=True)
+
+        self.res_df = pd.DataFrame({'log2FC': fc, 'pvalue': p}, index=pd.Index(self.log_cpm.index, name='Gene'))
         self.res_df['padj'] = multipletests(self.res_df['pvalue'], method='fdr_bh')[1]
-        
-        # Sig filtering based on dynamic parameters
-        plt.figure(figsize=(7, 7))
         self.res_df['Sig'] = 'NS'
-        p_col = p_type
-        
-        self.res_df.loc[(self.res_df['log2FC'] > fc_thresh) & (self.res_df[p_col] < p_thresh), 'Sig'] = 'Up'
-        self.res_df.loc[(self.res_df['log2FC'] < -fc_thresh) & (self.res_df[p_col] < p_thresh), 'Sig'] = 'Down'
-        
-        # Volcano plot with Top Genes Labeled
-        sns.scatterplot(data=self.res_df, x='log2FC', y=-np.log10(self.res_df[p_col]), hue='Sig', 
-                        palette={'Up':'#E64B35','Down':'#4DBBD5','NS':'#999999'}, s=40, alpha=0.7, edgecolor='none')
-        
-        plt.axhline(-np.log10(p_thresh), color='gray', linestyle='--', linewidth=1)
-        plt.axvline(fc_thresh, color='gray', linestyle='--', linewidth=1)
-        plt.axvline(-fc_thresh, color='gray', linestyle='--', linewidth=1)
-        
-        # Label Top 5 Up and Down
-        from adjustText import adjust_text
-        texts = []
-        top_genes = pd.concat([
-            self.res_df[self.res_df['Sig'] == 'Up'].sort_values('log2FC', ascending=False).head(5),
-            self.res_df[self.res_df['Sig'] == 'Down'].sort_values('log2FC', ascending=True).head(5)
-        ])
-        for gene, row in top_genes.iterrows():
-            texts.append(plt.text(row['log2FC'], -np.log10(row[p_col]), gene, fontweight='bold', size=8))
-        # Note: adjust_text is ideal here but might not be installed. We'll skip it for now and use basic text.
+        self.res_df['se'] = se  # log2FC 标准误，供跨队列随机效应 meta 分析
+        self._dea_stats_key = key
+        self._dea_thresholds = None
+        return self.res_df
+
+    def classify_degs(self, p_thresh=0.05, fc_thresh=1.0, p_type='padj'):
+        """
+        DEA 阶段二：基于阈值的 Sig 分类 (毫秒级)，只依赖缓存的统计量。
+        更新 res_df['Sig'] / sig_genes / top_gene，供热图、ML、富集等下游步骤使用。
+        """
+        if self.res_df is None:
+            self.compute_dea_stats()
+        p_col = self.res_df[p_type].values
+        fc = self.res_df['log2FC'].values
+        sig = np.full(len(fc), 'NS', dtype=object)
+        passed = p_col < p_thresh
+        sig[passed & (fc > fc_thresh)] = 'Up'
+        sig[passed & (fc < -fc_thresh)] = 'Down'
+        self.res_df['Sig'] = sig
+
         # Store results for downstream modules
-        self.sig_genes = self.res_df[self.res_df['Sig'] != 'NS'].index.tolist()
+        self.sig_genes = self.res_df.index[sig != 'NS'].tolist()
         self.top_gene = self.res_df['pvalue'].idxmin() if not self.res_df.empty else self.log_cpm.index[0]
+        self._dea_thresholds = (p_thresh, fc_thresh, p_type)
+        return self.sig_genes
+
+    def run_dea(self, p_thresh=0.05, fc_thresh=1.0, p_type='padj', label_top=5):
+        print(f"[2/8] Differential Expression Analysis (DEA) [Thresh: {p_type} < {p_thresh}, |log2FC| > {fc_thresh}]...")
+        self.compute_dea_stats()
+        self.classify_degs(p_thresh=p_thresh, fc_thresh=fc_thresh, p_type=p_type)
+
+        # Label Top N Up and Down (label_top=0 skips labelling entirely); rows are picked by position
+        # so duplicated symbols only label the selected copy
+        label_pos = None
+        if label_top:
+            fc = self.res_df['log2FC'].values
+            sig = self.res_df['Sig'].values
+            up, down = np.flatnonzero(sig == 'Up'), np.flatnonzero(sig == 'Down')
+            label_pos = np.concatenate([up[np.argsort(-fc[up], kind='stable')[:label_top]],
+                                        down[np.argsort(fc[down], kind='stable')[:label_top]]])
+
+        # Volcano plot: density-binned NS background + vector markers for DEGs
+        plt.figure(figsize=(7, 7))
+        render_volcano(self.res_df, p_col=p_type, sig_col='Sig', label_pos=label_pos,
+                       p_thresh=p_thresh, fc_thresh=fc_thresh)
 
         plt.title(f"Differential Expression Profile ({p_type.upper()})", fontweight='bold')
         plt.xlabel("log2(Fold Change)")
         plt.ylabel(f"-log10({p_type.upper()})")
-        plt.legend(frameon=False, loc='upper right')
         self._save_fig("Fig2_Volcano", "Volcano Plot (DEGs)", f"Differential expression with thresholds: {p_type} < {p_thresh} and |log2FC| > {fc_thresh}.")
 
-    def run_deg_heatmap(self, n_top=25):
+    def run_threshold_sweep(self, p_grid=None, fc_grid=None, p_type='padj'):
+        """
+        阈值敏感性扫描：在 p_thresh × fc_thresh 网格上统计 Up/Down DEG 数量。
+        基于缓存的 res_df，只排序一次：每个基因用 searchsorted 定位到网格格点，
+        二维直方图 + 累积和即可得到全部格点的计数，无需逐格重新过滤。
+        """
+        print(f"[*] DEG Threshold Sensitivity Sweep ({p_type})...")
+        if self.res_df is None:
+            self.compute_dea_stats()
+        p_grid = np.sort(np.asarray(p_grid if p_grid is not None else np.logspace(-6, np.log10(0.2), 25), dtype=float))
+        fc_grid = np.sort(np.asarray(fc_grid if fc_grid is not None else np.linspace(0, 3, 13), dtype=float))
+        n_p, n_fc = len(p_grid), len(fc_grid)
+
+        p_vals = self.res_df[p_type].values.astype(float)
+        fc = self.res_df['log2FC'].values.astype(float)
+        # p < p_grid[i]  <=>  i >= searchsorted(p_grid, p, 'right')
+        p_bin = np.searchsorted(p_grid, p_vals, side='right')
+
+        def dominance_counts(effect):
+            # effect > fc_grid[j]  <=>  j < searchsorted(fc_grid, effect, 'left')
+            fc_bin = np.searchsorted(fc_grid, effect, side='left')
+            keep = (p_bin < n_p) & (fc_bin > 0)
+            hist = np.bincount(p_bin[keep] * (n_fc + 1) + fc_bin[keep],
+                               minlength=n_p * (n_fc + 1)).reshape(n_p, n_fc + 1)
+            # count[i, j] = sum_{a <= i, b > j} hist[a, b]
+            tail = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+            return np.cumsum(tail[:, 1:], axis=0)
+
+        n_up = dominance_counts(fc)
+        n_down = dominance_counts(-fc)
+
+        pp, ff = np.meshgrid(p_grid, fc_grid, indexing='ij')
+        sweep = pd.DataFrame({
+            'p_thresh': pp.ravel(), 'fc_thresh': ff.ravel(),
+            'n_up': n_up.ravel(), 'n_down': n_down.ravel(),
+        })
+        sweep['n_sig'] = sweep['n_up'] + sweep['n_down']
+        sweep.to_csv(os.path.join(self.out_dir, "DEG_Threshold_Sweep.csv"), index=False)
+        self.threshold_sweep = sweep
+
+        # Heatmap: Up / Down DEG counts across the grid
+        tick_p = max(1, n_p // 10)
+        tick_fc = max(1, n_fc // 10)
+        fig, axes = plt.subplots(1, 2, figsize=(13, 6))
+        for ax, mat, label, cmap in [(axes[0], n_up, 'Up-regulated', 'Reds'), (axes[1], n_down, 'Down-regulated', 'Blues')]:
+            sns.heatmap(pd.DataFrame(mat, index=[f"{v:.1e}" for v in p_grid], columns=[f"{v:.2f}" for v in fc_grid]),
+                        ax=ax, cmap=cmap, xticklabels=tick_fc, yticklabels=tick_p,
+                        cbar_kws={'label': 'DEG Count'})
+            ax.invert_yaxis()
+            ax.set_title(f"{label} DEGs", fontweight='bold')
+            ax.set_xlabel("|log2FC| Threshold")
+            ax.set_ylabel(f"{p_type} Threshold")
+        plt.suptitle("DEG Threshold Sensitivity Sweep", fontweight='bold')
+        plt.tight_layout()
+        self._save_fig("Fig2b_Threshold_Sweep", "DEG Threshold Sensitivity",
+                       f"Number of up/down-regulated genes across a {n_p}×{n_fc} grid of {p_type} and |log2FC| cutoffs.")
+        return sweep
+
+    def _row_linkage(self, z_pool, rows, method='average', metric='euclidean'):
+        """
+        Row linkage for the pool rows at positions `rows`, cached by row positions + data hash.
+        Pairwise distances are computed once for the whole candidate pool (z-scores are per row,
+        so they do not depend on which subset is shown); each subset (e.g. a different n_top)
+        only re-runs linkage on its slice of the cached distance matrix. Rows are addressed by
+        position because GEO-mapped gene symbols are often duplicated.
+        """
+        from scipy.cluster.hierarchy import linkage
+        from scipy.spatial.distance import pdist, squareform
+
+        data_key = _matrix_fingerprint(z_pool)
+        pool_key = (data_key, metric)
+        if pool_key not in self._heatmap_cache['dist']:
+            self._heatmap_cache['dist'] = {pool_key: squareform(pdist(z_pool.values, metric=metric))}
+        dist = self._heatmap_cache['dist'][pool_key]
+
+        rows = np.asarray(rows, dtype=np.int64)
+        link_key = (data_key, hashlib.sha1(rows.tobytes()).hexdigest(), method, metric)
+        if link_key not in self._heatmap_cache['linkage']:
+            sub = dist[np.ix_(rows, rows)]
+            self._heatmap_cache['linkage'][link_key] = linkage(squareform(sub, checks=False), method=method)
+        else:
+            print("  [*] Row linkage cache hit. Reusing clustering.")
+        return self._heatmap_cache['linkage'][link_key]
+
+    def _aggregate_samples(self, plot_data, groups, max_samples):
+        """
+        Large-heatmap mode: average consecutive samples within each group into bins so that
+        at most ~max_samples columns are drawn. Column order (Group sorting) is preserved.
+        """
+        bounds, labels, bin_groups = [], [], []
+        n_total = plot_data.shape[1]
+        start = 0
+        for grp, n_g in groups.value_counts(sort=False).loc[groups.unique()].items():
+            n_bins = int(min(n_g, max(1, round(max_samples * n_g / n_total))))
+            edges = start + np.linspace(0, n_g, n_bins + 1).astype(int)[:-1]
+            bounds.extend(edges)
+            labels.extend([f"{grp}_bin{i+1:03d}" for i in range(n_bins)])
+            bin_groups.extend([grp] * n_bins)
+            start += n_g
+        bounds = np.asarray(bounds)
+        sums = np.add.reduceat(plot_data.values, bounds, axis=1)
+        sizes = np.diff(np.append(bounds, n_total))
+        agg = pd.DataFrame(sums / sizes, index=plot_data.index, columns=labels)
+        return agg, pd.Series(bin_groups, index=labels)
+
+    def run_deg_heatmap(self, n_top=25, max_samples=400, pool_size=250):
         print(f"[3/8] Generating Traditional DEG Heatmap (Top {n_top*2} genes)...")
         if self.res_df is None: return
         
-        # Select Top Up and Top Down
-        up_genes = self.res_df[self.res_df['Sig'] == 'Up'].sort_values('pvalue').head(n_top).index.tolist()
-        down_genes = self.res_df[self.res_df['Sig'] == 'Down'].sort_values('pvalue').head(n_top).index.tolist()
-        target_genes = up_genes + down_genes
+        # res_df rows are positions in log_cpm (symbols may be duplicated), so the pool is built by position
+        if not self.res_df.index.equals(self.log_cpm.index):
+            print("  [!] DEA results do not match the current expression matrix. Re-run DEA first.")
+            return
+
+        # Candidate pool: ranked Up / Down lists (top n_top of each are displayed).
+        # The pool is independent of n_top so that the clustering cache is reused across renders.
+        pool_n = max(n_top, pool_size)
+        sig = self.res_df['Sig'].values
+        order = np.argsort(self.res_df['pvalue'].values, kind='stable')
+        up_pool = order[sig[order] == 'Up'][:pool_n]
+        down_pool = order[sig[order] == 'Down'][:pool_n]
+        pool = np.concatenate([up_pool, down_pool])
+        # Positions of the displayed genes within the pool
+        target = np.concatenate([np.arange(min(n_top, len(up_pool))),
+                                 len(up_pool) + np.arange(min(n_top, len(down_pool)))])
         
         is_exploratory = False
-        if not target_genes:
+        if len(target) == 0:
             print("  [!] No significant genes for heatmap. Switching to Exploratory Mode (Top Variance).")
-            target_genes = self.log_cpm.var(axis=1).sort_values(ascending=False).head(n_top*2).index.tolist()
+            var = self.log_cpm.var(axis=1).values
+            pool = np.argsort(-var, kind='stable')[:max(n_top*2, pool_size*2)]
+            target = np.arange(min(n_top*2, len(pool)))
             is_exploratory = True
+        if len(target) == 0: return
 
         # Prepare expression data and sort samples by group to create 'four-quadrant' look
         samples_sorted = self.metadata.sort_values('Group').index
-        # Ensure genes exist in log_cpm
-        target_genes = [g for g in target_genes if g in self.log_cpm.index]
-        if not target_genes: return
-        
-        plot_data = self.log_cpm.loc[target_genes, samples_sorted]
+        col_pos = self.log_cpm.columns.get_indexer(samples_sorted)
         
-        # Z-score scaling (along genes/rows) for optimal contrast
-        plot_data_z = plot_data.apply(lambda x: (x - x.mean()) / (x.std() + 1e-9) if x.std() != 0 else x, axis=1)
+        # Vectorized row-wise Z-score (along genes) for optimal contrast; constant rows -> 0
+        pool_vals = self.log_cpm.values[np.ix_(pool, col_pos)].astype(float)
+        mu = pool_vals.mean(axis=1, keepdims=True)
+        sd = pool_vals.std(axis=1, ddof=1, keepdims=True)
+        z_pool = pd.DataFrame((pool_vals - mu) / np.where(sd > 0, sd + 1e-9, 1.0),
+                              index=self.log_cpm.index[pool], columns=samples_sorted)
+        plot_data_z = z_pool.iloc[target]
+        row_linkage = self._row_linkage(z_pool, target) if len(target) > 1 else None
+
+        # Large-heatmap mode: thousands of samples are binned per group before drawing
+        sample_groups = self.metadata.loc[samples_sorted, 'Group']
+        if plot_data_z.shape[1] > max_samples:
+            print(f"  [*] Large-heatmap mode: aggregating {plot_data_z.shape[1]} samples into <= {max_samples} group-wise bins.")
+            plot_data_z, sample_groups = self._aggregate_samples(plot_data_z, sample_groups, max_samples)
         
         # Plot styling
         plt.figure(figsize=(12, 10))
         # We manually build the heatmap to ensure 'four-quadrant' alignment
         g = sns.clustermap(plot_data_z, cmap='RdBu_r', center=0, 
                            col_cluster=False, # Keep our Group sorting
-                           row_cluster=True, 
+                           row_cluster=row_linkage is not None, 
+                           row_linkage=row_linkage,
                            figsize=(12, 10),
-                           yticklabels=True, xticklabels=False,
+                           yticklabels=len(target) <= 100, xticklabels=False,
                            cbar_kws={'label': 'Z-Score Expression'})
         
         # Add Group Annotations (Heatmap side colors)
         health_color = '#4DBBD5'
         cancer_color = '#E64B35'
-        group_colors = self.metadata.loc[samples_sorted, 'Group'].map({'Cancer': cancer_color, 'Healthy': health_color})
+        group_colors = sample_groups.map({'Cancer': cancer_color, 'Healthy': health_color})
         for i, color in enumerate(group_colors):
              g.ax_heatmap.add_patch(plt.Rectangle((i, 0), 1, -0.02, facecolor=color, clip_on=False, transform=g.ax_heatmap.get_xaxis_transform()))
 
@@ -298,53 +497,244 @@ class MasterBioinfoPipeline:
         }
         print(f"  [*] Detected {len(self.sig_genes)} significant genes.")
 
-    def run_wgcna_lite(self):
-        print(f"[3/8] WGCNA: Gene Co-expression Network Analysis...")
-        # Prioritize sig_genes, fallback to top variance
-        if hasattr(self, 'sig_genes') and len(self.sig_genes) >= 20:
-            target_genes = self.sig_genes[:1000] # Cap at 1000 for lite version
-            print(f"  [*] Using {len(target_genes)} Significant Genes for WGCNA.")
+    def _wgcna_traits(self):
+        """Clinical traits for module-trait correlation: Cancer group indicator + numeric metadata columns."""
+        traits = pd.DataFrame({'Cancer Group': (self.metadata['Group'] == 'Cancer').astype(float)}, index=self.metadata.index)
+        for col in self.metadata.columns:
+            if col == 'Group':
+                continue
+            vals = pd.to_numeric(self.metadata[col], errors='coerce')
+            if vals.notna().mean() >= 0.5 and vals.nunique() > 1:
+                traits[col] = vals
+        return traits.loc[self.log_cpm.columns]
+
+    def _wgcna_tom_modules(self, X, power, min_module_size, deep_split, block_size):
+        """TOM backend of run_wgcna_lite. Returns (power, soft-threshold table or None, labels, connectivity)."""
+        import shutil
+        import tempfile
+        from scipy.cluster.hierarchy import linkage
+        import coexpression_engine as ce
+
+        workdir = tempfile.mkdtemp(prefix="wgcna_", dir=self.out_dir)
+        try:
+            cor_path = os.path.join(workdir, "abs_cor.npy")
+            if power is None:
+                power, sft, abs_cor = ce.pick_soft_threshold(X, block_size=block_size, cor_path=cor_path)
+                print(f"  [*] Soft-threshold power selected by scale-free fit: {power} (R^2 = {sft.set_index('Power').loc[power, 'SFT.R.sq']:.2f})")
+            else:
+                sft = None
+                _, _, abs_cor = ce.pick_soft_threshold(X, powers=[power], block_size=block_size, cor_path=cor_path)
+
+            diss, connectivity = ce.blockwise_tom(abs_cor, power, workdir, block_size=block_size)
+            del abs_cor
+            tree = linkage(ce.condensed_from_square(diss, block_size=block_size), method='average')
+            del diss
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        labels = ce.dynamic_tree_cut(tree, min_module_size=min_module_size, deep_split=deep_split)
+        labels = ce.prune_by_kme(X, ce.merge_close_modules(X, labels))
+        return power, sft, labels, connectivity
+
+    def run_wgcna_lite(self, max_genes=5000, power=None, min_module_size=30, deep_split=2, block_size=2000,
+                       backend='tom', knn_k=20, hub_method='degree'):
+        """
+        Co-expression module analysis with two backends:
+        - backend='tom' (default, blockwise WGCNA): soft-threshold selection (scale-free fit) -> adjacency /
+          TOM in float32 gene blocks backed by memmaps -> average-linkage dendrogram on dissTOM -> dynamic
+          tree cut -> eigengene-based module merging / kME pruning.
+        - backend='knn': sparse top-k co-expression graph (networkx) -> community detection -> hub genes by
+          degree / centrality. Memory grows with genes × knn_k, so max_genes can cover the whole transcriptome.
+        Both end with module eigengenes and module-trait correlation against metadata columns.
+
+        max_genes defaults to 5000 because only the TOM is blockwise: the average-linkage dendrogram
+        needs the full condensed dissTOM in memory (n²/2 float64, ~0.1 GB at 5k genes but ~1.6 GB at
+        20k, plus linkage working copies), which interactive / web-app runs cannot assume. Pass
+        max_genes=20000 (or None for all genes) for a transcriptome-scale TOM run on a large machine,
+        or use backend='knn'. Duplicated gene symbols are averaged before gene selection.
+        """
+        import coexpression_engine as ce
+
+        print(f"[3/8] WGCNA: Gene Co-expression Network Analysis ({backend} backend)...")
+        # WGCNA 惯例：按方差筛选基因 (而非仅用 DEG)，上限 max_genes；重复基因名先取均值，保证网络节点唯一
+        expr = self.log_cpm
+        if expr.index.has_duplicates:
+            expr = expr.groupby(level=0, sort=False).mean()
+        target_genes = expr.var(axis=1).sort_values(ascending=False).head(max_genes).index
+        print(f"  [*] Using top {len(target_genes)} variable genes for network construction.")
+        X = expr.loc[target_genes].T.values
+
+        sft = None
+        if backend == 'knn':
+            src, dst, w = ce.knn_coexpression_edges(X, k=knn_k, block_size=block_size)
+            G = ce.knn_graph(list(target_genes), src, dst, w)
+            labels = ce.prune_by_kme(X, ce.graph_modules(G, list(target_genes), min_module_size=min_module_size))
+            connectivity = np.array([d for _, d in G.degree(list(target_genes), weight='weight')])
+            self.wgcna_graph = G
+            self.wgcna_hubs = ce.hub_genes(G, list(target_genes), labels, method=hub_method)
+            self.wgcna_hubs.to_csv(os.path.join(self.out_dir, "WGCNA_HubGenes.csv"), index=False)
+            print(f"  [*] kNN graph: {G.number_of_nodes()} genes, {G.number_of_edges()} edges (k = {knn_k}).")
         else:
-            target_genes = self.log_cpm.var(axis=1).sort_values(ascending=False).head(500).index
-            print(f"  [*] No sufficient DEGs found. Using top 500 variable genes.")
-            
-        mat = self.log_cpm.loc[target_genes].T
-        
-        # Correlation-based clustering (Power = 6 simulation)
-        corr = mat.corr()
-        cluster = AgglomerativeClustering(n_clusters=4)
-        modules = cluster.fit_predict(corr)
-        
-        # Module-Trait Heatmap (Mock)
-        module_colors = ['Turquoise', 'Blue', 'Brown', 'Yellow']
-        trait_corr = np.random.uniform(-0.8, 0.8, (4, 1))
-        
-        plt.figure(figsize=(5, 6))
-        sns.heatmap(trait_corr, annot=True, cmap='RdBu_r', yticklabels=module_colors, xticklabels=['Cancer Group'])
+            power, sft, labels, connectivity = self._wgcna_tom_modules(X, power, min_module_size, deep_split, block_size)
+
+        colors = ce.label_colors(labels)
+        self.wgcna_modules = pd.Series(colors, index=target_genes, name='Module')
+        self.wgcna_connectivity = pd.Series(connectivity, index=target_genes, name='kTotal')
+        self.wgcna_modules.to_frame().assign(kTotal=self.wgcna_connectivity).to_csv(os.path.join(self.out_dir, "WGCNA_Modules.csv"))
+
+        # Soft-threshold diagnostics
+        if sft is not None:
+            fig, axes = plt.subplots(1, 2, figsize=(11, 5))
+            axes[0].plot(sft['Power'], sft['SFT.R.sq'], 'o-', color='#E64B35')
+            axes[0].axhline(0.85, color='gray', linestyle='--', linewidth=1)
+            axes[0].axvline(power, color='black', linestyle=':', linewidth=1)
+            axes[0].set_xlabel("Soft Threshold (power)")
+            axes[0].set_ylabel("Scale Free Topology Fit (signed R²)")
+            axes[0].set_title("Scale Independence")
+            axes[1].plot(sft['Power'], sft['mean.k'], 'o-', color='#4DBBD5')
+            axes[1].set_xlabel("Soft Threshold (power)")
+            axes[1].set_ylabel("Mean Connectivity")
+            axes[1].set_title("Mean Connectivity")
+            plt.tight_layout()
+            self._save_fig("Fig3a_WGCNA_SoftThreshold", "WGCNA Soft-Threshold Selection",
+                           f"Scale-free topology fit across soft-threshold powers; power = {power} was selected.")
+
+        mods = [m for m in np.unique(labels) if m != 0]
+        if not mods:
+            print("  [!] No co-expression module reached the minimum module size.")
+            self._report_summary['wgcna'] = {'backend': backend, 'power': power, 'n_genes': len(target_genes), 'n_modules': 0}
+            return
+
+        me, mods = ce.module_eigengenes(X, labels)
+        module_names = [f"ME{ce.label_colors([m])[0]}" for m in mods]
+        self.wgcna_eigengenes = pd.DataFrame(me, index=self.log_cpm.columns, columns=module_names)
+        traits = self._wgcna_traits()
+        r, pv = ce.module_trait_correlation(me, traits.values)
+        self.wgcna_trait_corr = pd.DataFrame(r, index=module_names, columns=traits.columns)
+
+        # Module-Trait Heatmap (real correlations)
+        annot = np.array([[f"{r[i, j]:.2f}\n({pv[i, j]:.1e})" if np.isfinite(r[i, j]) else "NA"
+                           for j in range(r.shape[1])] for i in range(r.shape[0])])
+        plt.figure(figsize=(2.2 + 1.6 * r.shape[1], 1.5 + 0.5 * r.shape[0]))
+        sns.heatmap(self.wgcna_trait_corr, annot=annot, fmt='', cmap='RdBu_r', center=0, vmin=-1, vmax=1,
+                    annot_kws={'size': 8}, cbar_kws={'label': 'Pearson r'})
         plt.title("WGCNA: Module-Trait Relationships")
-        self._save_fig("Fig3_WGCNA", "WGCNA Module-Trait Heatmap", "Identification of gene co-expression modules and their correlation with clinical status.")
+        sizes = pd.Series(colors[labels != 0]).value_counts()
+        network = f"soft power = {power}" if backend != 'knn' else f"kNN graph, k = {knn_k}"
+        self._save_fig("Fig3_WGCNA", "WGCNA Module-Trait Heatmap",
+                       f"{len(mods)} co-expression modules ({network}) from {len(target_genes)} genes; "
+                       f"cells show eigengene-trait correlation and p-value.")
+
+        best = np.nanargmax(np.abs(r[:, 0])) if np.isfinite(r[:, 0]).any() else 0
+        self._report_summary['wgcna'] = {
+            'backend': backend,
+            'power': power,
+            'n_genes': len(target_genes),
+            'n_modules': len(mods),
+            'module_sizes': {k: int(v) for k, v in sizes.items()},
+            'top_module': module_names[best],
+            'top_module_r': float(r[best, 0]),
+            'top_module_p': float(pv[best, 0]),
+        }
+        if backend == 'knn':
+            top_color = module_names[best][2:]
+            self._report_summary['wgcna']['hub_genes'] = self.wgcna_hubs.loc[self.wgcna_hubs['Module'] == top_color, 'Gene'].tolist()
+
+    def run_cibersort_lite(self, signature_path=None, method='nnls', n_jobs=None, n_perm=500):
+        """
+        Immune infiltration deconvolution against an LM22-format signature matrix.
+        signature_path 默认读取环境变量 OPENCLAW_LM22_PATH，否则为当前目录下的 LM22.txt。
+        method: 'nnls' (batched non-negative least squares, default) or 'nusvr' (CIBERSORT nu-SVR).
+        n_perm: random mixtures for the per-sample permutation p-value; one null per cohort, drawn
+        from its own mixture values as in CIBERSORT and cached on disk for re-runs; 0 disables it.
+        """
+        import deconvolution_engine as de
 
-    def run_cibersort_lite(self):
         print("[4/8] CIBERSORT: Immune Infiltration Deconvolution...")
-        cell_types = ['T cells CD8', 'B cells', 'Macrophages M1', 'Macrophages M2', 'NK cells', 'Neutrophils']
-        n_samples = self.metadata.shape[0]
-        
-        # Simulate infiltration proportions
-        base = np.random.dirichlet(np.ones(len(cell_types)), n_samples)
-        # Shift Macrophages M1 in Cancer group
-        base[n_samples//2:, 2] *= 2.5
-        comp = pd.DataFrame(base, columns=cell_types, index=self.metadata.index)
-        comp = comp.div(comp.sum(axis=1), axis=0)
-        
+        signature_path = signature_path or os.environ.get("OPENCLAW_LM22_PATH", "LM22.txt")
+        if not os.path.exists(signature_path):
+            print(f"  [!] Skipping deconvolution: signature matrix not found ({signature_path}).")
+            return
+
+        sig = de.load_signature_matrix(signature_path)
+        result, prepared = de.deconvolve(sig, self.log_cpm, method=method, n_jobs=n_jobs, n_perm=n_perm)
+        print(f"  [*] {len(prepared['genes'])}/{sig.shape[0]} signature genes matched; {result.shape[0]} samples solved ({method}).")
+        result.to_csv(os.path.join(self.out_dir, "CIBERSORT_Fractions.csv"))
+        comp = result[prepared['cell_types']]
+        self.immune_fractions = comp
+        n_sig_fit = None
+        if n_perm:
+            n_sig_fit = int((result['P-value'] < 0.05).sum())
+            print(f"  [*] Permutation test ({n_perm} random mixtures): {n_sig_fit}/{len(result)} samples with deconvolution p < 0.05.")
+
+        # Group comparison per cell type (Cancer vs Healthy)
+        groups = self.metadata.loc[comp.index, 'Group']
+        rows = []
+        for ct in comp.columns:
+            c_vals = comp.loc[groups == 'Cancer', ct]
+            h_vals = comp.loc[groups == 'Healthy', ct]
+            p = stats.mannwhitneyu(c_vals, h_vals).pvalue if len(c_vals) and len(h_vals) and comp[ct].nunique() > 1 else np.nan
+            rows.append({'CellType': ct, 'Mean_Cancer': c_vals.mean(), 'Mean_Healthy': h_vals.mean(), 'pvalue': p})
+        diff = pd.DataFrame(rows).set_index('CellType').sort_values('pvalue')
+        self.immune_diff = diff
+
+        order = self.metadata.loc[comp.index].sort_values('Group').index
         plt.figure(figsize=(10, 6))
-        comp.plot(kind='bar', stacked=True, ax=plt.gca(), width=0.8, color=sns.color_palette("Set3"))
-        plt.legend(bbox_to_anchor=(1, 1))
+        palette = sns.color_palette("tab20", comp.shape[1])
+        if len(order) <= 200:
+            comp.loc[order].plot(kind='bar', stacked=True, ax=plt.gca(), width=0.8, color=palette, legend=False)
+        else:
+            # Large cohorts: one filled polygon per cell type instead of n_samples × n_cells bars
+            plt.stackplot(np.arange(len(order)), comp.loc[order].values.T, labels=comp.columns, colors=palette, step='mid')
+            plt.xlim(0, len(order) - 1)
+        plt.legend(bbox_to_anchor=(1, 1), fontsize=7, frameon=False)
         plt.title("Immune Cell Composition (CIBERSORT)")
         plt.xticks([])
-        self._save_fig("Fig4_CIBERSORT", "Immune Infiltration Panorama", "Estimated proportions of 6 immune cell types across all samples.")
+        plt.xlabel("Samples (sorted by Group)")
+        plt.ylabel("Estimated Fraction")
+        self._save_fig("Fig4_CIBERSORT", "Immune Infiltration Panorama",
+                       f"Estimated proportions of {comp.shape[1]} immune cell types across all samples ({method} deconvolution).")
+
+        top = diff.dropna().head(5)
+        self._report_summary['immune'] = {
+            'method': method,
+            'n_signature_genes': len(prepared['genes']),
+            'n_perm': n_perm,
+            'n_samples_p05': n_sig_fit,
+            'top_diff_cells': [{'cell_type': ct, 'mean_cancer': float(r['Mean_Cancer']),
+                                'mean_healthy': float(r['Mean_Healthy']), 'pvalue': float(r['pvalue'])}
+                               for ct, r in top.iterrows()],
+        }
 
-    def run_advanced_ml(self):
+    def _feature_matrix(self, genes, features='genes', expr=None):
+        """
+        Features × samples for ML / survival models: 'genes' (rows of expr), 'pathways'
+        (ssGSEA scores from run_pathway_scores) or 'both'. An external expr is scored with the
+        same library and pathway set as the training cohort.
+        """
+        import ml_engine as me
+        expr = self.log_cpm if expr is None else expr
+        if features != 'genes' and self.pathway_scores is None:
+            self.run_pathway_scores()
+        # Gene rows: one per normalized symbol (GEO-mapped symbols are often duplicated), the same
+        # collapsing the model bundle applies at scoring time
+        gene_rows = me.collapse_symbols(expr).reindex(pd.unique(me.normalize_symbols(genes)))
+        if features == 'genes' or self.pathway_scores is None:
+            if features != 'genes':
+                print("  [!] Pathway scores unavailable; falling back to gene features.")
+            return gene_rows
+        if expr is self.log_cpm:
+            scores = self.pathway_scores
+        else:
+            import enrichment_engine as ee
+            scores = ee.ssgsea_scores(expr, self.pathway_library, min_size=1, max_size=np.inf).reindex(self.pathway_scores.index)
+        scores = scores.reindex(columns=expr.columns)
+        return scores if features == 'pathways' else pd.concat([gene_rows, scores])
+
+    def run_advanced_ml(self, n_trees=200, nested_cv=True, cv_jobs=None, tune=True, tune_budget=60.0,
+                        stability=True, n_subsamples=200, stability_threshold=0.6, features='genes'):
         print("[5/8] Advanced ML: Dual-Model Feature Selection (RF + L1-Logistic)...")
+        import ml_engine as me
         from sklearn.linear_model import LogisticRegression
         from sklearn.model_selection import train_test_split
         from sklearn.metrics import roc_curve, auc
@@ -357,7 +747,9 @@ class MasterBioinfoPipeline:
             target_genes = self.log_cpm.var(axis=1).sort_values(ascending=False).head(2000).index
 
         print(f"  [*] Screening identified {len(target_genes)} genes for ML modeling.")
-        X = self.log_cpm.loc[target_genes].T.fillna(0.0)
+        X = self._feature_matrix(target_genes, features).T.fillna(0.0)
+        if features != 'genes':
+            print(f"  [*] Feature mode '{features}': {X.shape[1]} features.")
         y = (self.metadata['Group'] == 'Cancer').astype(int)
 
         # Flexible ML Strategy with Cross-Dataset Robustness
@@ -375,7 +767,7 @@ class MasterBioinfoPipeline:
             X_train = pd.DataFrame(scaler.fit_transform(X_train_raw), index=X_train_raw.index, columns=X_train_raw.columns)
             
             # Independent scaling for External Validation set (Crucial for Batch Effect removal)
-            X_test_raw_full = external_val.loc[target_genes].T.fillna(0.0)
+            X_test_raw_full = self._feature_matrix(target_genes, features, external_val).T.fillna(0.0)
             y_test = (external_meta['Group'] == 'Cancer').astype(int)
             
             # Using independent scaler for test to align distributions
@@ -383,12 +775,12 @@ class MasterBioinfoPipeline:
             X_test = pd.DataFrame(test_scaler.fit_transform(X_test_raw_full), index=X_test_raw_full.index, columns=X_test_raw_full.columns)
             
             # BIOLOGICAL CHECK: Check if top genes change in the same direction
-            common_genes = list(set(self.sig_genes) & set(target_genes))[:20]
+            # (on the collapsed feature matrices, so duplicated symbols cannot misalign the two cohorts)
+            common_genes = [g for g in pd.unique(me.normalize_symbols(self.sig_genes)) if g in X.columns][:20]
             if common_genes:
-                train_dir = self.log_cpm.loc[common_genes, self.metadata['Group']=='Cancer'].mean(axis=1) - \
-                            self.log_cpm.loc[common_genes, self.metadata['Group']=='Healthy'].mean(axis=1)
-                test_dir = external_val.loc[common_genes, external_meta['Group']=='Cancer'].mean(axis=1) - \
-                           external_val.loc[common_genes, external_meta['Group']=='Healthy'].mean(axis=1)
+                train_dir = X.loc[y == 1, common_genes].mean() - X.loc[y == 0, common_genes].mean()
+                test_dir = X_test_raw_full.loc[y_test == 1, common_genes].mean() - \
+                           X_test_raw_full.loc[y_test == 0, common_genes].mean()
                 
                 # Correlation of log2FC between datasets
                 dir_corr = np.corrcoef(train_dir, test_dir)[0, 1]
@@ -409,30 +801,41 @@ class MasterBioinfoPipeline:
             X_test = pd.DataFrame(scaler.transform(X_test_split), index=X_test_split.index, columns=X_test_split.columns)
             self._ml_is_external = False
 
+        # --- 超参数搜索 (successive halving)：每个 (数据集, 特征矩阵) 只搜一次，最优配置持久化，同一输入重跑直接复用 ---
+        # 特征列随 DEG 阈值变化，键中必须带矩阵指纹，否则会复用在另一组特征上调出的参数
+        tuned = {}
+        if tune:
+            print("  [*] Hyperparameter search (successive halving)...")
+            tune_key = f"{self.dataset_id}_{_matrix_fingerprint(X)[:16]}" if self.dataset_id else _matrix_fingerprint(X)
+            tuned = me.tuned_params(tune_key, X_train.values, y_train.values,
+                                    time_budget=tune_budget, n_jobs=cv_jobs)
+
         # --- Method 1: L1 逻辑回归（等价于 LASSO 二分类，输出为概率，适合 ROC）---
-        print("  [*] Running L1-Logistic (LASSO 二分类)...")
-        l1_logistic = LogisticRegression(
-            penalty='l1', solver='saga', max_iter=3000, C=0.1, random_state=42
-        ).fit(X_train, y_train)
-        # 交叉验证选 C（可选，这里用固定 C 保证稳定）
+        # 正则化路径只算一次：每折沿 C 网格 warm start，各折并行；refit 后的最优 C 模型直接用于系数、图与 ROC
+        print("  [*] Running L1-Logistic (LASSO 二分类, CV-selected C)...")
         from sklearn.linear_model import LogisticRegressionCV
-        l1_cv = LogisticRegressionCV(
-            Cs=10, penalty='l1', solver='saga', cv=3, max_iter=2000, random_state=42
+        l1_tuned = tuned.get('l1', {}).get('params', {})
+        # 粗搜得到的 C 只定中心，CV 在其上下各一个数量级内细化
+        Cs = np.logspace(np.log10(l1_tuned['C']) - 1, np.log10(l1_tuned['C']) + 1, 10) if 'C' in l1_tuned else 10
+        l1_logistic = LogisticRegressionCV(
+            Cs=Cs, penalty='l1', solver='saga', cv=3, scoring='roc_auc', max_iter=3000,
+            class_weight=l1_tuned.get('class_weight'), refit=True, n_jobs=-1, random_state=42
         ).fit(X_train, y_train)
-        best_C = np.atleast_1d(l1_cv.C_)[0]
+        best_C = float(np.atleast_1d(l1_logistic.C_)[0])
 
-        # L1 系数路径示意（用最终模型非零系数数量）
         nz = np.sum(np.abs(l1_logistic.coef_) > 1e-5)
-        print(f"  [*] L1 非零系数数量: {nz}")
+        print(f"  [*] L1 最优 C = {best_C:.4g}, 非零系数数量: {nz}")
 
-        # LASSO/L1 CV 图（用 LogisticRegressionCV 的分数代替）
         plt.figure(figsize=(7, 6))
-        score_key = 1 if 1 in l1_cv.scores_ else list(l1_cv.scores_.keys())[0]
-        plt.semilogx(l1_cv.Cs_, l1_cv.scores_[score_key].mean(axis=0), 'o-', color='red')
+        score_key = 1 if 1 in l1_logistic.scores_ else list(l1_logistic.scores_.keys())[0]
+        cv_scores = l1_logistic.scores_[score_key]
+        cv_mean, cv_sd = cv_scores.mean(axis=0), cv_scores.std(axis=0)
+        plt.semilogx(l1_logistic.Cs_, cv_mean, 'o-', color='red')
+        plt.fill_between(l1_logistic.Cs_, cv_mean - cv_sd, cv_mean + cv_sd, color='red', alpha=0.15)
         plt.axvline(best_C, color='black', linestyle='--', label=f'Best C={best_C:.4f}')
-        plt.title("L1-Logistic CV (Mean Accuracy vs C)")
+        plt.title("L1-Logistic CV (Mean AUC vs C)")
         plt.xlabel("C (Inverse Regularization)")
-        plt.ylabel("Mean Accuracy")
+        plt.ylabel("Mean CV AUC (± SD)")
         plt.legend()
         self._save_fig("Fig5a_Lasso_CV", "L1-Logistic CV", "Cross-validation to select regularization strength C.")
 
@@ -452,27 +855,49 @@ class MasterBioinfoPipeline:
         else:
             print("  [!] No non-zero coefficients found for L1-Logistic.")
 
+        # 稳定性选择：单次 L1 拟合的系数随划分波动大，改用数百次半抽样的入选频率确定稳定基因面板
+        stab_info = None
+        if stability:
+            print(f"  [*] Stability selection ({n_subsamples} half-subsamples)...")
+            stab_table, stab_info = me.stability_selection(
+                X_train.values, y_train.values, n_subsamples=n_subsamples,
+                threshold=stability_threshold, n_jobs=cv_jobs, feature_names=X_train.columns)
+            self.stable_panel = list(stab_table.index[stab_table['stable']])
+            stab_table.to_csv(os.path.join(self.out_dir, "ML_Stability_Selection.csv"))
+            print(f"  [*] Stable panel: {len(self.stable_panel)} genes (E[false selections] ≤ {stab_info['expected_false_selections']:.2f})")
+
+            top = stab_table.head(20).iloc[::-1]
+            plt.figure(figsize=(8, 7))
+            plt.barh(range(len(top)), top['stability'], color=np.where(top['stable'], NPG_COLORS[0], '#BBBBBB'), alpha=0.85)
+            plt.axvline(stability_threshold, color='black', linestyle='--', linewidth=1, label=f'Threshold = {stability_threshold}')
+            plt.yticks(range(len(top)), top.index)
+            plt.xlim(0, 1.02)
+            plt.xlabel("Selection Frequency (max over C)")
+            plt.title("L1-Logistic Stability Selection")
+            plt.legend(loc='lower right', frameon=False)
+            self._save_fig("Fig5b2_Stability", "L1 Stability Selection",
+                           f"Selection frequency over {n_subsamples} stratified half-subsamples; {len(self.stable_panel)} genes pass the stability threshold.")
+        else:
+            # 上一次的稳定面板基于另一组特征，不能沿用到下游 LASSO-Cox
+            self.stable_panel = []
+
         # --- Method 2: Random Forest ---
         print("  [*] Running Random Forest...")
-        rf_eval = RandomForestClassifier(n_estimators=1, warm_start=True, oob_score=True, random_state=42)
-        error_rates = []
-        tree_range = range(10, 201, 10)
-        for n in tree_range:
-            rf_eval.set_params(n_estimators=n)
-            rf_eval.fit(X_train, y_train)
-            error_rates.append(1 - rf_eval.oob_score_)
+        # 一次训练最大规模森林；收敛曲线由逐树 OOB 预测增量累积得到，森林复用于重要性与 ROC
+        rf_params = {'n_estimators': n_trees, **tuned.get('rf', {}).get('params', {})}
+        rf = RandomForestClassifier(n_jobs=-1, random_state=42, **rf_params)
+        rf.fit(X_train, y_train)
+        error_rates = me.staged_oob_error(rf, X_train, y_train)
+        tree_range = np.arange(1, rf.n_estimators + 1)
 
         plt.figure(figsize=(7, 6))
-        plt.plot(tree_range, error_rates, 'k-', marker='o', markersize=4, label='OOB Error Rate')
+        plt.plot(tree_range, error_rates, 'k-', linewidth=1.2, label='OOB Error Rate')
         plt.title("Random Forest Error Rates (Convergence Analysis)")
         plt.xlabel("Number of Trees")
         plt.ylabel("OOB Error")
         plt.grid(True, alpha=0.3)
         self._save_fig("Fig5c1_RF_Error", "RF Error Convergence", "Out-of-bag error stabilization as trees are added to the forest.")
 
-        rf = RandomForestClassifier(n_estimators=100, random_state=42)
-        rf.fit(X_train, y_train)
-
         # RF Importance (on training data for interpretation)
         imp = pd.Series(rf.feature_importances_, index=X.columns).sort_values(ascending=False).head(15)
         plt.figure(figsize=(8, 6))
@@ -484,40 +909,339 @@ class MasterBioinfoPipeline:
         self._save_fig("Fig5c2_RF_Imp", "RF Feature Importance", "Ranking of top genes based on their contribution to sample classification.")
 
         # --- ROC 均在测试集上计算，避免“和猜没区别”的 0.5 错觉 ---
-        plt.figure(figsize=(6, 6))
         y_prob_rf = rf.predict_proba(X_test)[:, 1]
-        fpr_rf, tpr_rf, _ = roc_curve(y_test, y_prob_rf)
-        auc_rf = auc(fpr_rf, tpr_rf)
-        plt.plot(fpr_rf, tpr_rf, label=f'Random Forest (AUC = {auc_rf:.3f})', color='blue')
         y_prob_l1 = l1_logistic.predict_proba(X_test)[:, 1]
+        fpr_rf, tpr_rf, _ = roc_curve(y_test, y_prob_rf)
         fpr_l1, tpr_l1, _ = roc_curve(y_test, y_prob_l1)
-        auc_l1 = auc(fpr_l1, tpr_l1)
-        plt.plot(fpr_l1, tpr_l1, label=f'L1-Logistic (AUC = {auc_l1:.3f})', color='red', linestyle='--')
+        auc_rf, auc_l1 = auc(fpr_rf, tpr_rf), auc(fpr_l1, tpr_l1)
+        # 配对分层 bootstrap (一次性生成全部重抽样索引) 给出 95% CI；DeLong 检验比较两模型 AUC
+        auc_ci = me.bootstrap_auc_ci(y_test, {'rf': y_prob_rf, 'l1': y_prob_l1}, n_boot=2000)
+        delong = me.delong_test(y_test, y_prob_rf, y_prob_l1)
+        print(f"  [*] AUC RF = {auc_rf:.3f} ({auc_ci['rf']['ci_low']:.3f}-{auc_ci['rf']['ci_high']:.3f}), "
+              f"L1 = {auc_l1:.3f} ({auc_ci['l1']['ci_low']:.3f}-{auc_ci['l1']['ci_high']:.3f}), DeLong p = {delong['pvalue']:.3g}")
 
+        plt.figure(figsize=(6, 6))
+        plt.plot(fpr_rf, tpr_rf, color='blue',
+                 label=f"Random Forest (AUC = {auc_rf:.3f}, 95% CI {auc_ci['rf']['ci_low']:.3f}-{auc_ci['rf']['ci_high']:.3f})")
+        plt.plot(fpr_l1, tpr_l1, color='red', linestyle='--',
+                 label=f"L1-Logistic (AUC = {auc_l1:.3f}, 95% CI {auc_ci['l1']['ci_low']:.3f}-{auc_ci['l1']['ci_high']:.3f})")
         plt.plot([0, 1], [0, 1], 'k--', alpha=0.5)
+        plt.text(0.98, 0.14, f"DeLong RF vs L1: p = {delong['pvalue']:.3g}", ha='right', fontsize=9,
+                 transform=plt.gca().transAxes)
         plt.xlabel('False Positive Rate (1-Specificity)')
         plt.ylabel('True Positive Rate (Sensitivity)')
         plt.title('Multi-Model ROC (Test Set)')
-        plt.legend(loc='lower right')
-        self._save_fig("Fig5d_ROC", "Multi-Model ROC Analysis", "ROC on held-out test set; AUC > 0.5 indicates discriminative ability.")
+        plt.legend(loc='lower right', fontsize=8)
+        self._save_fig("Fig5d_ROC", "Multi-Model ROC Analysis",
+                       "ROC on held-out test set with stratified bootstrap 95% CIs (2000 replicates); DeLong test compares the two AUCs.")
 
-        self.top_gene = imp.index[0]
-        self._report_summary['ml'] = {'auc_rf': float(auc_rf), 'auc_l1': float(auc_l1)}
+        # 通路特征模式下 top_gene 仍取重要性最高的基因 (供 KM / 报告使用)
+        self.top_gene = next((f for f in imp.index if f in self.log_cpm.index), imp.index[0] if features == 'genes' else self.top_gene)
+        self._report_summary['ml'] = {'auc_rf': float(auc_rf), 'auc_l1': float(auc_l1), 'l1_C': best_C, 'l1_n_nonzero': int(nz),
+                                      'auc_rf_ci': [auc_ci['rf']['ci_low'], auc_ci['rf']['ci_high']],
+                                      'auc_l1_ci': [auc_ci['l1']['ci_low'], auc_ci['l1']['ci_high']],
+                                      'delong_p': delong['pvalue']}
+        # 模型包持久化：特征列表 + 标准化参数 + 模型权重 + 基因对齐表，新队列可直接打分无需重跑流程
+        if features == 'genes':
+            self.model_bundle_path = me.save_model_bundle(
+                os.path.join(self.out_dir, "ML_Model_Bundle.joblib"), X.columns, scaler, {'rf': rf, 'l1': l1_logistic},
+                scaling='per_cohort' if self._ml_is_external else 'train',
+                metadata={'dataset_id': self.dataset_id, 'n_train': int(len(y_train)), 'auc_rf': float(auc_rf),
+                          'auc_l1': float(auc_l1), 'l1_C': best_C})
+            print(f"  [*] Model bundle saved: {self.model_bundle_path}")
+        else:
+            print("  [*] Model bundle skipped: bundles score gene-level features only (features='genes').")
+
+        if stab_info:
+            self._report_summary['ml']['stable_panel'] = self.stable_panel[:30]
+            self._report_summary['ml']['stability'] = stab_info
+        if tuned:
+            self._report_summary['ml']['tuned_params'] = {m: r['params'] for m, r in tuned.items()}
+
+        # --- 嵌套交叉验证基准：单次划分 AUC 在 GEO 规模队列上波动大，用外层折均值 + 95% CI 评估并自动选模 ---
+        if nested_cv:
+            print("  [*] Nested CV benchmark (RF / L1-Logistic / Linear SVM / HistGradientBoosting)...")
+            cv_summary, cv_folds, winner = me.nested_cv_benchmark(X.values, y.values, n_jobs=cv_jobs)
+            self.ml_benchmark = cv_summary
+            cv_summary.to_csv(os.path.join(self.out_dir, "ML_NestedCV_Summary.csv"))
+            cv_folds.to_csv(os.path.join(self.out_dir, "ML_NestedCV_Folds.csv"), index=False)
+
+            plt.figure(figsize=(7, 5))
+            order = list(cv_summary.index)
+            for i, name in enumerate(order):
+                fold_auc = cv_folds.loc[cv_folds['model'] == name, 'auc']
+                plt.scatter(np.full(len(fold_auc), i) + np.linspace(-0.12, 0.12, len(fold_auc)), fold_auc,
+                            color='grey', alpha=0.6, s=20, zorder=2)
+                row = cv_summary.loc[name]
+                plt.errorbar(i, row['mean_auc'], yerr=[[row['mean_auc'] - row['ci_low']], [row['ci_high'] - row['mean_auc']]],
+                             fmt='o', color=NPG_COLORS[0] if name == winner else NPG_COLORS[1], markersize=9, capsize=6, zorder=3)
+            plt.axhline(0.5, color='black', linestyle='--', alpha=0.5)
+            plt.xticks(range(len(order)), cv_summary['label'], rotation=15)
+            plt.ylabel("Outer-fold ROC-AUC")
+            plt.title("Nested CV Model Benchmark (mean ± 95% CI)")
+            self._save_fig("Fig5e_NestedCV", "Nested CV Model Benchmark",
+                           f"Outer-fold AUC of four classifiers with inner-fold tuning; best model: {cv_summary.loc[winner, 'label']}.")
+
+            self._report_summary['ml']['best_model'] = cv_summary.loc[winner, 'label']
+            self._report_summary['ml']['nested_cv'] = {
+                row['label']: {'mean_auc': float(row['mean_auc']), 'ci_low': float(row['ci_low']), 'ci_high': float(row['ci_high'])}
+                for _, row in cv_summary.iterrows()
+            }
+
+    def score_cohort(self, expr, name="external", bundle_path=None, batch_size=5000):
+        """Score a new expression matrix (genes × samples) with the persisted RF / L1 model bundle."""
+        import ml_engine as me
+        bundle_path = bundle_path or self.model_bundle_path
+        if not bundle_path or not os.path.exists(bundle_path):
+            print("  [!] No model bundle found. Run run_advanced_ml first or pass bundle_path.")
+            return None, None
+        scores, report = me.score_expression(bundle_path, expr, batch_size=batch_size)
+        scores.to_csv(os.path.join(self.out_dir, f"ML_Scores_{name}.csv"))
+        print(f"  [*] Scored {report['n_samples']} samples of {name} ({report['n_missing']} model genes imputed).")
+        return scores, report
+
+    def _survival_data(self):
+        """(time, event) Series aligned to log_cpm samples, or None when the metadata carries no survival columns."""
+        for t_col, e_col in [('Survival', 'Status'), ('Survival_Time', 'Status'), ('OS_time', 'OS_event')]:
+            if t_col in self.metadata.columns and e_col in self.metadata.columns:
+                surv = self.metadata.loc[self.log_cpm.columns, [t_col, e_col]].apply(pd.to_numeric, errors='coerce').dropna()
+                if len(surv) >= 10 and surv[e_col].sum() > 0:
+                    return surv[t_col], surv[e_col].astype(int)
+        print("  [!] No usable survival columns (Survival/Status) in metadata; skipping survival analysis.")
+        return None
+
+    def run_cox_screen(self, genes=None, fdr=0.05, features='genes'):
+        """Genome-wide univariate Cox screen (batched Newton–Raphson over all genes and/or pathway scores)."""
+        print("[6/8] Genome-wide Univariate Cox Screen...")
+        import survival_engine as se
+        surv = self._survival_data()
+        if surv is None:
+            return None
+        time_, event = surv
+        expr = self._feature_matrix(genes if genes is not None else self.log_cpm.index, features).loc[:, time_.index]
+        expr = expr[expr.var(axis=1) > 0]
+        cox = se.cox_univariate(expr, time_.values, event.values)
+        cox = cox.sort_values('pvalue')
+        self.cox_screen = cox
+        cox.to_csv(os.path.join(self.out_dir, "Survival_Cox_Screen.csv"))
+        n_sig = int((cox['padj'] < fdr).sum())
+        print(f"  [*] Cox screen: {len(cox)} genes, {n_sig} with FDR < {fdr}")
+
+        plt.figure(figsize=(7, 6))
+        lhr = np.log2(cox['HR'].clip(1e-6, 1e6))
+        nlp = -np.log10(cox['pvalue'].clip(1e-300))
+        sig = (cox['padj'] < fdr).values
+        colors = np.where(~sig, '#BBBBBB', np.where(lhr > 0, NPG_COLORS[0], NPG_COLORS[1]))
+        plt.scatter(lhr, nlp, c=colors, s=12, alpha=0.7, edgecolors='none', rasterized=True)
+        for g in cox.index[:8]:
+            plt.text(lhr[g], nlp[g], g, fontsize=7)
+        plt.axvline(0, color='gray', linestyle='--', linewidth=1)
+        plt.xlabel("log2 Hazard Ratio (per log2 expression unit)")
+        plt.ylabel("-log10 Wald p")
+        plt.title("Univariate Cox Screen")
+        self._save_fig("Fig6a_Cox_Screen", "Genome-wide Cox Screen",
+                       f"Univariate Cox regression for {len(cox)} genes; {n_sig} prognostic genes at FDR < {fdr} (red: risk, blue: protective).")
+
+        top = cox.head(10)
+        self._report_summary['survival'] = {
+            **self._report_summary.get('survival', {}),
+            'n_genes_cox': int(len(cox)), 'n_cox_sig': n_sig, 'cox_fdr': fdr,
+            'top_cox': [{'gene': g, 'HR': float(r['HR']), 'HR_lower': float(r['HR_lower']), 'HR_upper': float(r['HR_upper']),
+                         'pvalue': float(r['pvalue']), 'padj': float(r['padj'])} for g, r in top.iterrows()],
+        }
+        return cox
+
+    def run_survival_model(self, max_features=200, l1_ratio=1.0, n_folds=5, n_jobs=None, features='genes'):
+        """Multi-gene prognostic signature: elastic-net Cox on the ML-selected genes with CV-chosen penalty."""
+        print("[6/8] Penalized Cox Risk Model (LASSO-Cox)...")
+        import survival_engine as se
+        surv_data = self._survival_data()
+        if surv_data is None:
+            return None
+        time_, event = surv_data
+
+        # 候选基因：稳定性面板 ∪ 差异基因，按单因素 Cox p 值排序截取 (无 Cox 结果时按方差)
+        feats = self._feature_matrix(self.log_cpm.index, features)
+        genes = list(dict.fromkeys(list(self.stable_panel) + list(self.sig_genes)))
+        if features != 'genes' and self.pathway_scores is not None:
+            genes += list(self.pathway_scores.index)
+        genes = [g for g in genes if g in feats.index]
+        if len(genes) < 5:
+            genes = list(feats.var(axis=1).sort_values(ascending=False).head(2000).index)
+        if self.cox_screen is not None:
+            genes = list(self.cox_screen['pvalue'].reindex(genes).sort_values().index[:max_features])
+        else:
+            genes = list(feats.loc[genes].var(axis=1).sort_values(ascending=False).index[:max_features])
+        X = feats.loc[genes, time_.index].T.fillna(0.0).values
+
+        cv = se.coxnet_cv(X, time_.values, event.values, l1_ratio=l1_ratio, n_folds=n_folds, n_jobs=n_jobs)
+        coef = pd.Series(cv['coef'], index=genes)
+        coef = coef[coef != 0].sort_values(key=np.abs, ascending=False)
+        risk = pd.Series((X - cv['path']['mean']) @ cv['coef'], index=time_.index)
+        self.risk_score = risk
+        self.coxnet_coef = coef
+        coef.rename('coef').to_csv(os.path.join(self.out_dir, "Survival_CoxNet_Coefficients.csv"))
+        pd.DataFrame({'risk_score': risk, 'oof_risk_score': cv['oof_risk'], 'time': time_, 'event': event}).to_csv(
+            os.path.join(self.out_dir, "Survival_RiskScore.csv"))
+
+        # 区分度：交叉验证 (折外) 风险分的 C-index 与时间依赖 AUC，另附全数据拟合的表观 C-index
+        c_cv = se.concordance_index(time_.values, event.values, cv['oof_risk'])
+        c_app = se.concordance_index(time_.values, event.values, risk.values)
+        horizons = np.quantile(time_.values[event.values == 1], [0.25, 0.5, 0.75])
+        td_auc = se.time_dependent_auc(time_.values, event.values, cv['oof_risk'], horizons)
+        print(f"  [*] LASSO-Cox: {len(coef)} genes at lambda={cv['best_lambda']:.4g}; C-index CV = {c_cv:.3f} (apparent {c_app:.3f})")
+
+        lam = np.log10(cv['lambdas'])
+        cvl = cv['cvl'].sum(axis=0)
+        nz = (cv['path']['coefs'] != 0).sum(axis=1)
+        fig, ax = plt.subplots(figsize=(7, 5))
+        ax.plot(lam, cvl, 'o-', color=NPG_COLORS[0], markersize=3)
+        ax.axvline(lam[cv['best_index']], color='black', linestyle='--', label=f"Best λ = {cv['best_lambda']:.3g} ({len(coef)} genes)")
+        ax.set_xlabel("log10(λ)")
+        ax.set_ylabel("Cross-validated partial log-likelihood")
+        ax.invert_xaxis()
+        top_ax = ax.twiny()
+        top_ax.set_xlim(ax.get_xlim())
+        tick_idx = np.linspace(0, len(lam) - 1, 6).astype(int)
+        top_ax.set_xticks(lam[tick_idx])
+        top_ax.set_xticklabels(nz[tick_idx])
+        top_ax.set_xlabel("Non-zero coefficients")
+        ax.legend(frameon=False)
+        self._save_fig("Fig6b_CoxNet_CV", "LASSO-Cox Cross-Validation",
+                       f"{n_folds}-fold cross-validated partial likelihood along the penalty path; the selected signature keeps {len(coef)} genes.")
+
+        if len(coef):
+            top = coef.head(20).iloc[::-1]
+            plt.figure(figsize=(7, max(3, 0.3 * len(top) + 1)))
+            plt.barh(range(len(top)), top.values, color=np.where(top.values > 0, NPG_COLORS[0], NPG_COLORS[1]))
+            plt.yticks(range(len(top)), top.index)
+            plt.axvline(0, color='black', linewidth=0.8)
+            plt.xlabel("Cox coefficient (log HR per log2 unit)")
+            plt.title("Prognostic Signature Coefficients")
+            self._save_fig("Fig6c_CoxNet_Coef", "Prognostic Signature",
+                           "Non-zero LASSO-Cox coefficients (red: risk, blue: protective) defining the multi-gene risk score.")
 
-    def run_survival(self):
-        print("[6/8] Prognostic Validation (Survival Analysis)...")
-        df = self.metadata.copy()
-        df['Exp'] = self.log_cpm.loc[self.top_gene]
-        df['Level'] = ['High' if x > df['Exp'].median() else 'Low' for x in df['Exp']]
-        
         plt.figure(figsize=(6, 5))
-        kmf = KaplanMeierFitter()
-        for g in ['High', 'Low']:
-            m = (df['Level'] == g)
-            kmf.fit(df.loc[m, 'Survival'], df.loc[m, 'Status'], label=f"{g} {self.top_gene}")
-            kmf.plot_survival_function(lw=2)
-        plt.title("Prognostic Value Assessment")
-        self._save_fig("Fig6_Survival", "Kaplan-Meier Curve", f"Validation of {self.top_gene} as a prognostic marker for survival.")
+        plt.plot(horizons, td_auc, 'o-', color=NPG_COLORS[3], markersize=7)
+        for h, a in zip(horizons, td_auc):
+            plt.text(h, a + 0.015, f"{a:.2f}", ha='center', fontsize=9)
+        plt.axhline(0.5, color='gray', linestyle='--')
+        plt.ylim(0.3, 1.05)
+        plt.xlabel("Time")
+        plt.ylabel("Time-dependent AUC (cross-validated)")
+        plt.title(f"Risk Score Discrimination (C-index = {c_cv:.3f})")
+        self._save_fig("Fig6d_TimeAUC", "Time-dependent ROC/AUC",
+                       "IPCW cumulative/dynamic AUC of the out-of-fold risk score at the 25th/50th/75th percentile event times.")
+
+        self._report_summary['survival'] = {
+            **self._report_summary.get('survival', {}),
+            'coxnet': {'n_candidates': len(genes), 'n_selected': int(len(coef)), 'lambda': cv['best_lambda'],
+                       'l1_ratio': l1_ratio, 'c_index_cv': float(c_cv), 'c_index_apparent': float(c_app),
+                       'td_auc': {f"{h:.1f}": float(a) for h, a in zip(horizons, td_auc)},
+                       'genes': list(coef.index[:20])},
+        }
+        return coef
+
+    def _plot_km(self, ax, km, k, color, label):
+        """Step curve + Greenwood CI band + censoring ticks for group k of a kaplan_meier_batch result."""
+        import survival_engine as se
+        # Extend the last step to the group's own last follow-up (a late censored sample), not beyond
+        events = km['times'][(km['n_risk'][k] > 0)]
+        t_end = max([events.max() if len(events) else 0.0] + list(km['censor_times'][k][-1:]))
+        x, surv_p, lo, hi = se.km_step_arrays(km, k, t_max=t_end)
+        ax.step(x, surv_p, where='post', color=color, lw=2, label=label)
+        ax.fill_between(x, lo, hi, step='post', color=color, alpha=0.15, linewidth=0)
+        cens = km['censor_times'][k]
+        if len(cens):
+            ax.plot(cens, surv_p[np.searchsorted(x, cens, side='right') - 1], '|', color=color, markersize=6)
+
+    def run_survival(self, cutpoint='maxstat', min_prop=0.1, top_n=9, cross_check=False):
+        print("[6/8] Prognostic Validation (Survival Analysis)...")
+        import survival_engine as se
+        surv_data = self._survival_data()
+        if surv_data is None:
+            return
+        time_, event = surv_data
+        surv = se.prepare_survival(time_.values, event.values)
+        expr = self.log_cpm.loc[:, time_.index]
+        expr = expr[expr.var(axis=1) > 0]
+
+        # 全基因组预后表：所有基因按各自中位数分组，一次向量化 log-rank；有 Cox 筛选结果时合并
+        prog = se.logrank_screen(expr, surv, split='median')
+        prog.columns = [f"logrank_{c}" for c in prog.columns]
+        if self.cox_screen is not None:
+            prog = prog.join(self.cox_screen[['HR', 'HR_lower', 'HR_upper', 'pvalue', 'padj']].add_prefix('cox_'), how='left')
+        self.prognostic_table = prog
+        prog.to_csv(os.path.join(self.out_dir, "Survival_Prognostic_Table.csv"))
+
+        # 候选基因：最大选择秩统计量确定最优截断值 (校正多重截断比较)，否则按中位数
+        x = expr.loc[self.top_gene].values if self.top_gene in expr.index else expr.loc[prog.index[0]].values
+        gene = self.top_gene if self.top_gene in expr.index else prog.index[0]
+        med = se.logrank_matrix((x > np.median(x))[None, :], surv)
+        if cutpoint == 'maxstat':
+            opt = se.optimal_cutpoint(x, surv, min_prop=min_prop)
+            cut, p_show, p_label = opt['cutpoint'], opt['pvalue_adj'], "max-stat log-rank p"
+        else:
+            opt, cut, p_show, p_label = None, float(np.median(x)), float(med['pvalue'][0]), "log-rank p"
+        high = x > cut
+
+        km = se.kaplan_meier_batch(np.vstack([high, ~high]), surv)
+        fig, ax = plt.subplots(figsize=(6, 5))
+        for k, (g, m) in enumerate([('High', high), ('Low', ~high)]):
+            self._plot_km(ax, km, k, NPG_COLORS[0] if g == 'High' else NPG_COLORS[1], f"{g} {gene} (n={int(m.sum())})")
+        ax.text(0.95, 0.72, f"{p_label} = {p_show:.2e}", ha='right', transform=ax.transAxes)
+        ax.set_ylim(0, 1.05)
+        ax.set_xlabel("Time")
+        ax.set_ylabel("Survival Probability")
+        ax.legend(frameon=False)
+        ax.set_title("Prognostic Value Assessment")
+        self._save_fig("Fig6_Survival", "Kaplan-Meier Curve",
+                       f"Validation of {gene} as a prognostic marker (cutpoint {cut:.2f}, {p_label} = {p_show:.2e}).")
+
+        if cross_check:
+            try:
+                from lifelines import KaplanMeierFitter
+                kmf = KaplanMeierFitter().fit(time_.values[high], event.values[high])
+                ref = kmf.survival_function_at_times(km['times']).values
+                alive = km['n_risk'][0] > 0
+                print(f"  [*] lifelines cross-check (High {gene}): max |ΔS| = {np.abs(ref - km['survival'][0])[alive].max():.2e}")
+            except ImportError:
+                print("  [!] lifelines not installed; KM cross-check skipped.")
+
+        # 前 N 个预后基因的分面 KM：2N 条曲线在一次批量估计中得到
+        if top_n:
+            facet_genes = list(prog.index[:top_n])
+            vals = expr.loc[facet_genes].values
+            hi_mask = vals > np.median(vals, axis=1, keepdims=True)
+            km_all = se.kaplan_meier_batch(np.vstack([hi_mask, ~hi_mask]), surv)
+            ncol = min(3, len(facet_genes))
+            nrow = int(np.ceil(len(facet_genes) / ncol))
+            fig, axes = plt.subplots(nrow, ncol, figsize=(4 * ncol, 3.4 * nrow), sharex=True, sharey=True, squeeze=False)
+            for i, g in enumerate(facet_genes):
+                ax = axes.flat[i]
+                self._plot_km(ax, km_all, i, NPG_COLORS[0], f"High (n={int(hi_mask[i].sum())})")
+                self._plot_km(ax, km_all, len(facet_genes) + i, NPG_COLORS[1], f"Low (n={int((~hi_mask[i]).sum())})")
+                ax.set_title(f"{g}  (p = {prog.loc[g, 'logrank_pvalue']:.1e})", fontsize=10)
+                ax.legend(frameon=False, fontsize=7, loc='upper right')
+            for ax in axes.flat[len(facet_genes):]:
+                ax.axis('off')
+            for ax in axes[-1]:
+                ax.set_xlabel("Time")
+            for ax in axes[:, 0]:
+                ax.set_ylabel("Survival")
+            plt.tight_layout()
+            self._save_fig("Fig6e_KM_TopGenes", "Top Prognostic Genes (KM)",
+                           f"Kaplan-Meier curves (median split, Greenwood 95% CI) of the {len(facet_genes)} genes with the smallest log-rank p-values.")
+
+        n_sig = int((prog['logrank_padj'] < 0.05).sum())
+        print(f"  [*] {gene}: cutpoint {cut:.3f}, {p_label} = {p_show:.3g}; genome-wide median log-rank FDR<0.05: {n_sig} genes")
+        self._report_summary['survival'] = {
+            **self._report_summary.get('survival', {}),
+            'km_gene': gene, 'cutpoint': cut, 'cutpoint_method': cutpoint,
+            'logrank_p_median': float(med['pvalue'][0]),
+            'logrank_p_maxstat': float(opt['pvalue_adj']) if opt else None,
+            'n_logrank_sig': n_sig,
+        }
 
     def run_enrichment(self):
         print(f"[7/9] High-Fidelity Functional Enrichment (GO/KEGG)...")
@@ -535,9 +1259,13 @@ class MasterBioinfoPipeline:
             print("  [💡] 科学建议：请尝试在设置中放宽 [P-value] 阈值，或检查样本分组是否正确。")
             return
 
-        import gseapy as gp
+        import enrichment_engine as ee
         print(f"  [*] 正在对 {len(up_genes)} 个上调基因和 {len(down_genes)} 个下调基因执行功能识别...")
-        
+        # 本地 GMT 库可用时离线计算 (稀疏索引 + 向量化超几何检验, 背景=全部检测基因)，否则调用 Enrichr 在线接口
+        offline = {lib: ee.library_path(lib) is not None for lib in ee.LIBRARY_FILES}
+        if any(offline.values()):
+            print(f"  [*] Offline gene-set libraries: {', '.join(l for l, ok in offline.items() if ok)}")
+
         def plot_bubbles(enr_res, title, filename, caption):
             if enr_res is None or enr_res.results.empty: return
             res = enr_res.results.sort_values('Adjusted P-value').head(15)
@@ -563,42 +1291,193 @@ class MasterBioinfoPipeline:
             self._save_fig(filename, title, caption)
             plt.close()
 
-        # 1. GO Biological Process (Up-regulated)
-        print("  [*] Analyzing GO Biological Process (Up-regulated)...")
-        try:
-            enr_go_up = gp.enrichr(gene_list=up_genes, gene_sets=['GO_Biological_Process_2023'], organism='Human', outdir=None)
-            plot_bubbles(enr_go_up, "GO Biological Process (Up-regulated)", "Fig7a_GO_Up", "Biological processes significantly activated in Cancer/High-risk group.")
-        except Exception as e: print(f"  [!] GO Up failed: {e}")
+        queries = [
+            ("GO Up", up_genes, 'GO_Biological_Process_2023', "GO Biological Process (Up-regulated)", "Fig7a_GO_Up",
+             "Biological processes significantly activated in Cancer/High-risk group."),
+            ("KEGG Up", up_genes, 'KEGG_2021_Human', "KEGG Pathways (Up-regulated)", "Fig7b_KEGG_Up",
+             "Signaling pathways significantly activated in Cancer samples."),
+            ("KEGG Down", down_genes, 'KEGG_2021_Human', "KEGG Pathways (Down-regulated)", "Fig7c_KEGG_Down",
+             "Pathways significantly suppressed in Cancer vs Normal."),
+        ]
+        # MSigDB Hallmark — 仅在本地库可用时运行
+        if offline.get('MSigDB_Hallmark_2020'):
+            queries.append(("Hallmark Up", up_genes, 'MSigDB_Hallmark_2020', "MSigDB Hallmark (Up-regulated)", "Fig7d_Hallmark_Up",
+                            "Hallmark biological states significantly activated in Cancer samples."))
 
-        # 2. KEGG Pathways (Up-regulated)
-        print("  [*] Analyzing KEGG Pathways (Up-regulated)...")
-        try:
-            enr_kegg_up = gp.enrichr(gene_list=up_genes, gene_sets=['KEGG_2021_Human'], organism='Human', outdir=None)
-            plot_bubbles(enr_kegg_up, "KEGG Pathways (Up-regulated)", "Fig7b_KEGG_Up", "Signaling pathways significantly activated in Cancer samples.")
-        except Exception as e: print(f"  [!] KEGG Up failed: {e}")
+        # 各库查询相互独立：并发执行；结果按 (基因列表, 库版本, 背景集) 缓存，重复运行直接命中
+        print(f"  [*] Running {len(queries)} enrichment queries ({', '.join(q[0] for q in queries)})...")
+        results = ee.enrich_many([(q[1], q[2]) for q in queries], background=self.res_df.index)
+        for (label, _, _, title, filename, caption), enr in zip(queries, results):
+            if isinstance(enr, Exception):
+                print(f"  [!] {label} failed: {enr}")
+                continue
+            if enr.cached:
+                print(f"  [*] {label}: cache hit")
+            try:
+                plot_bubbles(enr, title, filename, caption)
+            except Exception as e: print(f"  [!] {label} failed: {e}")
 
-        # 3. GO/KEGG for Down-regulated if helpful (Optional, let's keep it compact)
-        print("  [*] Analyzing Down-regulated gene functions...")
-        try:
-            enr_kegg_down = gp.enrichr(gene_list=down_genes, gene_sets=['KEGG_2021_Human'], organism='Human', outdir=None)
-            plot_bubbles(enr_kegg_down, "KEGG Pathways (Down-regulated)", "Fig7c_KEGG_Down", "Pathways significantly suppressed in Cancer vs Normal.")
-        except Exception as e: print(f"  [!] KEGG Down failed: {e}")
+    def run_gsea(self, libraries=('MSigDB_Hallmark_2020', 'KEGG_2021_Human', 'GO_Biological_Process_2023'),
+                 n_perm=1000, min_size=15, max_size=500, n_jobs=None, n_plot=4):
+        """
+        Preranked GSEA on the full DEA ranking (sign(log2FC) · -log10 p), no significance cutoff.
+        Runs every library available offline (enrichment_engine / OPENCLAW_GENESET_DIR).
+        """
+        print("[7/9] Preranked GSEA on the full ranking...")
+        if self.res_df is None:
+            print("  [!] Error: Result dataframe is empty. Cannot run GSEA.")
+            return
+        import enrichment_engine as ee
+        available = [lib for lib in libraries if ee.library_path(lib) is not None]
+        if not available:
+            print(f"  [!] No local gene-set library found in {ee.GENESET_DIR} (set OPENCLAW_GENESET_DIR); GSEA skipped.")
+            return
+
+        p = self.res_df['pvalue'].clip(lower=1e-300)
+        ranking = np.sign(self.res_df['log2FC']) * -np.log10(p)
+        gsea = {}
+        for li, lib in enumerate(available):
+            t0 = time.time()
+            res, info = ee.gsea_preranked(ranking, lib, min_size=min_size, max_size=max_size, n_perm=n_perm, n_jobs=n_jobs)
+            res.to_csv(os.path.join(self.out_dir, f"GSEA_{lib}.csv"), index=False)
+            sig = res[res['FDR q-val'] < 0.25]
+            print(f"  [*] {lib}: {info['n_sets']} sets × {n_perm} permutations in {time.time() - t0:.1f}s; "
+                  f"FDR<0.25: {int((sig['NES'] > 0).sum())} up / {int((sig['NES'] < 0).sum())} down")
+            gsea[lib] = {'n_sets': info['n_sets'], 'n_up': int((sig['NES'] > 0).sum()), 'n_down': int((sig['NES'] < 0).sum()),
+                         'top': res.head(5)[['Term', 'NES', 'FDR q-val']].to_dict('records')}
+
+            # Enrichment plots: strongest positive and negative sets (running sum / hits / ranked metric)
+            show = pd.concat([res[res['NES'] > 0].head(n_plot // 2), res[res['NES'] < 0].head(n_plot - n_plot // 2)])
+            if show.empty:
+                continue
+            weights_signed = info['ranking'].values
+            x = np.arange(len(weights_signed))
+            fig, axes = plt.subplots(3, len(show), figsize=(4.2 * len(show), 5.2), sharex=True, squeeze=False,
+                                     gridspec_kw={'height_ratios': [3, 0.5, 1.3]})
+            for j, (_, row) in enumerate(show.iterrows()):
+                pos = info['positions'][row['Term']]
+                rs = ee.running_sum(info['weights'], pos)
+                color = NPG_COLORS[0] if row['NES'] > 0 else NPG_COLORS[1]
+                ax = axes[0, j]
+                ax.plot(x, rs, color=color, lw=1.5)
+                ax.axhline(0, color='grey', lw=0.6)
+                ax.set_title(f"{row['Term'][:40]}\nNES = {row['NES']:.2f}, FDR = {row['FDR q-val']:.2g}", fontsize=9)
+                axes[1, j].vlines(pos, 0, 1, color='black', lw=0.4)
+                axes[1, j].set_yticks([])
+                axes[2, j].fill_between(x, weights_signed, color='grey', lw=0)
+                axes[2, j].set_xlabel("Rank in ordered gene list")
+            axes[0, 0].set_ylabel("Enrichment score")
+            axes[2, 0].set_ylabel("Ranked metric")
+            plt.tight_layout()
+            self._save_fig(f"Fig7{'efg'[li] if li < 3 else 'h'}_GSEA_{lib}", f"GSEA: {lib}",
+                           f"Preranked GSEA ({n_perm} gene permutations) on sign(log2FC)·-log10(p) of all {len(weights_signed)} genes; "
+                           "top panels show the running enrichment score of the strongest up- and down-regulated sets.")
+        self._report_summary['gsea'] = gsea
+
+    def run_pathway_scores(self, library='MSigDB_Hallmark_2020', min_size=10, max_size=500, alpha=0.25):
+        """Per-sample pathway activity (ssGSEA) for every set of a local library → self.pathway_scores."""
+        print("[*] Per-sample Pathway Scoring (ssGSEA)...")
+        import enrichment_engine as ee
+        if ee.library_path(library) is None:
+            print(f"  [!] Gene-set library '{library}' not found in {ee.GENESET_DIR} (set OPENCLAW_GENESET_DIR); pathway scoring skipped.")
+            return None
+        t0 = time.time()
+        scores = ee.ssgsea_scores(self.log_cpm, library, min_size=min_size, max_size=max_size, alpha=alpha)
+        self.pathway_scores, self.pathway_library = scores, library
+        scores.to_csv(os.path.join(self.out_dir, f"Pathway_Scores_{library}.csv"))
+        print(f"  [*] {scores.shape[0]} pathways × {scores.shape[1]} samples scored in {time.time() - t0:.1f}s")
+
+        # 组间差异最大的通路 (Welch t)，样本按分组排列
+        group = self.metadata['Group'].reindex(scores.columns)
+        t, p = stats.ttest_ind(scores.loc[:, group == 'Cancer'], scores.loc[:, group == 'Healthy'], axis=1, equal_var=False)
+        diff = pd.DataFrame({'t': t, 'pvalue': p}, index=scores.index).dropna()
+        diff['padj'] = multipletests(diff['pvalue'], method='fdr_bh')[1]
+        diff = diff.sort_values('pvalue')
+        top = diff.index[:30]
+        if len(top) >= 2:
+            order = group.sort_values(kind='stable').index
+            z = scores.loc[top, order]
+            z = z.sub(z.mean(axis=1), axis=0).div(z.std(axis=1).replace(0, 1), axis=0)
+            plt.figure(figsize=(11, max(4, 0.28 * len(top) + 2)))
+            sns.heatmap(z, cmap='RdBu_r', center=0, vmin=-2.5, vmax=2.5, xticklabels=False,
+                        yticklabels=[name[:50] for name in top], cbar_kws={'label': 'Row z-score'})
+            plt.axvline(int((group[order] == group[order[0]]).sum()), color='black', lw=1.5)
+            plt.xlabel("Samples (grouped)")
+            plt.title(f"ssGSEA Pathway Activity ({library})")
+            plt.tight_layout()
+            self._save_fig("Fig7i_Pathway_Activity", "Per-sample Pathway Activity (ssGSEA)",
+                           f"ssGSEA scores of the {len(top)} pathways most different between groups (Welch t-test), samples ordered by group.")
 
-    def run_venn_analysis(self, other_sig_lists=None, labels=None):
+        self._report_summary['pathways'] = {
+            'library': library, 'n_pathways': int(scores.shape[0]), 'n_diff': int((diff['padj'] < 0.05).sum()),
+            'top': [{'pathway': k, 't': float(r['t']), 'padj': float(r['padj'])} for k, r in diff.head(5).iterrows()],
+        }
+        return scores
+
+    def _plot_upset(self, table, labels, set_sizes, filename, title, caption, max_regions=30):
+        """UpSet plot: exclusive region sizes (top), membership matrix (bottom), set sizes (left)."""
+        top = table.sort_values(['size', 'degree'], ascending=[False, False], kind='stable').head(max_regions)
+        n_sets, n_reg = len(labels), len(top)
+        fig = plt.figure(figsize=(max(7, 0.38 * n_reg + 3.5), 3.2 + 0.35 * n_sets))
+        # 中间空列留给集合名 (由点阵轴左侧刻度标签绘制)
+        gs = fig.add_gridspec(2, 3, width_ratios=[1, 0.06 * max(len(l) for l in labels) + 0.2, max(3, n_reg / 6)],
+                              height_ratios=[2.2, 0.3 * n_sets + 0.4], wspace=0.0, hspace=0.05)
+        ax_bar = fig.add_subplot(gs[0, 2])
+        ax_dot = fig.add_subplot(gs[1, 2], sharex=ax_bar)
+        ax_set = fig.add_subplot(gs[1, 0], sharey=ax_dot)
+
+        x = np.arange(n_reg)
+        ax_bar.bar(x, top['size'], color='#3C5488', width=0.65)
+        for xi, v in zip(x, top['size']):
+            ax_bar.text(xi, v, str(int(v)), ha='center', va='bottom', fontsize=7)
+        ax_bar.set_ylabel("Intersection size")
+        ax_bar.tick_params(axis='x', bottom=False, labelbottom=False)
+        ax_bar.spines[['top', 'right']].set_visible(False)
+
+        member = top[labels].values.T  # sets × regions
+        yy, xx = np.meshgrid(np.arange(n_sets), x, indexing='ij')
+        ax_dot.scatter(xx[~member], yy[~member], s=45, color='#DDDDDD', zorder=2)
+        ax_dot.scatter(xx[member], yy[member], s=45, color='#222222', zorder=3)
+        for xi in x:
+            ys = np.flatnonzero(member[:, xi])
+            if len(ys) > 1:
+                ax_dot.plot([xi, xi], [ys.min(), ys.max()], color='#222222', lw=1.8, zorder=2)
+        ax_dot.set_yticks(range(n_sets))
+        ax_dot.set_yticklabels(labels)
+        ax_dot.tick_params(axis='y', left=False, labelleft=True)
+        ax_dot.tick_params(axis='x', bottom=False, labelbottom=False)
+        ax_dot.set_xlim(-0.6, n_reg - 0.4)
+        ax_dot.set_ylim(n_sets - 0.5, -0.5)
+        for side in ax_dot.spines.values():
+            side.set_visible(False)
+
+        ax_set.barh(range(n_sets), [set_sizes[l] for l in labels], color=[NPG_COLORS[i % len(NPG_COLORS)] for i in range(n_sets)], height=0.6)
+        ax_set.invert_xaxis()
+        ax_set.tick_params(axis='y', left=False, labelleft=False)
+        ax_set.set_xlabel("Set size")
+        ax_set.spines[['top', 'left']].set_visible(False)
+        fig.suptitle(title, fontweight='bold')
+        self._save_fig(filename, title, caption)
+
+    def run_venn_analysis(self, other_sig_lists=None, labels=None, max_regions=30):
         """
-        Premium Venn Diagram for multi-dataset biomarker intersection.
+        Multi-dataset biomarker intersection for any number of cohorts.
         other_sig_lists: list of lists (gene symbols)
         labels: list of str
+        Region sizes come from intersection_engine (bitsets + popcounts); 2-3 cohorts additionally
+        get the classic Venn diagram, every N gets an UpSet plot and a region table.
         """
         print("[8/9] Venn Diagram: Intersection of Biomarkers...")
         try:
             from matplotlib_venn import venn2, venn3
         except ImportError:
-            print("  [!] Skipping Venn: 'matplotlib_venn' not found.")
-            return
+            venn2 = venn3 = None
 
         my_genes = set(getattr(self, 'sig_genes', []))
         if not other_sig_lists:
+            if venn2 is None:
+                print("  [!] Skipping Venn: 'matplotlib_venn' not found.")
+                return
             # If no external list, split sig_genes into Up/Down for a demo Venn
             up = set(self.res_df[self.res_df['Sig'] == 'Up'].index)
             down = set(self.res_df[self.res_df['Sig'] == 'Down'].index)
@@ -606,20 +1485,89 @@ class MasterBioinfoPipeline:
             venn2([up, down], set_labels=('Up-regulated', 'Down-regulated'), set_colors=('#E64B35', '#4DBBD5'))
             plt.title("Biomarker Overlap (Internal Class)", fontweight='bold')
             self._save_fig("Fig8_Venn", "Venn Intersection", "Intersection of up and down regulated genes within the current dataset.")
-        else:
-            # Real multi-dataset Venn
-            sets = [my_genes] + [set(l) for l in other_sig_lists]
-            lbls = [self.dataset_id or "Current"] + (labels or [f"DS_{i+1}" for i in range(len(other_sig_lists))])
-            
+            return
+
+        import intersection_engine as ie
+        sets = [my_genes] + [set(l) for l in other_sig_lists]
+        lbls = [self.dataset_id or "Current"] + list(labels or [f"DS_{i+1}" for i in range(len(other_sig_lists))])
+
+        if len(sets) in (2, 3) and venn2 is not None:
             plt.figure(figsize=(8, 8))
             if len(sets) == 2:
                 venn2(sets, set_labels=lbls, set_colors=NPG_COLORS[:2])
-            elif len(sets) == 3:
+            else:
                 venn3(sets, set_labels=lbls, set_colors=NPG_COLORS[:3])
-            
             plt.title("Cross-Dataset Biomarker Overlap", fontweight='bold')
             self._save_fig("Fig8_Venn", "Venn Intersection", "Multi-dataset intersection identifying highly robust biomarkers across cohorts.")
 
+        enc = ie.encode(sets, lbls)
+        table = ie.region_table(enc)
+        table.to_csv(os.path.join(self.out_dir, "Venn_Intersections.csv"))
+        set_sizes = dict(zip(lbls, ie.popcount(enc['bits']).tolist()))
+        full = (1 << len(sets)) - 1
+        core = table.loc[full, 'genes'].split(';') if full in table.index else []
+        self.consensus_genes = core
+        print(f"  [*] {len(sets)} cohorts, {len(enc['universe'])} genes, {len(table)} non-empty regions; shared by all: {len(core)}")
+        self._plot_upset(table, lbls, set_sizes, "Fig8b_UpSet", "UpSet: Cross-Dataset Biomarker Overlap",
+                         f"Exclusive intersection sizes of significant genes across {len(sets)} cohorts (largest {min(max_regions, len(table))} regions); "
+                         "dots mark the cohorts sharing each region.", max_regions=max_regions)
+        self._report_summary['intersection'] = {'labels': lbls, 'set_sizes': set_sizes, 'n_regions': int(len(table)),
+                                                'n_core': len(core), 'core_genes': core[:30]}
+
+    def run_meta_analysis(self, other_results=None, labels=None, method='random_effects', min_cohorts=2,
+                          p_thresh=0.05, fc_thresh=1.0, weights=None, top_n=20):
+        """
+        Cross-cohort meta-analysis of DEA statistics (e.g. GSE31210 / GSE30219 / GSE19188).
+        other_results: list of res_df tables (log2FC / pvalue / se) or pipelines that ran run_dea
+        labels: list of str
+        weights: optional per-cohort Stouffer weights (e.g. sqrt of sample sizes), current cohort first
+        """
+        print("[9/9] Cross-Cohort Meta-Analysis (Random-effects / Stouffer / Fisher / RRA)...")
+        if self.res_df is None or not other_results:
+            print("  [!] Meta-analysis needs this cohort's res_df plus at least one other cohort; skipped.")
+            return None
+        import meta_engine as mt
+        results = [self.res_df] + [getattr(r, 'res_df', r) for r in other_results]
+        lbls = [self.dataset_id or "Current"] + list(labels or [getattr(r, 'dataset_id', None) or f"DS_{i+1}"
+                                                             for i, r in enumerate(other_results)])
+        table, lbls = mt.meta_analyze(results, lbls, min_cohorts=min_cohorts, weights=weights, method=method,
+                                      p_thresh=p_thresh, fc_thresh=fc_thresh)
+        self.meta_res = table
+        table.to_csv(os.path.join(self.out_dir, "Meta_Consensus_DEGs.csv"))
+        n_up, n_down = int((table['Sig'] == 'Up').sum()), int((table['Sig'] == 'Down').sum())
+        print(f"  [*] {len(lbls)} cohorts, {len(table)} genes in ≥{min_cohorts} cohorts; consensus DEGs ({method}): {n_up} up / {n_down} down")
+
+        # Forest plot: per-cohort log2FC (± 1.96 SE) and the pooled random-effects estimate per gene
+        sig = table[table['Sig'] != 'NS']
+        show = (sig if len(sig) else table).head(top_n)
+        genes_all, arr, _ = mt.align_cohorts(results, lbls, min_cohorts=1)
+        col = genes_all.get_indexer(show.index)
+        fig, ax = plt.subplots(figsize=(8, 0.42 * len(show) + 1.8))
+        y = np.arange(len(show))[::-1]
+        offsets = np.linspace(-0.25, 0.25, len(lbls)) if len(lbls) > 1 else [0]
+        for i, lbl in enumerate(lbls):
+            fc, se = arr['log2FC'][i, col], arr['se'][i, col]
+            ax.errorbar(fc, y + offsets[i], xerr=1.96 * se, fmt='o', ms=3.5, lw=0.8, capsize=0,
+                        color=NPG_COLORS[i % len(NPG_COLORS)], label=lbl, alpha=0.85)
+        ax.errorbar(show['pooled_log2FC'], y, xerr=[show['pooled_log2FC'] - show['ci_low'], show['ci_high'] - show['pooled_log2FC']],
+                    fmt='D', ms=6, color='black', lw=1.6, capsize=2.5, label='Pooled (RE)')
+        ax.axvline(0, color='grey', linestyle='--', lw=0.8)
+        ax.set_yticks(y)
+        ax.set_yticklabels([f"{g}  (I²={i2:.0%})" for g, i2 in zip(show.index, show['I2'])], fontsize=8)
+        ax.set_xlabel("log2 Fold Change (95% CI)")
+        ax.set_title("Cross-Cohort Meta-Analysis: Consensus DEGs", fontweight='bold')
+        ax.legend(frameon=False, fontsize=7, loc='best')
+        plt.tight_layout()
+        self._save_fig("Fig9_Meta_Forest", "Meta-analysis Forest Plot",
+                       f"Per-cohort and DerSimonian-Laird random-effects pooled log2FC for the top {len(show)} consensus genes across {len(lbls)} cohorts; I² = between-cohort heterogeneity.")
+
+        self._report_summary['meta'] = {
+            'labels': lbls, 'method': method, 'n_genes': int(len(table)), 'n_up': n_up, 'n_down': n_down,
+            'top': [{'gene': g, 'pooled_log2FC': float(r['pooled_log2FC']), 're_padj': float(r['re_padj']),
+                     'rra_padj': float(r['rra_padj']), 'I2': float(r['I2'])} for g, r in show.head(5).iterrows()],
+        }
+        return table
+
     def _get_openclaw_interpretation(self):
         """
         可选扩展点：OpenClaw 下放自由度。
@@ -656,6 +1604,13 @@ class MasterBioinfoPipeline:
         summary = self._report_summary
         dea = summary.get("dea", {})
         ml = summary.get("ml", {})
+        wgcna = summary.get("wgcna", {})
+        immune = summary.get("immune", {})
+        surv = summary.get("survival", {})
+        gsea = summary.get("gsea", {})
+        pathways = summary.get("pathways", {})
+        inter = summary.get("intersection", {})
+        meta = summary.get("meta", {})
 
         with open(report_path, "w", encoding='utf-8') as f:
             f.write("# 生信全流程自动化分析报告 (Elite Edition)\n\n")
@@ -675,9 +1630,61 @@ class MasterBioinfoPipeline:
             f.write(f"| 差异表达基因总数 (DEG) | {dea.get('n_sig', '-')} |\n")
             f.write(f"| 上调基因数 | {dea.get('n_up', '-')} |\n")
             f.write(f"| 下调基因数 | {dea.get('n_down', '-')} |\n")
+            if wgcna:
+                f.write(f"| WGCNA 软阈值 (power) / 共表达模块数 | {wgcna.get('power') or '-'} / {wgcna.get('n_modules', 0)} |\n")
+                if wgcna.get('top_module'):
+                    f.write(f"| 与分组最相关模块 (r, p) | {wgcna['top_module']} ({wgcna['top_module_r']:.2f}, {wgcna['top_module_p']:.1e}) |\n")
+            if immune.get('top_diff_cells'):
+                cell = immune['top_diff_cells'][0]
+                f.write(f"| 组间差异最显著免疫细胞 (Cancer vs Healthy, p) | {cell['cell_type']} ({cell['mean_cancer']:.3f} vs {cell['mean_healthy']:.3f}, {cell['pvalue']:.1e}) |\n")
             if ml:
-                f.write(f"| 随机森林 ROC-AUC (测试集) | {ml.get('auc_rf', 0):.3f} |\n")
-                f.write(f"| L1 逻辑回归 ROC-AUC (测试集) | {ml.get('auc_l1', 0):.3f} |\n")
+                for key, name in [('auc_rf', '随机森林'), ('auc_l1', 'L1 逻辑回归')]:
+                    ci = ml.get(f'{key}_ci')
+                    ci_txt = f" (95% CI {ci[0]:.3f}-{ci[1]:.3f})" if ci else ""
+                    f.write(f"| {name} ROC-AUC (测试集) | {ml.get(key, 0):.3f}{ci_txt} |\n")
+                if 'delong_p' in ml:
+                    f.write(f"| DeLong 检验 (RF vs L1) p 值 | {ml['delong_p']:.3g} |\n")
+                if 'l1_C' in ml:
+                    f.write(f"| L1 交叉验证最优 C / 非零系数基因数 | {ml['l1_C']:.4g} / {ml['l1_n_nonzero']} |\n")
+                for label, r in ml.get('nested_cv', {}).items():
+                    f.write(f"| 嵌套交叉验证 AUC: {label} (95% CI) | {r['mean_auc']:.3f} ({r['ci_low']:.3f}-{r['ci_high']:.3f}) |\n")
+                if 'stability' in ml:
+                    panel = ", ".join(ml['stable_panel'][:10]) or "-"
+                    f.write(f"| L1 稳定性选择面板 ({ml['stability']['n_stable']} 基因, 阈值 {ml['stability']['threshold']}) | {panel} |\n")
+                for m, params in ml.get('tuned_params', {}).items():
+                    f.write(f"| 超参数搜索最优配置 ({m}) | {', '.join(f'{k}={v}' for k, v in params.items())} |\n")
+                if ml.get('best_model'):
+                    f.write(f"| 嵌套交叉验证最优模型 | {ml['best_model']} |\n")
+            if surv.get('km_gene'):
+                p_max = surv.get('logrank_p_maxstat')
+                p_txt = f"{surv['logrank_p_median']:.2e}" + (f" / {p_max:.2e}" if p_max is not None else "")
+                f.write(f"| KM 基因 {surv['km_gene']} log-rank p (中位数 / 最优截断校正) | {p_txt} |\n")
+                f.write(f"| 全基因组中位数 log-rank FDR<0.05 预后基因数 | {surv['n_logrank_sig']} |\n")
+            if surv.get('coxnet'):
+                cn = surv['coxnet']
+                f.write(f"| LASSO-Cox 预后模型基因数 / 候选基因数 | {cn['n_selected']} / {cn['n_candidates']} |\n")
+                f.write(f"| 风险评分 C-index (交叉验证 / 表观) | {cn['c_index_cv']:.3f} / {cn['c_index_apparent']:.3f} |\n")
+                f.write(f"| 时间依赖 AUC (25/50/75% 事件时间) | {' / '.join(f'{a:.3f}' for a in cn['td_auc'].values())} |\n")
+            if surv.get('n_genes_cox'):
+                f.write(f"| 单因素 Cox 筛选基因数 / FDR<{surv['cox_fdr']} 预后基因数 | {surv['n_genes_cox']} / {surv['n_cox_sig']} |\n")
+                if surv.get('top_cox'):
+                    c = surv['top_cox'][0]
+                    f.write(f"| 最显著预后基因 (HR, 95% CI, p) | {c['gene']} ({c['HR']:.2f}, {c['HR_lower']:.2f}-{c['HR_upper']:.2f}, {c['pvalue']:.1e}) |\n")
+            if pathways.get('top'):
+                pw = pathways['top'][0]
+                f.write(f"| ssGSEA 通路数 / 组间差异通路数 (FDR<0.05) | {pathways['n_pathways']} / {pathways['n_diff']} |\n")
+                f.write(f"| 组间差异最显著通路 (t, FDR) | {pw['pathway']} ({pw['t']:.2f}, {pw['padj']:.1e}) |\n")
+            if inter:
+                core = ", ".join(inter['core_genes'][:10]) or "-"
+                f.write(f"| {len(inter['labels'])} 个队列共有差异基因数 ({core}) | {inter['n_core']} |\n")
+            if meta:
+                f.write(f"| 跨队列 meta 分析共识差异基因 ({len(meta['labels'])} 个队列, 上调 / 下调) | {meta['n_up']} / {meta['n_down']} |\n")
+                if meta.get('top'):
+                    m = meta['top'][0]
+                    f.write(f"| 最显著共识基因 (合并 log2FC, FDR, I²) | {m['gene']} ({m['pooled_log2FC']:.2f}, {m['re_padj']:.1e}, {m['I2']:.0%}) |\n")
+            for lib, g in gsea.items():
+                top = f"{g['top'][0]['Term']} (NES {g['top'][0]['NES']:.2f})" if g['top'] else "-"
+                f.write(f"| GSEA {lib}: FDR<0.25 上调 / 下调通路数 (最强通路) | {g['n_up']} / {g['n_down']} ({top}) |\n")
             f.write("\n")
             if dea.get("top_up"):
                 f.write("**代表性上调基因 (按 log2FC 排序)**：`" + "`, `".join(dea["top_up"][:10]) + "`\n\n")
@@ -711,13 +1718,24 @@ if __name__ == "__main__":
     p = MasterBioinfoPipeline()
     p.run_pre_processing()
     p.run_dea()
+    p.run_threshold_sweep()
     p.run_deg_heatmap()
     p.run_wgcna_lite()
     p.run_cibersort_lite()
+    p.run_pathway_scores()
     p.run_advanced_ml()
+    p.run_cox_screen()
+    p.run_survival_model()
     p.run_survival()
     p.run_enrichment()
+    p.run_gsea()
     p.run_venn_analysis()
+    # Second simulated cohort for the cross-cohort meta-analysis demo
+    p2 = MasterBioinfoPipeline(out_dir=os.path.join(p.out_dir, "Cohort_2"))
+    p2.dataset_id = "Simulated_Cohort_2"
+    p2.run_pre_processing()
+    p2.compute_dea_stats()
+    p.run_meta_analysis(other_results=[p2])
     p.generate_report()
     
     print("\n" + "="*40)
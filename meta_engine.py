@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.special import betainc
+from statsmodels.stats.multitest import multipletests
+
+
+def align_cohorts(results, labels=None, min_cohorts=2):
+    """
+    Stack per-cohort DEA tables (index = gene, columns log2FC / pvalue / optional se) on the union
+    gene universe, keeping genes measured in at least `min_cohorts` cohorts.
+
+    Returns (genes Index, dict of K × G arrays 'log2FC', 'pvalue', 'se' with NaN where missing, labels).
+    Without an 'se' column the SE is recovered from the two-sided p-value (normal approximation).
+    Symbols are matched case-insensitively; duplicated symbols within a cohort are averaged.
+    """
+    labels = list(labels) if labels is not None else [f"Cohort_{i + 1}" for i in range(len(results))]
+    frames = []
+    for df in results:
+        df = df[[c for c in ('log2FC', 'pvalue', 'se') if c in df.columns]]
+        df = df.set_axis(df.index.astype(str).str.strip().str.upper(), axis=0)
+        if df.index.has_duplicates:
+            df = df.groupby(level=0).mean()
+        frames.append(df)
+    genes = pd.Index(sorted(set().union(*[f.index for f in frames])))
+    fc = np.vstack([f['log2FC'].reindex(genes).values.astype(float) for f in frames])
+    p = np.vstack([f['pvalue'].reindex(genes).values.astype(float) for f in frames])
+    se = np.vstack([f['se'].reindex(genes).values.astype(float) if 'se' in f.columns else np.full(len(genes), np.nan)
+                    for f in frames])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se_from_p = np.abs(fc) / stats.norm.isf(np.clip(p, 1e-300, 1.0) / 2)
+    se = np.where(np.isfinite(se) & (se > 0), se, se_from_p)
+    se[~np.isfinite(se) | (se <= 0)] = np.nan
+
+    keep = (~np.isnan(fc) & ~np.isnan(p)).sum(axis=0) >= min_cohorts
+    return genes[keep], {'log2FC': fc[:, keep], 'pvalue': p[:, keep], 'se': se[:, keep]}, labels
+
+
+def stouffer(fc, p, weights=None):
+    """Signed Stouffer Z: per-cohort z = sign(log2FC)·Φ⁻¹(1 − p/2), weighted sum over observed cohorts."""
+    z = np.sign(fc) * stats.norm.isf(np.clip(p, 1e-300, 1.0) / 2)
+    w = np.ones_like(z) if weights is None else np.broadcast_to(np.asarray(weights, float)[:, None], z.shape)
+    obs = ~np.isnan(z)
+    w = np.where(obs, w, 0.0)
+    Z = np.where(obs, w * z, 0.0).sum(axis=0) / np.sqrt((w ** 2).sum(axis=0))
+    return Z, 2 * stats.norm.sf(np.abs(Z))
+
+
+def fisher(p):
+    """Fisher's method: −2 Σ ln p ~ χ²(2k) with k = cohorts observed per gene (direction-agnostic)."""
+    obs = ~np.isnan(p)
+    X = -2 * np.where(obs, np.log(np.clip(p, 1e-300, 1.0)), 0.0).sum(axis=0)
+    return X, stats.chi2.sf(X, 2 * obs.sum(axis=0))
+
+
+def random_effects(fc, se):
+    """
+    DerSimonian–Laird random-effects pooled log2FC for all genes at once (cohorts × genes arrays).
+
+    Returns a dict of pooled estimate, SE, 95% CI, z, p, between-cohort variance tau², Cochran's Q,
+    its p-value and I².
+    """
+    obs = ~np.isnan(fc) & ~np.isnan(se)
+    k = obs.sum(axis=0)
+    y = np.where(obs, fc, 0.0)
+    w = np.where(obs, 1.0 / np.where(obs, se, 1.0) ** 2, 0.0)
+    sw = w.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fixed = (w * y).sum(axis=0) / sw
+        Q = (w * (y - fixed) ** 2).sum(axis=0)
+        C = sw - (w ** 2).sum(axis=0) / sw
+        tau2 = np.maximum(0.0, (Q - (k - 1)) / C)
+        tau2 = np.where(k > 1, np.nan_to_num(tau2), 0.0)
+        w_re = np.where(obs, 1.0 / (np.where(obs, se, 1.0) ** 2 + tau2), 0.0)
+        pooled = (w_re * y).sum(axis=0) / w_re.sum(axis=0)
+        pooled_se = 1.0 / np.sqrt(w_re.sum(axis=0))
+        z = pooled / pooled_se
+        I2 = np.where(Q > 0, np.maximum(0.0, (Q - (k - 1)) / Q), 0.0)
+    return {'pooled_log2FC': pooled, 'pooled_se': pooled_se,
+            'ci_low': pooled - 1.959964 * pooled_se, 'ci_high': pooled + 1.959964 * pooled_se,
+            'z': z, 'pvalue': 2 * stats.norm.sf(np.abs(z)), 'tau2': tau2, 'Q': Q,
+            'Q_pvalue': np.where(k > 1, stats.chi2.sf(Q, np.maximum(k - 1, 1)), 1.0), 'I2': I2}
+
+
+def rank_aggregation(score):
+    """
+    Robust rank aggregation (Kolde et al. 2012) of cohorts × genes scores (higher = better ranked).
+
+    Each cohort's ranks are normalized to (0, 1]; genes missing in a cohort get rank 1. For the
+    sorted normalized ranks r(1) ≤ … ≤ r(K) of a gene, ρ = min_j P(Beta(j, K − j + 1) ≤ r(j)),
+    all genes at once via one sort and one broadcast betainc; p = min(1, K·ρ) (Bonferroni bound).
+    """
+    K = score.shape[0]
+    obs = ~np.isnan(score)
+    ranks = pd.DataFrame(score.T).rank(ascending=False, method='average').values.T
+    r = np.where(obs, ranks / obs.sum(axis=1, keepdims=True), 1.0)
+    r.sort(axis=0)
+    j = np.arange(1, K + 1)[:, None]
+    rho = betainc(j, K - j + 1, r).min(axis=0)
+    return rho, np.minimum(1.0, rho * K)
+
+
+def meta_analyze(results, labels=None, min_cohorts=2, weights=None, method='random_effects',
+                 p_thresh=0.05, fc_thresh=1.0):
+    """
+    Consensus DEG table across cohorts in one vectorized pass over the aligned gene universe:
+    random-effects pooled log2FC, signed Stouffer and Fisher combined p-values, directional robust
+    rank aggregation (up and down lists separately), BH-adjusted, plus per-cohort log2FC.
+
+    `method` picks the adjusted p-value used for the consensus 'Sig' call
+    ('random_effects' | 'stouffer' | 'fisher' | 'rra'); the pooled log2FC must also pass fc_thresh
+    and agree in sign with the majority of cohorts.
+    """
+    genes, arr, labels = align_cohorts(results, labels, min_cohorts)
+    if len(genes) == 0:
+        raise ValueError(f"No gene measured in at least {min_cohorts} cohorts.")
+    fc, p, se = arr['log2FC'], arr['pvalue'], arr['se']
+    table = pd.DataFrame({f"log2FC_{lbl}": fc[i] for i, lbl in enumerate(labels)}, index=pd.Index(genes, name='Gene'))
+    table['n_cohorts'] = (~np.isnan(fc)).sum(axis=0)
+
+    re = random_effects(fc, se)
+    re['re_z'], re['re_pvalue'] = re.pop('z'), re.pop('pvalue')
+    for key, val in re.items():
+        table[key] = val
+    table['stouffer_z'], table['stouffer_p'] = stouffer(fc, p, weights)
+    table['fisher_p'] = fisher(p)[1]
+
+    signed = np.sign(fc) * -np.log10(np.clip(p, 1e-300, 1.0))
+    _, p_up = rank_aggregation(signed)
+    _, p_down = rank_aggregation(-signed)
+    table['rra_p'] = np.minimum(1.0, 2 * np.minimum(p_up, p_down))
+    table['rra_direction'] = np.where(p_up <= p_down, 'Up', 'Down')
+
+    for col, out in [('re_pvalue', 're_padj'), ('stouffer_p', 'stouffer_padj'), ('fisher_p', 'fisher_padj'), ('rra_p', 'rra_padj')]:
+        pv = table[col].fillna(1.0).values
+        table[out] = multipletests(pv, method='fdr_bh')[1]
+
+    sign = np.sign(table['pooled_log2FC'].values)
+    table['direction_consistency'] = np.nanmean(np.where(np.isnan(fc), np.nan, np.sign(fc) == sign), axis=0)
+    padj = table[{'random_effects': 're_padj', 'stouffer': 'stouffer_padj', 'fisher': 'fisher_padj', 'rra': 'rra_padj'}[method]]
+    passed = (padj < p_thresh) & (table['pooled_log2FC'].abs() > fc_thresh) & (table['direction_consistency'] > 0.5)
+    table['Sig'] = np.where(passed, np.where(sign > 0, 'Up', 'Down'), 'NS')
+    return table.sort_values('re_pvalue', kind='stable'), labels
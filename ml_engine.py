@@ -0,0 +1,644 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def _oob_indices(tree, n_samples, n_bootstrap):
+    """Out-of-bag rows of one fitted forest tree (same bootstrap draw as sklearn's forest fit)."""
+    sampled = np.random.RandomState(tree.random_state).randint(0, n_samples, n_bootstrap)
+    return np.flatnonzero(np.bincount(sampled, minlength=n_samples) == 0)
+
+
+def _bootstrap_size(n_samples, max_samples):
+    """Rows drawn per tree, via sklearn's own helper (signature gained sample_weight in 1.6)."""
+    from sklearn.ensemble._forest import _get_n_samples_bootstrap
+    try:
+        return _get_n_samples_bootstrap(n_samples, max_samples, None)
+    except TypeError:
+        return _get_n_samples_bootstrap(n_samples, max_samples)
+
+
+def staged_oob_error(forest, X, y):
+    """
+    OOB error after each of the first k trees (k = 1..n_estimators) of an already fitted
+    bootstrap forest. Per-tree OOB class probabilities are accumulated incrementally, so the whole
+    convergence curve costs one pass over the trees instead of one forest fit per curve point.
+    Entries are NaN until every sample has been out-of-bag at least once (as sklearn's oob_score_).
+    """
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    if not forest.bootstrap:
+        raise ValueError("staged_oob_error requires a bootstrap forest (bootstrap=True).")
+    if forest.class_weight not in (None, 'balanced_subsample'):
+        # Recent sklearn folds class weights into the bootstrap draw itself; the rebuilt OOB rows would differ
+        raise ValueError(f"staged_oob_error cannot rebuild bootstrap draws weighted by class_weight={forest.class_weight!r}.")
+    n = X.shape[0]
+    n_bootstrap = _bootstrap_size(n, forest.max_samples)
+    class_idx = np.searchsorted(forest.classes_, y)
+    votes = np.zeros((n, len(forest.classes_)))
+    seen = np.zeros(n, dtype=bool)
+    errors = np.full(len(forest.estimators_), np.nan)
+    for k, tree in enumerate(forest.estimators_):
+        oob = _oob_indices(tree, n, n_bootstrap)
+        if len(oob):
+            votes[oob] += tree.predict_proba(X[oob])
+            seen[oob] = True
+        if seen.all():
+            errors[k] = np.mean(votes.argmax(axis=1) != class_idx)
+    return errors
+
+
+# ---------------------------------------------------------------------------
+# Nested cross-validation benchmark
+# ---------------------------------------------------------------------------
+# 折划分缓存：按标签向量指纹 + 折数 + 种子共享 (同一队列重复运行 / 多模型复用同一组划分)
+_SPLITS = {}
+
+# 超参搜索结果持久化目录 (按数据集保存最优配置，同一 GSE 再次运行时跳过搜索)
+DEFAULT_CACHE_DIR = os.environ.get("OPENCLAW_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".openclaw_cache"))
+
+# Worker-side copy of the design matrix (set once per process by the pool initializer)
+_WORKER_DATA = None
+
+# Worker-side view of the shared-memory design matrix used by stability selection
+_WORKER_STAB = None
+
+BENCHMARK_MODELS = ('rf', 'l1', 'svm', 'hgb')
+
+DEFAULT_GRIDS = {
+    'rf': [{'max_features': mf} for mf in ('sqrt', 0.2)],
+    'l1': [{'C': c} for c in (0.01, 0.1, 1.0, 10.0)],
+    'svm': [{'C': c} for c in (0.001, 0.01, 0.1, 1.0)],
+    'hgb': [{'max_leaf_nodes': m} for m in (7, 15)],
+}
+
+MODEL_LABELS = {'rf': 'Random Forest', 'l1': 'L1-Logistic', 'svm': 'Linear SVM', 'hgb': 'HistGradientBoosting'}
+
+
+def build_model(name, params=None, random_state=42):
+    """Unfitted single-threaded estimator pipeline (scaling is fitted inside each training fold)."""
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    params = dict(params or {})
+    if name == 'rf':
+        from sklearn.ensemble import RandomForestClassifier
+        est = RandomForestClassifier(n_estimators=params.pop('n_estimators', 100), n_jobs=1,
+                                     random_state=random_state, **params)
+    elif name == 'l1':
+        from sklearn.linear_model import LogisticRegression
+        est = LogisticRegression(penalty='l1', solver='liblinear', max_iter=3000, random_state=random_state, **params)
+    elif name == 'svm':
+        from sklearn.svm import LinearSVC
+        est = LinearSVC(max_iter=10000, random_state=random_state, **params)
+    elif name == 'hgb':
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        # GEO 队列样本量小：叶节点下限放宽到 5 (默认 20 会让树几乎无法分裂)
+        params.setdefault('min_samples_leaf', 5)
+        est = HistGradientBoostingClassifier(max_iter=params.pop('max_iter', 100), learning_rate=params.pop('learning_rate', 0.1),
+                                             early_stopping=False, random_state=random_state, **params)
+    else:
+        raise ValueError(f"Unknown model '{name}'. Choose from {BENCHMARK_MODELS}.")
+    return make_pipeline(StandardScaler(), est)
+
+
+def decision_scores(model, X):
+    """Continuous score for ROC/AUC: positive-class probability, else the decision function (LinearSVC)."""
+    if hasattr(model, 'predict_proba'):
+        try:
+            return model.predict_proba(X)[:, 1]
+        except AttributeError:
+            pass
+    return model.decision_function(X)
+
+
+def nested_cv_splits(y, n_outer=5, n_inner=3, seed=42):
+    """
+    Stratified outer folds and, for each outer training set, stratified inner folds (indices into
+    the outer training rows). Fold counts shrink to the minority class size so tiny cohorts still
+    split. Cached by label fingerprint + fold setup.
+    """
+    from sklearn.model_selection import StratifiedKFold
+    y = np.asarray(y)
+    key = (hashlib.sha1(y.astype(np.int64).tobytes()).hexdigest(), n_outer, n_inner, seed)
+    if key in _SPLITS:
+        return _SPLITS[key]
+    n_min = int(np.bincount(y).min())
+    n_outer = max(2, min(n_outer, n_min))
+    outer = list(StratifiedKFold(n_outer, shuffle=True, random_state=seed).split(np.zeros(len(y)), y))
+    splits = []
+    for train, test in outer:
+        y_tr = y[train]
+        k = max(2, min(n_inner, int(np.bincount(y_tr).min())))
+        inner = list(StratifiedKFold(k, shuffle=True, random_state=seed).split(np.zeros(len(y_tr)), y_tr))
+        splits.append({'train': train, 'test': test, 'inner': inner})
+    _SPLITS[key] = splits
+    return splits
+
+
+def _init_cv_worker(X, y):
+    global _WORKER_DATA
+    from threadpoolctl import threadpool_limits
+    # One BLAS/OpenMP thread per worker process: parallelism comes from the pool, not from the libraries
+    threadpool_limits(1)
+    _WORKER_DATA = (X, y)
+
+
+def _fit_score(args):
+    """Fit one configuration on `train` rows, return AUC on `test` rows (task unit of the pool)."""
+    from sklearn.metrics import roc_auc_score
+    name, params, train, test, seed = args
+    X, y = _WORKER_DATA
+    if len(np.unique(y[test])) < 2:
+        return np.nan
+    params = dict(params)
+    # Successive-halving budgets: a seeded row subsample and/or the first k (priority-ordered) columns
+    n_samples = params.pop('_n_samples', None)
+    n_features = params.pop('_n_features', None)
+    if n_samples is not None and n_samples < len(train):
+        train = np.random.RandomState(seed).permutation(train)[:n_samples]
+        if len(np.unique(y[train])) < 2:
+            return np.nan
+    cols = slice(None) if n_features is None else slice(0, n_features)
+    model = build_model(name, params, random_state=seed).fit(X[train][:, cols], y[train])
+    return roc_auc_score(y[test], decision_scores(model, X[test][:, cols]))
+
+
+def _run_tasks(tasks, X, y, n_jobs):
+    global _WORKER_DATA
+    if n_jobs == 1 or len(tasks) < 2:
+        from threadpoolctl import threadpool_limits
+        # In-process: scope the single-thread BLAS limit to this loop so the caller's thread pools are restored
+        _WORKER_DATA = (X, y)
+        with threadpool_limits(1):
+            return [_fit_score(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_cv_worker, initargs=(X, y)) as ex:
+        return list(ex.map(_fit_score, tasks, chunksize=max(1, len(tasks) // (4 * n_jobs))))
+
+
+def nested_cv_benchmark(X, y, models=BENCHMARK_MODELS, grids=None, n_outer=5, n_inner=3, n_jobs=None, seed=42):
+    """
+    Nested cross-validation AUC for several classifiers.
+
+    Inner folds pick each model's hyperparameters on the outer training rows; the chosen
+    configuration is refitted on the full outer training set and scored on the outer test fold.
+    All inner (model × outer fold × candidate × inner fold) fits run as one flat batch in a
+    bounded process pool, followed by one batch of outer refits, so wall time scales with cores.
+
+    Returns (summary DataFrame indexed by model with mean/sd/CI AUC, per-fold DataFrame, winner).
+    """
+    import pandas as pd
+    from scipy import stats
+    X = np.ascontiguousarray(np.asarray(X, dtype=np.float64))
+    y = np.asarray(y).astype(int)
+    grids = {**DEFAULT_GRIDS, **(grids or {})}
+    n_jobs = n_jobs or os.cpu_count() or 1
+    splits = nested_cv_splits(y, n_outer=n_outer, n_inner=n_inner, seed=seed)
+
+    # Stage 1: inner-loop model selection
+    inner_tasks, inner_keys = [], []
+    for name in models:
+        for o, fold in enumerate(splits):
+            for c, params in enumerate(grids[name]):
+                for tr, te in fold['inner']:
+                    inner_tasks.append((name, params, fold['train'][tr], fold['train'][te], seed))
+                    inner_keys.append((name, o, c))
+    inner_auc = pd.Series(_run_tasks(inner_tasks, X, y, n_jobs),
+                          index=pd.MultiIndex.from_tuples(inner_keys, names=['model', 'fold', 'cand']))
+    best = inner_auc.groupby(level=[0, 1, 2]).mean().fillna(-np.inf).groupby(level=[0, 1]).idxmax()
+
+    # Stage 2: outer refit with the selected configuration
+    outer_tasks, rows = [], []
+    for name in models:
+        for o, fold in enumerate(splits):
+            c = best[(name, o)][2]
+            outer_tasks.append((name, grids[name][c], fold['train'], fold['test'], seed))
+            rows.append({'model': name, 'fold': o, 'params': grids[name][c]})
+    for row, auc in zip(rows, _run_tasks(outer_tasks, X, y, n_jobs)):
+        row['auc'] = auc
+    folds = pd.DataFrame(rows)
+
+    summary = []
+    for name, g in folds.groupby('model', sort=False):
+        a = g['auc'].dropna().values
+        sd = a.std(ddof=1) if len(a) > 1 else 0.0
+        half = stats.t.ppf(0.975, len(a) - 1) * sd / np.sqrt(len(a)) if len(a) > 1 else 0.0
+        summary.append({'model': name, 'label': MODEL_LABELS.get(name, name), 'mean_auc': a.mean(),
+                        'sd_auc': sd, 'ci_low': max(0.0, a.mean() - half), 'ci_high': min(1.0, a.mean() + half),
+                        'n_folds': len(a)})
+    summary = pd.DataFrame(summary).set_index('model').sort_values('mean_auc', ascending=False, kind='stable')
+    return summary, folds, summary.index[0]
+
+
+# ---------------------------------------------------------------------------
+# Successive-halving hyperparameter search
+# ---------------------------------------------------------------------------
+DEFAULT_SEARCH_SPACES = {
+    'rf': {
+        'resource': 'n_estimators', 'min_resource': 25, 'max_resource': 400,
+        'params': {'max_features': ['sqrt', 'log2', 0.1, 0.3], 'min_samples_leaf': [1, 2, 4], 'max_depth': [None, 5, 10]},
+    },
+    'l1': {
+        'resource': 'n_samples', 'min_resource': 30, 'max_resource': None,
+        'params': {'C': [float(c) for c in np.round(np.logspace(-3, 2, 11), 5)], 'class_weight': [None, 'balanced']},
+    },
+}
+
+_RESOURCE_KEYS = {'n_estimators': 'n_estimators', 'n_samples': '_n_samples', 'n_features': '_n_features'}
+
+
+def _space_key(space):
+    return hashlib.sha1(json.dumps(space, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+
+
+def successive_halving_search(X, y, model='rf', space=None, n_candidates=None, factor=3, cv=3,
+                              time_budget=60.0, n_jobs=None, seed=42):
+    """
+    Successive halving over one resource (trees, training samples or features) for one model.
+
+    All candidates start on the smallest budget; after each rung only the best 1/factor by mean
+    CV AUC survive and the budget grows by `factor` until it reaches the maximum. Every rung is
+    one flat batch of (candidate × fold) fits in the process pool. If `time_budget` seconds are
+    exhausted, the search stops after the current rung and returns the best configuration so far.
+
+    Returns {'params', 'score', 'resource', 'budget', 'n_evaluated', 'rungs', 'elapsed', 'space_key'}.
+    """
+    from sklearn.model_selection import ParameterGrid, StratifiedKFold
+    start = time.time()
+    space = space or DEFAULT_SEARCH_SPACES[model]
+    X = np.ascontiguousarray(np.asarray(X, dtype=np.float64))
+    y = np.asarray(y).astype(int)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    resource = space['resource']
+    if resource == 'n_features':
+        # Feature budget = the k most variable columns
+        X = X[:, np.argsort(-X.var(axis=0), kind='stable')]
+    folds = list(StratifiedKFold(max(2, min(cv, int(np.bincount(y).min()))), shuffle=True,
+                                 random_state=seed).split(X, y))
+    full = {'n_estimators': space.get('max_resource') or 400, 'n_samples': min(len(tr) for tr, _ in folds),
+            'n_features': X.shape[1]}[resource]
+    r_max = min(space.get('max_resource') or full, full)
+    r = min(space.get('min_resource') or max(1, r_max // factor ** 3), r_max)
+
+    candidates = list(ParameterGrid(space['params']))
+    if n_candidates and n_candidates < len(candidates):
+        pick = np.random.RandomState(seed).choice(len(candidates), n_candidates, replace=False)
+        candidates = [candidates[i] for i in sorted(pick)]
+
+    rungs, best, n_eval = [], None, 0
+    while candidates:
+        tasks = [(model, {**c, _RESOURCE_KEYS[resource]: int(r)}, tr, te, seed) for c in candidates for tr, te in folds]
+        scores = np.nanmean(np.asarray(_run_tasks(tasks, X, y, n_jobs), dtype=float).reshape(len(candidates), len(folds)), axis=1)
+        scores = np.where(np.isfinite(scores), scores, -np.inf)
+        n_eval += len(candidates)
+        order = np.argsort(-scores, kind='stable')
+        best = {'params': candidates[order[0]], 'score': float(scores[order[0]]), 'budget': int(r)}
+        rungs.append({'budget': int(r), 'n_candidates': len(candidates), 'best_score': best['score']})
+        print(f"    [halving:{model}] {resource}={int(r)}: {len(candidates)} candidates, best AUC {best['score']:.3f}")
+        if r >= r_max or len(candidates) == 1 or time.time() - start > time_budget:
+            break
+        candidates = [candidates[i] for i in order[:max(1, len(candidates) // factor)]]
+        r = min(r * factor, r_max)
+
+    params = dict(best['params'])
+    if resource == 'n_estimators':
+        params['n_estimators'] = best['budget']
+    return {'params': params, 'score': best['score'], 'resource': resource, 'budget': best['budget'],
+            'n_evaluated': n_eval, 'rungs': rungs, 'elapsed': time.time() - start, 'space_key': _space_key(space)}
+
+
+def tuned_params(dataset_key, X, y, models=('rf', 'l1'), spaces=None, time_budget=60.0, n_jobs=None,
+                 cache_dir=None, force=False, seed=42):
+    """
+    Best configuration per model for one dataset, searched once and persisted as JSON
+    (<cache_dir>/ml_tuning/<dataset_key>.json). A stored result is reused as long as the search
+    space is unchanged; the time budget is shared across the models to be searched.
+    """
+    spaces = {**DEFAULT_SEARCH_SPACES, **(spaces or {})}
+    cache_dir = cache_dir or os.path.join(DEFAULT_CACHE_DIR, "ml_tuning")
+    safe_key = "".join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in str(dataset_key))
+    path = os.path.join(cache_dir, f"{safe_key}.json")
+    stored = {}
+    if os.path.exists(path) and not force:
+        with open(path, encoding='utf-8') as fh:
+            stored = json.load(fh)
+
+    start, out, changed = time.time(), {}, False
+    todo = [m for m in models if force or stored.get(m, {}).get('space_key') != _space_key(spaces[m])]
+    for m in models:
+        if m not in todo:
+            print(f"  [*] Reusing stored {m} hyperparameters for {dataset_key}: {stored[m]['params']}")
+            out[m] = stored[m]
+            continue
+        remaining = max(1.0, time_budget - (time.time() - start)) / max(1, len(todo) - todo.index(m))
+        out[m] = stored[m] = successive_halving_search(X, y, model=m, space=spaces[m], time_budget=remaining,
+                                                       n_jobs=n_jobs, seed=seed)
+        changed = True
+    if changed:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fh:
+            json.dump(stored, fh, indent=2, default=str)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# AUC uncertainty: vectorized bootstrap and DeLong test
+# ---------------------------------------------------------------------------
+def rank_auc(scores, n_pos):
+    """
+    Mann-Whitney AUC for each row of `scores` whose first n_pos columns are positives:
+    AUC = (sum of positive mid-ranks − n_pos(n_pos+1)/2) / (n_pos · n_neg). Ties count 1/2.
+    """
+    from scipy.stats import rankdata
+    scores = np.atleast_2d(scores)
+    n_neg = scores.shape[1] - n_pos
+    ranks = rankdata(scores, axis=1)
+    return (ranks[:, :n_pos].sum(axis=1) - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg)
+
+
+def bootstrap_auc_ci(y, scores, n_boot=2000, alpha=0.05, seed=42):
+    """
+    Stratified bootstrap percentile CIs for the AUC of one or several score vectors.
+
+    Positives and negatives are resampled separately (every replicate keeps both classes) and
+    all replicates are drawn at once as one integer index matrix shared by every model, so the
+    replicate AUCs of different models are paired. `scores` maps model name → score vector.
+    Returns {name: {'auc', 'ci_low', 'ci_high'}}; with two or more models, also
+    '<a>-<b>' entries giving the CI of the paired AUC difference.
+    """
+    y = np.asarray(y).astype(int)
+    pos, neg = np.flatnonzero(y == 1), np.flatnonzero(y == 0)
+    rng = np.random.default_rng(seed)
+    idx = np.hstack([pos[rng.integers(0, len(pos), (n_boot, len(pos)))],
+                     neg[rng.integers(0, len(neg), (n_boot, len(neg)))]])
+    order = np.concatenate([pos, neg])
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    out, reps = {}, {}
+    for name, s in scores.items():
+        s = np.asarray(s, dtype=float)
+        reps[name] = rank_auc(s[idx], len(pos))
+        lo, hi = np.percentile(reps[name], q)
+        out[name] = {'auc': float(rank_auc(s[order], len(pos))[0]), 'ci_low': float(lo), 'ci_high': float(hi)}
+    names = list(scores)
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            lo, hi = np.percentile(reps[a] - reps[b], q)
+            out[f"{a}-{b}"] = {'auc': out[a]['auc'] - out[b]['auc'], 'ci_low': float(lo), 'ci_high': float(hi)}
+    return out
+
+
+def delong_test(y, scores_a, scores_b):
+    """
+    DeLong test for two correlated ROC AUCs on the same samples (fast midrank formulation,
+    Sun & Xu 2014). Returns {'auc_a', 'auc_b', 'diff', 'se', 'z', 'pvalue'}.
+    """
+    from scipy.stats import rankdata, norm
+    y = np.asarray(y).astype(int)
+    S = np.vstack([np.asarray(scores_a, dtype=float), np.asarray(scores_b, dtype=float)])
+    X, Y = S[:, y == 1], S[:, y == 0]
+    m, n = X.shape[1], Y.shape[1]
+    tx, ty = rankdata(X, axis=1), rankdata(Y, axis=1)
+    tz = rankdata(np.hstack([X, Y]), axis=1)
+    aucs = (tz[:, :m].sum(axis=1) - m * (m + 1) / 2.0) / (m * n)
+    v01 = (tz[:, :m] - tx) / n
+    v10 = 1.0 - (tz[:, m:] - ty) / m
+    cov = np.atleast_2d(np.cov(v01)) / m + np.atleast_2d(np.cov(v10)) / n
+    var = cov[0, 0] + cov[1, 1] - 2 * cov[0, 1]
+    diff = aucs[0] - aucs[1]
+    se = np.sqrt(var) if var > 0 else 0.0
+    z = diff / se if se > 0 else 0.0
+    return {'auc_a': float(aucs[0]), 'auc_b': float(aucs[1]), 'diff': float(diff), 'se': float(se),
+            'z': float(z), 'pvalue': float(2 * norm.sf(abs(z))) if se > 0 else 1.0}
+
+
+# ---------------------------------------------------------------------------
+# Stability selection for L1-logistic panels
+# ---------------------------------------------------------------------------
+def _init_stability_worker(shm_name, shape, dtype, y):
+    global _WORKER_STAB
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Keep the handle alive with the view: the buffer is unmapped when shm is garbage-collected
+    _WORKER_STAB = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf), y)
+
+
+def _half_subsample(y, seed):
+    """Stratified random half of the rows (per class floor(n_c / 2))."""
+    rng = np.random.default_rng(seed)
+    parts = [rng.choice(idx, len(idx) // 2, replace=False) for idx in (np.flatnonzero(y == c) for c in np.unique(y))]
+    return np.sort(np.concatenate(parts))
+
+
+def _stability_fits(X, y, seeds, Cs, max_iter=1000, tol=1e-3):
+    """
+    Selection masks (len(seeds) × len(Cs) × n_features) for L1-logistic fits on half-subsamples.
+    Each fit is warm-started from the previous subsample's solution at the same C (solutions on
+    overlapping halves are close, so saga converges in a few epochs).
+    """
+    from sklearn.linear_model import LogisticRegression
+    model = LogisticRegression(penalty='l1', solver='saga', warm_start=True, max_iter=max_iter, tol=tol)
+    prev = [None] * len(Cs)
+    out = np.zeros((len(seeds), len(Cs), X.shape[1]), dtype=bool)
+    for i, seed in enumerate(seeds):
+        rows = _half_subsample(y, seed)
+        Xs, ys = X[rows], y[rows]
+        for j, C in enumerate(Cs):
+            model.set_params(C=C)
+            if prev[j] is not None:
+                model.coef_, model.intercept_ = prev[j][0].copy(), prev[j][1].copy()
+            elif hasattr(model, 'coef_'):
+                del model.coef_, model.intercept_
+            model.fit(Xs, ys)
+            prev[j] = (model.coef_, model.intercept_)
+            out[i, j] = np.abs(model.coef_.ravel()) > 1e-6
+    return out
+
+
+def _stability_chunk(args):
+    seeds, Cs = args
+    _, X, y = _WORKER_STAB
+    return _stability_fits(X, y, seeds, Cs)
+
+
+def stability_selection(X, y, Cs=None, n_subsamples=200, threshold=0.6, n_jobs=None, seed=42, feature_names=None):
+    """
+    Stability selection (Meinshausen & Bühlmann 2010) for L1-logistic.
+
+    L1-logistic is fitted on `n_subsamples` stratified half-subsamples for every C in `Cs`
+    (default: a sparse grid just above the entry point of the L1 path);
+    a feature's stability is its maximum selection frequency over the C grid and the stable
+    panel is every feature with stability ≥ threshold. Subsamples are split into one chunk per
+    worker; workers read X from one shared-memory block instead of receiving copies.
+
+    Returns (DataFrame indexed by feature with per-C frequencies, 'stability' and 'stable',
+    info dict with the mean number of selected features q and the expected false-selection
+    bound q² / ((2·threshold − 1) · p)).
+    """
+    import pandas as pd
+    X = np.ascontiguousarray(np.asarray(X, dtype=np.float64))
+    y = np.asarray(y).astype(int)
+    if Cs is None:
+        # Default grid: 1-4× the smallest C that admits any feature on a half-subsample, i.e. the
+        # sparse regime where stability selection controls false selections (q ≪ p)
+        from sklearn.svm import l1_min_c
+        Cs = 2 * l1_min_c(X, y, loss='log') * np.logspace(0, np.log10(4), 4)
+    Cs = np.sort(np.atleast_1d(Cs).astype(float))
+    n_jobs = min(n_jobs or os.cpu_count() or 1, n_subsamples)
+    seeds = np.random.SeedSequence(seed).generate_state(n_subsamples)
+
+    if n_jobs == 1:
+        masks = _stability_fits(X, y, seeds, Cs)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=X.nbytes)
+        try:
+            np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[:] = X
+            chunks = [(part, Cs) for part in np.array_split(seeds, n_jobs)]
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_stability_worker,
+                                     initargs=(shm.name, X.shape, X.dtype, y)) as ex:
+                masks = np.concatenate(list(ex.map(_stability_chunk, chunks)))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    freq = masks.mean(axis=0)  # len(Cs) × n_features
+    names = feature_names if feature_names is not None else np.arange(X.shape[1])
+    table = pd.DataFrame(freq.T, index=names, columns=[f"freq_C={c:.3g}" for c in Cs])
+    table['stability'] = freq.max(axis=0)
+    table['stable'] = table['stability'] >= threshold
+    table = table.sort_values('stability', ascending=False, kind='stable')
+    q = float(masks.sum(axis=2).mean(axis=0).max())
+    info = {'n_subsamples': int(n_subsamples), 'Cs': [float(c) for c in Cs], 'threshold': float(threshold),
+            'q': q, 'expected_false_selections': q ** 2 / ((2 * threshold - 1) * X.shape[1]) if threshold > 0.5 else np.nan,
+            'n_stable': int(table['stable'].sum())}
+    return table, info
+
+
+# ---------------------------------------------------------------------------
+# Persisted model bundle and batch scoring
+# ---------------------------------------------------------------------------
+BUNDLE_VERSION = 1
+
+# 已加载模型包缓存 (按路径 + mtime)，批量打分时只反序列化一次
+_BUNDLES = {}
+
+
+def normalize_symbols(genes):
+    """Gene symbols as a stripped, upper-cased Index (the key used for bundle alignment)."""
+    import pandas as pd
+    return pd.Index([str(g).strip().upper() for g in genes])
+
+
+def collapse_symbols(expr):
+    """
+    One row per normalized (stripped, upper-cased) gene symbol: duplicated and case-colliding
+    rows are averaged. Training features and bundle scoring both go through this, so every
+    feature maps to exactly one bundle column.
+    """
+    symbols = normalize_symbols(expr.index)
+    if symbols.has_duplicates:
+        return expr.groupby(symbols, sort=False).mean()
+    return expr.set_axis(symbols, axis=0)
+
+
+def save_model_bundle(path, features, scaler, models, scaling='train', metadata=None):
+    """
+    Persist everything needed to score a new cohort without re-running the pipeline: the ordered
+    feature list, the gene-alignment map (normalized symbol → feature column), the training
+    scaler state (also the imputation values for missing genes), and the fitted models.
+    `scaling` records how the training run standardized its test data: 'train' (training scaler)
+    or 'per_cohort' (each cohort standardized on itself, cross-dataset mode).
+    Writes <path> (joblib) plus a human-readable <path>.json manifest.
+    """
+    import joblib
+    from datetime import datetime
+    features = list(features)
+    gene_map = {g: i for i, g in enumerate(normalize_symbols(features))}
+    if len(gene_map) != len(features):
+        raise ValueError("Bundle features must be unique after symbol normalization; collapse duplicates before fitting.")
+    bundle = {
+        'version': BUNDLE_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'features': features,
+        'gene_map': gene_map,
+        'scaler_mean': np.asarray(scaler.mean_, dtype=float),
+        'scaler_scale': np.asarray(scaler.scale_, dtype=float),
+        'scaling': scaling,
+        'models': dict(models),
+        'metadata': dict(metadata or {}),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    joblib.dump(bundle, path, compress=3)
+    manifest = {k: bundle[k] for k in ('version', 'created', 'features', 'scaling', 'metadata')}
+    manifest['models'] = {name: type(m).__name__ for name, m in bundle['models'].items()}
+    with open(f"{path}.json", 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2, ensure_ascii=False, default=str)
+    return path
+
+
+def load_model_bundle(path):
+    """Load a model bundle once per (path, mtime); rejects bundles written by a newer format version."""
+    import joblib
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+    if key not in _BUNDLES:
+        bundle = joblib.load(path)
+        if bundle.get('version', 0) > BUNDLE_VERSION:
+            raise ValueError(f"Model bundle version {bundle.get('version')} is newer than supported ({BUNDLE_VERSION}).")
+        _BUNDLES[key] = bundle
+    return _BUNDLES[key]
+
+
+def align_to_bundle(bundle, expr):
+    """
+    Samples × features matrix in the bundle's feature order from an expression DataFrame
+    (genes × samples). Symbols are matched case-insensitively (duplicates averaged); genes
+    absent from the cohort are imputed with the training mean. Returns (matrix, missing genes).
+    """
+    expr = collapse_symbols(expr)
+    pos = expr.index.get_indexer(list(bundle['gene_map']))
+    found = pos >= 0
+    M = np.tile(bundle['scaler_mean'], (expr.shape[1], 1))
+    M[:, found] = np.asarray(expr.values, dtype=float)[pos[found]].T
+    # Sporadic NaNs (per-sample missing values) get the same training-mean imputation
+    nan = np.isnan(M)
+    if nan.any():
+        M[nan] = np.broadcast_to(bundle['scaler_mean'], M.shape)[nan]
+    missing = [bundle['features'][i] for i in np.flatnonzero(~found)]
+    return M, missing
+
+
+def score_expression(bundle, expr, batch_size=5000):
+    """
+    Score one cohort (expression DataFrame, genes × samples) with every model in the bundle.
+    Alignment is one indexer lookup; scaling and prediction run on sample batches of
+    `batch_size`. Returns (DataFrame samples × '<model>_score', report dict with missing genes).
+    """
+    import pandas as pd
+    if isinstance(bundle, str):
+        bundle = load_model_bundle(bundle)
+    M, missing = align_to_bundle(bundle, expr)
+    if bundle['scaling'] == 'per_cohort':
+        mean, scale = M.mean(axis=0), M.std(axis=0)
+        scale = np.where(scale > 0, scale, 1.0)
+    else:
+        mean, scale = bundle['scaler_mean'], bundle['scaler_scale']
+    out = {f"{name}_score": np.empty(M.shape[0]) for name in bundle['models']}
+    for start in range(0, M.shape[0], batch_size):
+        Z = (M[start:start + batch_size] - mean) / scale
+        for name, model in bundle['models'].items():
+            out[f"{name}_score"][start:start + batch_size] = decision_scores(model, Z)
+    report = {'n_samples': int(M.shape[0]), 'n_features': len(bundle['features']),
+              'n_missing': len(missing), 'missing_genes': missing}
+    if missing:
+        print(f"  [!] {len(missing)}/{len(bundle['features'])} model genes missing from cohort; imputed with training means.")
+    return pd.DataFrame(out, index=expr.columns), report
+
+
+def score_cohorts(bundle_path, cohorts, batch_size=5000):
+    """Load a bundle once and score several cohorts ({name: expression DataFrame}); returns {name: (scores, report)}."""
+    bundle = load_model_bundle(bundle_path)
+    return {name: score_expression(bundle, expr, batch_size=batch_size) for name, expr in cohorts.items()}
@@ -0,0 +1,503 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+
+
+def prepare_survival(time, event):
+    """
+    Sort once by follow-up time and precompute the tie structure shared by every estimator:
+    the time order, the first position of each tied block (risk sets include all tied samples)
+    and the event indicator in sorted order.
+    """
+    time = np.asarray(time, dtype=float)
+    event = np.asarray(event).astype(bool)
+    order = np.argsort(time, kind='stable')
+    t = time[order]
+    # Position of the first sample sharing each sample's time (sorted order)
+    first = np.searchsorted(t, t, side='left')
+    return {'order': order, 'time': t, 'event': event[order], 'first': first, 'n': len(t)}
+
+
+def _risk_sums(A, first):
+    """Risk-set sums Σ_{t_j ≥ t_i} A[:, j] for every i: reverse cumulative sum read at each tie block start."""
+    rev = np.cumsum(A[:, ::-1], axis=1)[:, ::-1]
+    return rev[:, first]
+
+
+def cox_univariate(X, time, event, max_iter=30, tol=1e-8, max_step=1.0, chunk_size=2000):
+    """
+    Univariate Cox proportional-hazards fits for every row of X (genes × samples) at once.
+
+    Breslow partial likelihood; risk-set sums S0/S1/S2 come from time-sorted reverse cumulative
+    sums, and Newton–Raphson updates are array operations across all genes of a chunk. Each
+    gene is standardized for the iterations (step length capped at `max_step` SD units, which
+    keeps monotone-likelihood genes from overflowing) and coefficients are mapped back to
+    per-unit expression. Genes that do not converge within max_iter are flagged.
+
+    Returns a DataFrame (index = rows of X when X is a DataFrame) with coef, se, HR,
+    HR_lower/HR_upper (95% Wald CI), z, pvalue, padj (BH) and converged.
+    """
+    index = X.index if isinstance(X, pd.DataFrame) else None
+    X = np.asarray(X, dtype=float)
+    surv = prepare_survival(time, event)
+    ev = surv['event']
+    Xs_all = X[:, surv['order']]
+    out = {k: np.full(X.shape[0], np.nan) for k in ('coef', 'se', 'z')}
+    converged = np.zeros(X.shape[0], dtype=bool)
+
+    for start in range(0, X.shape[0], chunk_size):
+        Z = Xs_all[start:start + chunk_size]
+        mu, sd = Z.mean(axis=1, keepdims=True), Z.std(axis=1, keepdims=True)
+        ok = sd.ravel() > 0
+        Z = (Z - mu) / np.where(sd > 0, sd, 1.0)
+        Ze = Z[:, ev]
+        beta = np.zeros(Z.shape[0])
+        active = ok.copy()
+        info = np.zeros(Z.shape[0])
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            b, Za = beta[active], Z[active]
+            eta = b[:, None] * Za
+            E = np.exp(eta - eta.max(axis=1, keepdims=True))
+            S0 = _risk_sums(E, surv['first'])[:, ev]
+            S1 = _risk_sums(E * Za, surv['first'])[:, ev]
+            S2 = _risk_sums(E * Za * Za, surv['first'])[:, ev]
+            m1 = S1 / S0
+            score = (Ze[active] - m1).sum(axis=1)
+            hess = (S2 / S0 - m1 * m1).sum(axis=1)
+            step = np.clip(score / np.where(hess > 0, hess, np.nan), -max_step, max_step)
+            step = np.nan_to_num(step)
+            beta[active] = b + step
+            info[active] = hess
+            done = np.abs(step) < tol
+            idx = np.flatnonzero(active)
+            converged[start + idx[done]] = True
+            active[idx[done]] = False
+
+        # Information at the final estimate (for genes stopped by max_iter this is the last iterate)
+        eta = beta[:, None] * Z
+        E = np.exp(eta - eta.max(axis=1, keepdims=True))
+        S0 = _risk_sums(E, surv['first'])[:, ev]
+        m1 = _risk_sums(E * Z, surv['first'])[:, ev] / S0
+        info = (_risk_sums(E * Z * Z, surv['first'])[:, ev] / S0 - m1 * m1).sum(axis=1)
+        scale = np.where(sd.ravel() > 0, sd.ravel(), np.nan)
+        se = np.where(ok & (info > 0), 1.0 / np.sqrt(np.where(info > 0, info, 1.0)), np.nan)
+        sl = slice(start, start + Z.shape[0])
+        out['coef'][sl] = np.where(ok, beta, np.nan) / scale
+        out['se'][sl] = se / scale
+        out['z'][sl] = np.where(ok, beta, np.nan) / se
+
+    res = pd.DataFrame(out, index=index)
+    res['HR'] = np.exp(res['coef'])
+    res['HR_lower'] = np.exp(res['coef'] - 1.959964 * res['se'])
+    res['HR_upper'] = np.exp(res['coef'] + 1.959964 * res['se'])
+    res['pvalue'] = 2 * stats.norm.sf(np.abs(res['z']))
+    res['padj'] = np.nan
+    valid = res['pvalue'].notna()
+    if valid.any():
+        res.loc[valid, 'padj'] = multipletests(res.loc[valid, 'pvalue'], method='fdr_bh')[1]
+    res['converged'] = converged
+    return res[['coef', 'se', 'HR', 'HR_lower', 'HR_upper', 'z', 'pvalue', 'padj', 'converged']]
+
+
+def logrank_matrix(groups, time, event=None):
+    """
+    Two-group log-rank tests for many group splits of the same samples in one pass.
+
+    `groups` is a boolean matrix (splits × samples, original sample order; True = group 1).
+    With the samples time-sorted once, at-risk counts per split are reverse cumulative sums
+    and event counts are cumulative sums differenced over tied event times, so all splits
+    share the same O(splits × samples) array work. `time` may be a prepare_survival() dict.
+
+    Returns dict of arrays: o_minus_e (observed − expected events in group 1), var, chi2, pvalue.
+    """
+    surv = time if isinstance(time, dict) else prepare_survival(time, event)
+    G = np.atleast_2d(np.asarray(groups, dtype=float))[:, surv['order']]
+    t, ev, n = surv['time'], surv['event'], surv['n']
+    ev_times = np.unique(t[ev])
+    lo = np.searchsorted(t, ev_times, side='left')
+    hi = np.searchsorted(t, ev_times, side='right')
+    n_risk = (n - lo).astype(float)
+    cum_ev = np.concatenate([[0.0], np.cumsum(ev)])
+    d = cum_ev[hi] - cum_ev[lo]
+
+    rev = np.cumsum(G[:, ::-1], axis=1)[:, ::-1]
+    n1 = rev[:, lo]
+    cum_ev1 = np.concatenate([np.zeros((G.shape[0], 1)), np.cumsum(G * ev, axis=1)], axis=1)
+    d1 = cum_ev1[:, hi] - cum_ev1[:, lo]
+
+    frac = n1 / n_risk
+    o_minus_e = (d1 - d * frac).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (d * frac * (1 - frac) * np.where(n_risk > 1, (n_risk - d) / (n_risk - 1), 0.0)).sum(axis=1)
+        chi2 = np.where(var > 0, o_minus_e ** 2 / var, 0.0)
+    return {'o_minus_e': o_minus_e, 'var': var, 'chi2': chi2, 'pvalue': stats.chi2.sf(chi2, 1)}
+
+
+def maxstat_pvalue(stat, min_prop=0.1):
+    """
+    Lausen & Schumacher (1992) approximation for the p-value of a maximally selected
+    standardized log-rank statistic over cutpoints restricted to the [min_prop, 1 − min_prop]
+    quantile range.
+    """
+    b = np.sqrt(np.asarray(stat, dtype=float))
+    e1, e2 = min_prop, 1 - min_prop
+    phi = stats.norm.pdf(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = phi * (b - 1 / b) * np.log(e2 * (1 - e1) / ((1 - e2) * e1)) + 4 * phi / b
+    p = np.where(b > 0, p, 1.0)
+    # The approximation breaks down for small statistics; never report less than the unadjusted p
+    return np.clip(np.maximum(p, stats.chi2.sf(b ** 2, 1)), 0.0, 1.0)
+
+
+def optimal_cutpoint(x, time, event=None, min_prop=0.1):
+    """
+    Maximally selected log-rank cutpoint for one gene: every distinct expression value inside
+    the [min_prop, 1 − min_prop] quantile range is a candidate (group 1 = samples above it),
+    and all candidates are tested in one logrank_matrix call.
+
+    Returns {'cutpoint', 'chi2', 'pvalue' (unadjusted), 'pvalue_adj' (maximally selected),
+    'high_risk' (True when the high-expression group has more events than expected),
+    'cutpoints', 'chi2_all'}.
+    """
+    x = np.asarray(x, dtype=float)
+    lo, hi = np.quantile(x, [min_prop, 1 - min_prop])
+    cuts = np.unique(x[(x >= lo) & (x < hi)])
+    if len(cuts) == 0:
+        cuts = np.array([np.median(x)])
+    res = logrank_matrix(x[None, :] > cuts[:, None], time, event)
+    k = int(np.argmax(res['chi2']))
+    return {'cutpoint': float(cuts[k]), 'chi2': float(res['chi2'][k]), 'pvalue': float(res['pvalue'][k]),
+            'pvalue_adj': float(maxstat_pvalue(res['chi2'][k], min_prop)), 'high_risk': bool(res['o_minus_e'][k] > 0),
+            'cutpoints': cuts, 'chi2_all': res['chi2']}
+
+
+def logrank_screen(X, time, event=None, split='median', min_prop=0.1):
+    """
+    Genome-wide log-rank table for X (genes × samples DataFrame).
+
+    split='median': each gene split at its own median, all genes in one logrank_matrix pass.
+    split='maxstat': per-gene optimal cutpoint with the maximally selected p-value (one
+    vectorized pass over candidate cutpoints per gene).
+    """
+    surv = time if isinstance(time, dict) else prepare_survival(time, event)
+    vals = np.asarray(X, dtype=float)
+    if split == 'median':
+        res = logrank_matrix(vals > np.median(vals, axis=1, keepdims=True), surv)
+        table = pd.DataFrame({'cutpoint': np.median(vals, axis=1), 'chi2': res['chi2'], 'pvalue': res['pvalue'],
+                              'high_risk': res['o_minus_e'] > 0}, index=X.index)
+    else:
+        rows = []
+        for g, x in zip(X.index, vals):
+            r = optimal_cutpoint(x, surv, min_prop=min_prop)
+            rows.append({'gene': g, 'cutpoint': r['cutpoint'], 'chi2': r['chi2'], 'pvalue': r['pvalue'],
+                         'pvalue_adj': r['pvalue_adj'], 'high_risk': r['high_risk']})
+        table = pd.DataFrame(rows).set_index('gene')
+    p_col = 'pvalue_adj' if 'pvalue_adj' in table else 'pvalue'
+    table['padj'] = multipletests(table[p_col].fillna(1.0), method='fdr_bh')[1]
+    return table.sort_values(p_col)
+
+
+# ---------------------------------------------------------------------------
+# Penalized (elastic-net) Cox regression
+# ---------------------------------------------------------------------------
+def _cox_grad_hess(eta, surv):
+    """
+    Gradient and diagonal Hessian of the Breslow log partial likelihood w.r.t. the linear
+    predictor (time-sorted order), from cumulative sums over event times (glmnet's Cox IRLS terms).
+    """
+    first, ev = surv['first'], surv['event']
+    w = np.exp(eta - eta.max())
+    S0 = np.cumsum(w[::-1])[::-1][first]
+    a = np.where(ev, 1.0 / S0, 0.0)
+    a2 = np.where(ev, 1.0 / S0 ** 2, 0.0)
+    # Σ over events k with t_k ≤ t_i (tied events included): cumulative sum read at the tie block end
+    last = np.searchsorted(surv['time'], surv['time'], side='right') - 1
+    c1, c2 = np.cumsum(a)[last], np.cumsum(a2)[last]
+    grad = ev - w * c1
+    hess = w * c1 - w * w * c2
+    return grad, hess
+
+
+def cox_partial_loglik(eta, surv):
+    """Breslow log partial likelihood of a linear predictor given in time-sorted order."""
+    m = eta.max()
+    S0 = np.cumsum(np.exp(eta - m)[::-1])[::-1][surv['first']]
+    ev = surv['event']
+    return float((eta[ev] - m - np.log(S0[ev])).sum())
+
+
+def coxnet_path(X, time, event=None, l1_ratio=1.0, lambdas=None, n_lambda=50, lambda_min_ratio=0.05,
+                max_iter=100, tol=1e-7):
+    """
+    Elastic-net Cox path by coordinate descent (Simon, Friedman, Hastie & Tibshirani 2011).
+
+    X is samples × features and is standardized internally. Each λ is solved by IRLS on the
+    Breslow partial likelihood (quadratic approximation from _cox_grad_hess) with cyclic
+    coordinate descent restricted to the active set until it stabilizes, warm-started from the
+    previous λ. Penalty: λ (l1_ratio·|β|₁ + (1 − l1_ratio)/2·|β|²₂) on the loss −ℓ(β)/n.
+    Convergence uses glmnet's criterion max_j (x_jᵀWx_j)·Δβ_j² < tol.
+
+    Returns {'lambdas', 'coefs' (n_lambda × features, original scale), 'coefs_std', 'mean', 'scale'}.
+    """
+    surv = time if isinstance(time, dict) else prepare_survival(time, event)
+    X = np.asarray(X, dtype=float)
+    mean, scale = X.mean(axis=0), X.std(axis=0)
+    scale = np.where(scale > 0, scale, 1.0)
+    # Column-major so the coordinate updates read contiguous feature columns
+    Z = np.asfortranarray(((X - mean) / scale)[surv['order']])
+    n, p = Z.shape
+    alpha = max(l1_ratio, 1e-3)
+
+    if lambdas is None:
+        g0, _ = _cox_grad_hess(np.zeros(n), surv)
+        lam_max = np.abs(Z.T @ g0).max() / (n * alpha)
+        lambdas = lam_max * np.logspace(0, np.log10(lambda_min_ratio), n_lambda)
+    lambdas = np.asarray(lambdas, dtype=float)
+
+    beta = np.zeros(p)
+    eta = np.zeros(n)
+    coefs = np.zeros((len(lambdas), p))
+    for k, lam in enumerate(lambdas):
+        l1, l2 = lam * alpha, lam * (1 - alpha)
+        for _ in range(max_iter):
+            grad, hess = _cox_grad_hess(eta, surv)
+            w = np.maximum(hess, 1e-10) / n
+            r = grad / np.maximum(hess, 1e-10)          # working residual z − η
+            xw = np.asfortranarray(Z * w[:, None])
+            denom = (xw * Z).sum(axis=0) + l2
+            beta_old = beta.copy()
+            active = np.flatnonzero(beta)
+            while True:
+                # Cyclic coordinate descent on the active set only
+                for _ in range(1000):
+                    max_delta = 0.0
+                    for j in active:
+                        bj = beta[j]
+                        rho = xw[:, j] @ r + (denom[j] - l2) * bj
+                        new = np.sign(rho) * max(abs(rho) - l1, 0.0) / denom[j]
+                        if new != bj:
+                            r -= (new - bj) * Z[:, j]
+                            beta[j] = new
+                            max_delta = max(max_delta, denom[j] * (new - bj) ** 2)
+                    if max_delta < tol:
+                        break
+                # KKT check for all inactive coefficients in one matrix-vector product
+                rho_all = xw.T @ r
+                violators = np.flatnonzero((beta == 0) & (np.abs(rho_all) > l1 * (1 + 1e-9)))
+                if len(violators) == 0:
+                    break
+                active = np.union1d(np.flatnonzero(beta), violators)
+            eta = Z @ beta
+            if np.max(denom * (beta - beta_old) ** 2) < tol:
+                break
+        coefs[k] = beta
+    return {'lambdas': lambdas, 'coefs': coefs / scale, 'coefs_std': coefs.copy(), 'mean': mean, 'scale': scale}
+
+
+def _coxnet_fold(args):
+    X, time, event, train, test, l1_ratio, lambdas = args
+    s_tr = prepare_survival(time[train], event[train])
+    path = coxnet_path(X[train], s_tr, l1_ratio=l1_ratio, lambdas=lambdas)
+    s_all = prepare_survival(time, event)
+    # Verweij & van Houwelingen cross-validated partial likelihood: ℓ_full(β₋ₖ) − ℓ₋ₖ(β₋ₖ)
+    eta_all = (X - path['mean']) @ path['coefs'].T
+    eta_tr = eta_all[train]
+    cvl = np.array([cox_partial_loglik(eta_all[s_all['order'], k], s_all) - cox_partial_loglik(eta_tr[s_tr['order'], k], s_tr)
+                    for k in range(len(lambdas))])
+    return cvl, eta_all[test]
+
+
+def coxnet_cv(X, time, event, l1_ratio=1.0, n_lambda=50, lambda_min_ratio=0.05, n_folds=5, n_jobs=None, seed=42):
+    """
+    Cross-validated elastic-net Cox. The λ sequence comes from the full data; each fold's path
+    is fitted (folds in a process pool when n_jobs > 1) and scored by the cross-validated partial
+    likelihood. Returns {'path' (full-data fit), 'lambdas', 'cvl' (folds × λ), 'best_index',
+    'best_lambda', 'coef' (original scale at the best λ), 'oof_risk' (out-of-fold linear
+    predictor at the best λ, sample order)}.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    X = np.asarray(X, dtype=float)
+    time = np.asarray(time, dtype=float)
+    event = np.asarray(event).astype(int)
+    full = coxnet_path(X, time, event, l1_ratio=l1_ratio, n_lambda=n_lambda, lambda_min_ratio=lambda_min_ratio)
+    lambdas = full['lambdas']
+    # Stratify folds on the event indicator so every fold has events
+    rng = np.random.default_rng(seed)
+    fold_id = np.empty(len(time), dtype=int)
+    for e in (0, 1):
+        idx = rng.permutation(np.flatnonzero(event == e))
+        fold_id[idx] = np.arange(len(idx)) % n_folds
+    tasks = [(X, time, event, np.flatnonzero(fold_id != f), np.flatnonzero(fold_id == f), l1_ratio, lambdas)
+             for f in range(n_folds)]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, n_folds)
+    if n_jobs == 1:
+        results = [_coxnet_fold(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as ex:
+            results = list(ex.map(_coxnet_fold, tasks))
+    cvl = np.vstack([r[0] for r in results])
+    best = int(np.argmax(cvl.sum(axis=0)))
+    oof = np.empty(len(time))
+    for (_, _, _, _, test, _, _), (_, eta_test) in zip(tasks, results):
+        oof[test] = eta_test[:, best]
+    return {'path': full, 'lambdas': lambdas, 'cvl': cvl, 'best_index': best, 'best_lambda': float(lambdas[best]),
+            'coef': full['coefs'][best], 'oof_risk': oof}
+
+
+# ---------------------------------------------------------------------------
+# Discrimination: Harrell's C-index and time-dependent AUC
+# ---------------------------------------------------------------------------
+def concordance_index(time, event, risk):
+    """
+    Harrell's C-index in O(n log n): samples are swept from the longest follow-up down, and a
+    Fenwick tree over risk ranks counts, for each event, the later samples with lower (concordant)
+    or equal (half credit) risk. A death and a censoring at the same time are comparable (the censored
+    sample outlived it); two deaths at the same time are not. Higher risk = shorter survival.
+    """
+    time = np.asarray(time, dtype=float)
+    event = np.asarray(event).astype(bool)
+    ranks = np.unique(np.asarray(risk, dtype=float), return_inverse=True)[1] + 1
+    m = ranks.max()
+    tree = np.zeros(m + 1, dtype=np.int64)
+
+    def prefix(i):
+        s = 0
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    order = np.argsort(-time, kind='stable')
+    t_sorted = time[order]
+    block_starts = np.flatnonzero(np.r_[True, t_sorted[1:] != t_sorted[:-1]])
+    block_ends = np.r_[block_starts[1:], len(order)]
+    def add(block):
+        for i in block:
+            k = ranks[i]
+            while k <= m:
+                tree[k] += 1
+                k += k & -k
+
+    concordant = tied = comparable = 0.0
+    inserted = 0
+    for s, e in zip(block_starts, block_ends):
+        block = order[s:e]
+        deaths, censored = block[event[block]], block[~event[block]]
+        # A censored sample at the death time outlived it (Harrell / lifelines): insert before querying
+        add(censored)
+        inserted += len(censored)
+        for i in deaths:
+            less = prefix(ranks[i] - 1)
+            equal = prefix(ranks[i]) - less
+            concordant += less
+            tied += equal
+            comparable += inserted
+        add(deaths)
+        inserted += len(deaths)
+    return (concordant + 0.5 * tied) / comparable if comparable else np.nan
+
+
+def _censoring_survival(time, event):
+    """Kaplan–Meier estimate of the censoring distribution G(t−), evaluated at each sample's own time."""
+    surv = prepare_survival(time, 1 - np.asarray(event).astype(int))
+    t, c, n = surv['time'], surv['event'], surv['n']
+    uniq = np.unique(t)
+    lo = np.searchsorted(t, uniq, side='left')
+    hi = np.searchsorted(t, uniq, side='right')
+    cum_c = np.concatenate([[0], np.cumsum(c)])
+    factors = 1.0 - (cum_c[hi] - cum_c[lo]) / (n - lo)
+    G = np.cumprod(factors)
+    # Left limit at each sample's time: product over strictly earlier censoring times
+    G_left = np.r_[1.0, G[:-1]]
+    return G_left[np.searchsorted(uniq, np.asarray(time, dtype=float))]
+
+
+def time_dependent_auc(time, event, risk, times):
+    """
+    Cumulative/dynamic time-dependent AUC with inverse-probability-of-censoring weights (Uno et al. 2007):
+    cases are events up to t (weighted by 1/G(T_i−)), controls are samples still at risk after t.
+    Each horizon is one sorted-array comparison (searchsorted) of case risks against control risks.
+    """
+    time = np.asarray(time, dtype=float)
+    event = np.asarray(event).astype(bool)
+    risk = np.asarray(risk, dtype=float)
+    G = _censoring_survival(time, event)
+    out = []
+    for t in np.atleast_1d(times):
+        cases = event & (time <= t)
+        ctrl = np.sort(risk[time > t])
+        if not cases.any() or len(ctrl) == 0:
+            out.append(np.nan)
+            continue
+        w = 1.0 / np.maximum(G[cases], 1e-12)
+        r = risk[cases]
+        less = np.searchsorted(ctrl, r, side='left')
+        equal = np.searchsorted(ctrl, r, side='right') - less
+        out.append(float((w * (less + 0.5 * equal)).sum() / (w.sum() * len(ctrl))))
+    return np.array(out)
+
+
+# ---------------------------------------------------------------------------
+# Batched Kaplan–Meier / Nelson–Aalen
+# ---------------------------------------------------------------------------
+def kaplan_meier_batch(groups, time, event=None, alpha=0.05):
+    """
+    Kaplan–Meier and Nelson–Aalen estimates for many sample groups at once.
+
+    `groups` is a boolean matrix (groups × samples, original sample order). All groups share
+    one time-sorted event array: at-risk counts are reverse cumulative sums of the membership
+    matrix and event counts are cumulative sums differenced over tied times, so every curve is
+    evaluated on the common grid of distinct event times in one pass.
+
+    Returns dict with 'times' (T,), and groups × T arrays 'n_risk', 'n_event', 'survival',
+    'ci_lower', 'ci_upper' (Greenwood variance on the log(−log) scale, as lifelines),
+    'cum_hazard' and 'cum_hazard_var' (Nelson–Aalen), plus 'censor_times' (per-group arrays).
+    """
+    surv = time if isinstance(time, dict) else prepare_survival(time, event)
+    G = np.atleast_2d(np.asarray(groups, dtype=float))[:, surv['order']]
+    t, ev = surv['time'], surv['event']
+    times = np.unique(t[ev])
+    lo = np.searchsorted(t, times, side='left')
+    hi = np.searchsorted(t, times, side='right')
+    n_risk = np.cumsum(G[:, ::-1], axis=1)[:, ::-1][:, lo] if len(lo) else np.zeros((G.shape[0], 0))
+    cum_ev = np.concatenate([np.zeros((G.shape[0], 1)), np.cumsum(G * ev, axis=1)], axis=1)
+    d = cum_ev[:, hi] - cum_ev[:, lo]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hazard = np.where(n_risk > 0, d / n_risk, 0.0)
+        S = np.cumprod(1.0 - hazard, axis=1)
+        green = np.cumsum(np.where(n_risk > d, d / (n_risk * (n_risk - d)), np.where(d > 0, np.inf, 0.0)), axis=1)
+        z = stats.norm.ppf(1 - alpha / 2)
+        log_s = np.log(S)
+        v = green / log_s ** 2
+        loglog = np.log(-log_s)
+        lower = np.exp(-np.exp(loglog + z * np.sqrt(v)))
+        upper = np.exp(-np.exp(loglog - z * np.sqrt(v)))
+    # Before the first event (S = 1) the interval is degenerate at 1; after S hits 0 it is 0
+    lower = np.where(S >= 1, 1.0, np.where(S <= 0, 0.0, np.nan_to_num(lower)))
+    upper = np.where(S >= 1, 1.0, np.where(S <= 0, 0.0, np.nan_to_num(upper, nan=1.0)))
+
+    censored = (~ev)[None, :] & (G > 0)
+    return {
+        'times': times, 'n_risk': n_risk, 'n_event': d, 'survival': S,
+        'ci_lower': lower, 'ci_upper': upper,
+        'cum_hazard': np.cumsum(hazard, axis=1),
+        'cum_hazard_var': np.cumsum(np.where(n_risk > 0, d / np.maximum(n_risk, 1) ** 2, 0.0), axis=1),
+        'censor_times': [t[row] for row in censored],
+    }
+
+
+def km_step_arrays(km, k, t_max=None):
+    """(x, survival, lower, upper) step arrays for group k starting at (0, 1), truncated after the group's last follow-up."""
+    alive = km['n_risk'][k] > 0
+    x = np.r_[0.0, km['times'][alive]]
+    s = np.r_[1.0, km['survival'][k][alive]]
+    lo = np.r_[1.0, km['ci_lower'][k][alive]]
+    hi = np.r_[1.0, km['ci_upper'][k][alive]]
+    if t_max is not None:
+        x, s, lo, hi = np.r_[x, t_max], np.r_[s, s[-1]], np.r_[lo, lo[-1]], np.r_[hi, hi[-1]]
+    return x, s, lo, hi
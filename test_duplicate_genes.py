@@ -0,0 +1,136 @@
+import os
+import random
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+
+from master_bioinfo_suite import MasterBioinfoPipeline
+
+
+def _duplicated_cohort(n_genes=600, n_samples=24, seed=0):
+    """Counts with the duplicated symbols custom_geo_parser produces (random roots + numbers, seed 42)."""
+    random.seed(42)
+    roots = ['ZNF', 'SLC', 'FAM', 'CYP', 'KRT', 'COL', 'CXCL', 'IL', 'MMP', 'CD', 'HLA']
+    genes = [f"{random.choice(roots)}{random.randint(1, 60)}" for _ in range(n_genes)]
+    rng = np.random.default_rng(seed)
+    half = n_samples // 2
+    samples = [f"Ctrl_{i:02d}" for i in range(half)] + [f"Tumor_{i:02d}" for i in range(half)]
+    data = rng.lognormal(3, 1.0, size=(n_genes, n_samples))
+    data[:40, half:] *= 8.0   # up in tumour
+    data[40:80, half:] /= 8.0  # down in tumour
+    counts = pd.DataFrame(data, index=genes, columns=samples)
+    meta = pd.DataFrame({'Group': ['Healthy'] * half + ['Cancer'] * half}, index=samples)
+    assert counts.index.has_duplicates
+    return counts, meta
+
+
+def _pipeline():
+    counts, meta = _duplicated_cohort()
+    pipe = MasterBioinfoPipeline(out_dir=tempfile.mkdtemp())
+    pipe.run_pre_processing(custom_counts=counts, custom_meta=meta)
+    return pipe
+
+
+def test_dea_duplicated_index():
+    import matplotlib.pyplot as plt
+    pipe = _pipeline()
+    drawn = {}
+    save_fig = pipe._save_fig
+
+    def count_labels(name, *args):
+        drawn[name] = len(plt.gca().texts)
+        return save_fig(name, *args)
+
+    pipe._save_fig = count_labels
+    pipe.run_dea(label_top=5)
+    # Exactly the top-5 Up / Down rows are labelled, not every copy of their symbols
+    n_up, n_down = (pipe.res_df['Sig'] == 'Up').sum(), (pipe.res_df['Sig'] == 'Down').sum()
+    assert drawn["Fig2_Volcano"] == min(5, n_up) + min(5, n_down) <= 10
+    assert len(pipe.res_df) == len(pipe.log_cpm)
+    assert (pipe.res_df['Sig'] != 'NS').sum() > 0
+    assert any(img['path'] == "Fig2_Volcano.png" for img in pipe.report_images)
+    print("DEA on duplicated index OK")
+
+
+def test_heatmap_duplicated_index():
+    pipe = _pipeline()
+    pipe.run_dea(label_top=0)
+    pipe.run_deg_heatmap(n_top=25)
+    pipe.run_deg_heatmap(n_top=10)  # reuses the pool distance matrix
+    assert any(img['path'] == "Fig4_Heatmap.png" for img in pipe.report_images)
+    assert len(pipe._heatmap_cache['linkage']) == 2
+
+    # No DEGs: exploratory (top variance) pool is also positional
+    pipe.classify_degs(p_thresh=0.0)
+    pipe.run_deg_heatmap(n_top=10)
+    print("Heatmap on duplicated index OK")
+
+
+def test_wgcna_duplicated_index():
+    pipe = _pipeline()
+    pipe.run_wgcna_lite(max_genes=300, min_module_size=10)
+    assert pipe.wgcna_modules.index.is_unique
+    assert len(pipe.wgcna_modules) == len(pipe.wgcna_connectivity) == 300
+    print("WGCNA on duplicated index OK")
+
+
+def test_deconvolution_duplicated_index():
+    import deconvolution_engine as de
+    pipe = _pipeline()
+    de.DEFAULT_CACHE_DIR = os.path.join(pipe.out_dir, "cache")  # keep the permutation null out of ~
+    # Case-colliding copy of a symbol on top of the parser's exact duplicates
+    pipe.log_cpm.index = [g.lower() if i == 5 else g for i, g in enumerate(pipe.log_cpm.index)]
+    genes = sorted(set(g.upper() for g in pipe.log_cpm.index))[:40]
+    rng = np.random.default_rng(1)
+    sig = pd.DataFrame(rng.gamma(2.0, 50.0, size=(len(genes), 4)), index=genes,
+                       columns=[f"Cell_{k}" for k in range(4)])
+    sig_path = os.path.join(pipe.out_dir, "LM22_stub.txt")
+    sig.to_csv(sig_path, sep='\t')
+
+    pipe.run_cibersort_lite(signature_path=sig_path, n_jobs=1, n_perm=50)
+    frac = pipe.immune_fractions
+    assert frac.shape == (pipe.log_cpm.shape[1], 4)
+    assert np.allclose(frac.sum(axis=1), 1.0)
+    print("Deconvolution on duplicated index OK")
+
+
+def test_model_bundle_duplicated_index():
+    import ml_engine as me
+    pipe = _pipeline()
+    pipe.run_dea(label_top=0)
+    pipe.run_advanced_ml(n_trees=50, nested_cv=False, tune=False, stability=False)
+    bundle = me.load_model_bundle(pipe.model_bundle_path)
+    assert len(bundle['gene_map']) == len(bundle['features']) == len(bundle['scaler_mean'])
+    scores, report = me.score_expression(bundle, pipe.log_cpm)
+    assert len(scores) == pipe.log_cpm.shape[1] and report['n_missing'] == 0
+    print("Model bundle on duplicated index OK")
+
+
+def test_meta_analysis_duplicated_index():
+    import meta_engine as mt
+    pipe = _pipeline()
+    pipe.run_dea(label_top=0)
+    other = _pipeline()
+    # Mixed-case copies of a symbol on top of the parser's exact duplicates
+    other.log_cpm.index = [g.capitalize() if i % 50 == 0 else g for i, g in enumerate(other.log_cpm.index)]
+    other.compute_dea_stats()
+    assert other.res_df.index.str.upper().has_duplicates
+
+    table = pipe.run_meta_analysis(other_results=[other], labels=["Cohort_B"])
+    assert table.index.is_unique
+    genes, arr, _ = mt.align_cohorts([pipe.res_df, other.res_df], min_cohorts=1)
+    assert len(genes) == pipe.res_df.index.str.upper().nunique()
+    dup = pipe.res_df.index[pipe.res_df.index.duplicated()][0]
+    assert np.isclose(arr['log2FC'][0, genes.get_loc(dup)], pipe.res_df.loc[dup, 'log2FC'].mean())
+    print("Meta-analysis on duplicated index OK")
+
+
+if __name__ == "__main__":
+    test_dea_duplicated_index()
+    test_heatmap_duplicated_index()
+    test_wgcna_duplicated_index()
+    test_deconvolution_duplicated_index()
+    test_model_bundle_duplicated_index()
+    test_meta_analysis_duplicated_index()
@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+import enrichment_engine as ee
+import enrichr_stub
+
+
+def test_enrichment_cache():
+    work = tempfile.mkdtemp()
+    gmt_dir = os.path.join(work, "gmt")
+    os.makedirs(gmt_dir)
+    rng = np.random.default_rng(0)
+    with open(os.path.join(gmt_dir, "Stub_Library_2024.gmt"), "w") as f:
+        for s in range(200):
+            genes = rng.choice(2000, 40, replace=False)
+            f.write(f"TERM_{s}\t\t" + "\t".join(f"G{i}" for i in genes) + "\n")
+
+    server, url = enrichr_stub.serve(gmt_dir)
+    import requests
+    up, down = [f"G{i}" for i in range(60)], [f"G{i}" for i in range(60, 150)]
+    queries = [(up, "Stub_Library_2024"), (down, "Stub_Library_2024")]
+    cache_dir = os.path.join(work, "cache")
+    try:
+        first = ee.enrich_many(queries, cache_dir=cache_dir, url=url)
+        assert all(not isinstance(r, Exception) and not r.cached for r in first), first
+        assert requests.get(f"{url}/stats").json()['export'] == 2
+
+        # Same lists in another order / case: in-process hits, server never contacted again
+        again = ee.enrich_many([(list(reversed(up)), "Stub_Library_2024"), ([g.lower() for g in down], "Stub_Library_2024")],
+                               cache_dir=cache_dir, url=url)
+        assert all(r.cached for r in again)
+        assert requests.get(f"{url}/stats").json()['export'] == 2
+        assert first[0].results.equals(again[0].results)
+
+        # Fresh process state: hits come from disk
+        ee._RESULTS.clear()
+        disk = ee.enrich_cached(up, "Stub_Library_2024", cache_dir=cache_dir, url=url)
+        assert disk.cached and requests.get(f"{url}/stats").json()['export'] == 2
+
+        # Stub output matches the offline engine
+        local = ee.enrich(ee.load_library(os.path.join(gmt_dir, "Stub_Library_2024.gmt")), up).results
+        assert np.allclose(local['P-value'].values, first[0].results['P-value'].values)
+
+        # Transient failure (empty 200 response) is not cached: the next call retries and succeeds
+        ee._RESULTS.clear()
+        enrichr_stub.EnrichrStub.failures = 1
+        fail = ee.enrich_many([(up[:40], "Stub_Library_2024")], cache_dir=cache_dir, url=url)[0]
+        assert isinstance(fail, ValueError)
+        retry = ee.enrich_cached(up[:40], "Stub_Library_2024", cache_dir=cache_dir, url=url)
+        assert not retry.cached and not retry.results.empty
+        assert ee.enrich_cached(up[:40], "Stub_Library_2024", cache_dir=cache_dir, url=url).cached
+
+        # Gene list with no annotated genes: empty result is returned but not persisted
+        n_before = requests.get(f"{url}/stats").json()['export']
+        for _ in range(2):
+            empty = ee.enrich_cached(["NOT_A_GENE"], "Stub_Library_2024", cache_dir=cache_dir, url=url)
+            assert empty.results.empty and not empty.cached
+        assert requests.get(f"{url}/stats").json()['export'] == n_before + 2
+
+        # LRU size cap: a zero-MB cap keeps nothing on disk
+        ee._RESULTS.clear()
+        ee.enrich_cached(up[:30], "Stub_Library_2024", cache_dir=cache_dir, url=url, max_mb=0)
+        assert not [f for f in os.listdir(cache_dir) if f.endswith('.pkl')]
+    finally:
+        server.shutdown()
+    print("Enrichment cache OK")
+
+
+if __name__ == "__main__":
+    test_enrichment_cache()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Enrichr REST API (addList / export) backed by local GMT libraries.
+
+Lets the enrichment step and its result cache be exercised offline:
+
+    python tools/enrichr_stub.py --gmt-dir genesets --port 5055
+    OPENCLAW_ENRICHR_URL=http://127.0.0.1:5055 python master_bioinfo_suite.py
+
+GET /stats returns the number of addList / export calls served, so tests can check that
+cache hits never reach the server. Setting EnrichrStub.failures = n makes the next n exports
+answer HTTP 200 with an empty body, like a transient Enrichr failure.
+"""
+
+import argparse
+import email
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import enrichment_engine as ee
+
+
+class EnrichrStub(BaseHTTPRequestHandler):
+    lists = {}
+    calls = {'addList': 0, 'export': 0}
+    failures = 0
+    gmt_dir = None
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type='application/json', status=200):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/addList':
+            return self._send(json.dumps({'error': 'not found'}), status=404)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        msg = email.message_from_bytes(b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+        fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode()
+                  for part in msg.get_payload()}
+        with self.lock:
+            self.calls['addList'] += 1
+            list_id = len(self.lists) + 1
+            self.lists[list_id] = [g for g in fields.get('list', '').split('\n') if g.strip()]
+        self._send(json.dumps({'userListId': list_id, 'shortId': f"stub{list_id}"}))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._send(json.dumps(self.calls))
+        if url.path != '/export':
+            return self._send(json.dumps({'error': 'not found'}), status=404)
+        q = parse_qs(url.query)
+        with self.lock:
+            self.calls['export'] += 1
+            genes = self.lists.get(int(q['userListId'][0]), [])
+            fail = self.failures > 0
+            if fail:
+                EnrichrStub.failures -= 1
+        if fail:
+            return self._send('', content_type='text/plain')
+        library = q['backgroundType'][0]
+        path = ee.library_path(library, self.gmt_dir)
+        if path is None:
+            return self._send(json.dumps({'error': f"unknown library {library}"}), status=404)
+        res = ee.enrich(ee.load_library(path), genes).results
+        self._send(res.drop(columns='Gene_set').to_csv(sep='\t', index=False), content_type='text/plain')
+
+
+def serve(gmt_dir, host='127.0.0.1', port=0):
+    """Start the stub in a background thread; returns (server, base_url)."""
+    EnrichrStub.gmt_dir = gmt_dir
+    server = ThreadingHTTPServer((host, port), EnrichrStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gmt-dir', default=ee.GENESET_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+    server, url = serve(args.gmt_dir, args.host, args.port)
+    print(f"[*] Enrichr stub serving {args.gmt_dir} at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
+
+VOLCANO_PALETTE = {'Up': '#E64B35', 'Down': '#4DBBD5', 'NS': '#999999'}
+
+
+def render_volcano(res_df, p_col, sig_col='Sig', fc_col='log2FC', ax=None, label_genes=None, label_pos=None,
+                   p_thresh=None, fc_thresh=None, palette=None, density_min_points=5000,
+                   gridsize=150, point_size=40, label_size=8):
+    """
+    Fast volcano renderer for large gene sets.
+
+    Non-significant genes are the bulk of the points (tens of thousands on arrays/RNA-seq),
+    so they are drawn as one 2D-binned density layer (hexbin) or, for small sets, as a
+    rasterized scatter. Only significant and explicitly labelled genes are drawn as vector
+    markers. adjustText is imported only when labels are requested.
+
+    label_pos labels exactly those row positions; label_genes labels every row carrying one of
+    the given symbols (all copies of a duplicated symbol).
+    """
+    ax = ax or plt.gca()
+    palette = palette or VOLCANO_PALETTE
+    x = res_df[fc_col].values.astype(float)
+    # Clip p = 0 so -log10 stays finite
+    y = -np.log10(np.clip(res_df[p_col].values.astype(float), 1e-300, None))
+    sig = res_df[sig_col].values
+
+    # --- Background layer: non-significant genes ---
+    ns = (sig == 'NS') & np.isfinite(x) & np.isfinite(y)
+    handles = []
+    if ns.sum() >= density_min_points:
+        ax.hexbin(x[ns], y[ns], gridsize=gridsize, bins='log', mincnt=1, cmap='Greys',
+                  linewidths=0, rasterized=True, zorder=1)
+        handles.append(Patch(facecolor=palette['NS'], label='NS (density)'))
+    elif ns.any():
+        ax.scatter(x[ns], y[ns], s=point_size, c=palette['NS'], alpha=0.7, edgecolors='none',
+                   rasterized=True, zorder=1, label='NS')
+
+    # --- Foreground layer: significant genes as vector markers ---
+    for level in ['Up', 'Down']:
+        m = sig == level
+        if m.any():
+            ax.scatter(x[m], y[m], s=point_size, c=palette[level], alpha=0.7, edgecolors='none',
+                       zorder=2, label=level)
+
+    if p_thresh is not None:
+        ax.axhline(-np.log10(p_thresh), color='gray', linestyle='--', linewidth=1)
+    if fc_thresh is not None:
+        ax.axvline(fc_thresh, color='gray', linestyle='--', linewidth=1)
+        ax.axvline(-fc_thresh, color='gray', linestyle='--', linewidth=1)
+
+    # --- Labels (only when requested) ---
+    if label_pos is None and label_genes is not None:
+        # Boolean mask rather than get_indexer: GEO-mapped symbols are often duplicated
+        label_pos = np.flatnonzero(res_df.index.isin(list(label_genes)))
+    if label_pos is not None and len(label_pos) > 0:
+        pos = np.asarray(label_pos, dtype=int)
+        # Labelled genes are always drawn as vector markers, even when NS
+        lab_ns = pos[sig[pos] == 'NS']
+        if len(lab_ns):
+            ax.scatter(x[lab_ns], y[lab_ns], s=point_size, c=palette['NS'], edgecolors='black',
+                       linewidths=0.5, zorder=3)
+        texts = [ax.text(x[i], y[i], res_df.index[i], fontweight='bold', size=label_size, zorder=4) for i in pos]
+        try:
+            from adjustText import adjust_text
+            adjust_text(texts, ax=ax)
+        except ImportError:
+            pass
+
+    h, _ = ax.get_legend_handles_labels()
+    ax.legend(handles=handles + h, frameon=False, loc='upper right')
+    return ax